@@ -0,0 +1,85 @@
+'''
+    Measures the throughput of the thread pool and asyncio iterators against prsample_iterator for an I/O bound
+    get_example_from_obj, simulated by sleeping for a fixed time per example.
+
+    Usage, with prsample installed or on PYTHONPATH:
+        python benchmarks/bench_loaders.py [--latency SECONDS] [--batches N] [--json PATH]
+'''
+import argparse
+import asyncio
+import json
+import time
+
+import prsample as prs
+import prsample.examples as prse
+
+def build_class_list(class_count, objects_per_class):
+    return [[str(class_no * objects_per_class + i) for i in range(objects_per_class)] for class_no in range(class_count)]
+
+def make_fetchers(latency):
+
+    def get_example_from_obj(index, class_list, cumsum_examples_per_class):
+        time.sleep(latency)
+        return prse.Single_Example.get_example_from_obj(index, class_list, cumsum_examples_per_class)
+
+    async def get_example_from_obj_async(index, class_list, cumsum_examples_per_class):
+        await asyncio.sleep(latency)
+        return prse.Single_Example.get_example_from_obj(index, class_list, cumsum_examples_per_class)
+
+    return get_example_from_obj, get_example_from_obj_async
+
+def time_batches(batches, batch_count):
+    start = time.perf_counter()
+    for batch_no, batch in enumerate(batches):
+        if batch_no + 1 == batch_count:
+            break
+    return time.perf_counter() - start
+
+def run(latency = 0.001, batch_count = 8, examples_per_batch = 64, class_count = 100, objects_per_class = 100):
+    get_example_from_obj, get_example_from_obj_async = make_fetchers(latency)
+    p = prs.prsample(build_class_list(class_count, objects_per_class), examples_per_batch, \
+        prse.Single_Example.examples_per_obj, get_example_from_obj)
+    batch_count = min(batch_count, p.__len__())
+    example_count = batch_count * examples_per_batch
+
+    results = []
+    def record(loader, seconds, **params):
+        results.append(dict(benchmark = 'loaders', loader = loader, latency = latency, \
+            examples_per_batch = examples_per_batch, seconds = seconds, examples_per_second = example_count / seconds, **params))
+
+    record('prsample_iterator', time_batches(iter(p), batch_count))
+
+    for num_threads in [4, 16, 64]:
+        with p.threaded(num_threads = num_threads) as batches:
+            record('threaded', time_batches(batches, batch_count), num_threads = num_threads)
+
+    for concurrency in [16, 64, 256]:
+        async def consume():
+            batches = p.aiter(get_example_from_obj_async, concurrency = concurrency)
+            start = time.perf_counter()
+            batch_no = 0
+            async for batch in batches:
+                batch_no += 1
+                if batch_no == batch_count:
+                    break
+            seconds = time.perf_counter() - start
+            await batches.aclose()
+            return seconds
+        record('aiter', asyncio.run(consume()), concurrency = concurrency)
+
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--latency', type = float, default = 0.001)
+    parser.add_argument('--batches', type = int, default = 8)
+    parser.add_argument('--json', default = None)
+    args = parser.parse_args()
+
+    results = run(latency = args.latency, batch_count = args.batches)
+    for r in results:
+        print('{:<20} {:>12.1f} examples/s  {}'.format(r['loader'], r['examples_per_second'], \
+            {k : r[k] for k in ('num_threads', 'concurrency') if k in r}))
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent = 2)
@@ -0,0 +1,113 @@
+'''
+    Measures the trade between randomness and I/O locality of locality_window on a dataset of one file per object,
+    read back with the page cache dropped for the files before each run:
+
+        examples_per_second     the throughput of reading the files of the first --max-examples examples of an
+                                epoch, in batch order
+        mean_jump               the mean distance between the example indices of consecutive batch slots, over the
+                                epoch, relative to that of a uniformly random order, i.e. about 1 when random and
+                                near 0 when in storage order
+        classes_per_batch       the mean number of distinct classes per batch, relative to the batch size
+
+    Dropping the page cache uses posix_fadvise, so on systems without it the files are read from the page cache and
+    only the randomness measures are meaningful.
+
+    Usage, with prsample installed or on PYTHONPATH:
+        python benchmarks/bench_locality.py [--quick] [--dir PATH] [--object-bytes N] [--max-examples N] [--json PATH]
+'''
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+import prsample as prs
+import prsample.examples as prse
+
+def write_dataset(path, class_count, objects_per_class, object_bytes):
+    rng = np.random.default_rng(0)
+    class_list = []
+    for class_no in range(class_count):
+        class_dir = os.path.join(path, str(class_no))
+        os.makedirs(class_dir, exist_ok = True)
+        object_list = []
+        for obj_idx in range(objects_per_class):
+            file_name = os.path.join(class_dir, str(obj_idx) + '.bin')
+            with open(file_name, 'wb') as f:
+                f.write(rng.bytes(object_bytes))
+            object_list.append(file_name)
+        class_list.append(object_list)
+    return class_list
+
+def drop_page_cache(class_list):
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    for object_list in class_list:
+        for file_name in object_list:
+            fd = os.open(file_name, os.O_RDONLY)
+            try:
+                os.fdatasync(fd)
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            finally:
+                os.close(fd)
+
+def read_file(file_name):
+    with open(file_name, 'rb') as f:
+        return f.read()
+
+def randomness(p):
+    E, L, T = p.examples_per_batch, p.examples_per_batch_index, int(p.total_example_count)
+    idx, is_valid = p.get_batch_indices(np.arange(L))
+    sequence = idx.reshape(-1)[is_valid.reshape(-1)]
+    # The mean of |x - y| for x and y uniform over T indices is about T/3
+    mean_jump = np.mean(np.abs(np.diff(sequence))) / (T / 3) if len(sequence) > 1 else 0.0
+    class_no = np.asarray(p._flat_index['class_no'])[np.searchsorted(p._cumsum_examples_per_class, idx, \
+        side = 'right') - 1]
+    classes_per_batch = np.mean([len(set(row.tolist())) for row in class_no]) / E
+    return float(mean_jump), float(classes_per_batch)
+
+def run(path, class_count = 64, objects_per_class = 64, object_bytes = 64 << 10, examples_per_batch = 32, \
+        windows = (None, 1, 16, 256, 4096), max_examples = 4096):
+    class_list = write_dataset(path, class_count, objects_per_class, object_bytes)
+    results = []
+    for locality_window in windows:
+        record = dict(locality_window = locality_window, class_count = class_count, \
+            objects_per_class = objects_per_class, object_bytes = object_bytes, examples_per_batch = examples_per_batch)
+        p = prs.prsample(class_list, examples_per_batch, prse.Single_Example, no_duplicated_data = True, \
+            locality_window = locality_window)
+        record['mean_jump'], record['classes_per_batch'] = randomness(p)
+
+        drop_page_cache(class_list)
+        batch_count = max(1, min(len(p), max_examples // examples_per_batch))
+        start = time.perf_counter()
+        example_count = 0
+        for batch_no in range(batch_count):
+            for row in p._get_batch(batch_no):
+                if row[0] >= 0:
+                    read_file(class_list[row[0]][row[1]])
+                    example_count += 1
+        seconds = time.perf_counter() - start
+        record['examples'] = example_count
+        record['examples_per_second'] = example_count / seconds
+        results.append(record)
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--quick', action = 'store_true', help = 'a small dataset')
+    parser.add_argument('--dir', default = None, help = 'where to write the dataset, by default a temporary directory')
+    parser.add_argument('--object-bytes', type = int, default = 64 << 10)
+    parser.add_argument('--max-examples', type = int, default = 4096)
+    parser.add_argument('--json', default = None)
+    args = parser.parse_args()
+
+    grid = dict(class_count = 16, objects_per_class = 16, windows = (None, 1, 16, 256)) if args.quick else {}
+    with tempfile.TemporaryDirectory(dir = args.dir) as path:
+        results = run(path, object_bytes = args.object_bytes, max_examples = args.max_examples, **grid)
+    for r in results:
+        print('locality_window {:>6}  mean_jump {:>5.2f}  classes_per_batch {:>5.2f}  {:>10.0f} examples/s'.format( \
+            str(r['locality_window']), r['mean_jump'], r['classes_per_batch'], r['examples_per_second']))
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent = 2)
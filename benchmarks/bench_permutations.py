@@ -0,0 +1,83 @@
+'''
+    Compares the mapping from batch slots to example indices of the default coprime stride per batch_index with the
+    permutation classes of prsample.permutations, over a range of example counts:
+
+        init_seconds            a further init_prsample, including the stride search or the drawing of the keys
+        ns_per_index            the time of get_batch_indices per batch slot, over the first --max-slots slots
+        pair_chi_square         the chi square, per degree of freedom, of the 8x8 buckets of the example indices of
+                                consecutive slots, batch after batch, against independent uniform draws. About 1 when
+                                random and far larger when consecutive indices are related
+        lag_correlation         the correlation of the example indices a batch apart in the same batch_index
+        distinct_steps          the number of distinct differences between the example indices of consecutive
+                                batches in the same batch_index, relative to the number of differences
+
+    Usage, with prsample installed or on PYTHONPATH:
+        python benchmarks/bench_permutations.py [--quick] [--max-slots N] [--json PATH]
+'''
+import argparse
+import json
+import time
+
+import numpy as np
+import prsample as prs
+import prsample.examples as prse
+import prsample.permutations as prp
+
+permutations = [None, prp.affine_permutation, prp.feistel_permutation]
+
+def pair_chi_square(sequence, size, buckets = 8):
+    bucket = sequence * buckets // size
+    counts = np.bincount(bucket[:-1] * buckets + bucket[1:], minlength = buckets * buckets)
+    expected = (len(sequence) - 1) / (buckets * buckets)
+    return float(np.sum((counts - expected) ** 2 / expected) / (buckets * buckets - 1))
+
+def randomness(p, batch_count):
+    T = int(p.total_example_count)
+    idx, is_valid = p.get_batch_indices(np.arange(batch_count))
+    sequence = idx.reshape(-1)[is_valid.reshape(-1)]
+    # Each batch_index on its own, from batch to batch
+    lanes = idx[:, 0][is_valid[:, 0]]
+    steps = np.diff(lanes) % T
+    return pair_chi_square(sequence, T), float(np.corrcoef(lanes[:-1], lanes[1:])[0, 1]), \
+        len(set(steps.tolist())) / max(1, len(steps))
+
+def run(example_counts = (10**4, 10**6, 10**8), examples_per_batch = 256, max_slots = 1 << 20):
+    results = []
+    for example_count in example_counts:
+        # One class with an ordered pair example per pair of objects, so that few objects give many examples
+        class_list = [list(range(int(round(example_count ** 0.5))))]
+        for permutation in permutations:
+            p = prs.prsample(class_list, examples_per_batch, prse.Ordered_In_Class_Pair_Example, \
+                no_duplicated_data = True, shuffle = False, permutation = permutation)
+            record = dict(permutation = 'stride' if permutation is None else permutation.__name__, \
+                example_count = int(p.total_example_count), examples_per_batch = examples_per_batch)
+
+            start = time.perf_counter()
+            p.init_prsample()
+            record['init_seconds'] = time.perf_counter() - start
+
+            batch_count = max(2, min(len(p), max_slots // examples_per_batch))
+            start = time.perf_counter()
+            p.get_batch_indices(np.arange(batch_count))
+            record['ns_per_index'] = (time.perf_counter() - start) / (batch_count * examples_per_batch) * 1e9
+
+            record['pair_chi_square'], record['lag_correlation'], record['distinct_steps'] = randomness(p, batch_count)
+            results.append(record)
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--quick', action = 'store_true', help = 'a single example count')
+    parser.add_argument('--max-slots', type = int, default = 1 << 20)
+    parser.add_argument('--json', default = None)
+    args = parser.parse_args()
+
+    grid = dict(example_counts = (10**5,)) if args.quick else {}
+    results = run(max_slots = args.max_slots, **grid)
+    for r in results:
+        print('{:<20} T {:>10}  init {:>8.4f}s  {:>7.1f}ns/index  pair chi2 {:>10.2f}  lag corr {:>6.3f}  '
+            'distinct steps {:>5.3f}'.format(r['permutation'], r['example_count'], r['init_seconds'], \
+            r['ns_per_index'], r['pair_chi_square'], r['lag_correlation'], r['distinct_steps']))
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent = 2)
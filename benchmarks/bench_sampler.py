@@ -0,0 +1,117 @@
+'''
+    Measures prsample itself for every example class in prsample.examples, over a grid of class counts, uniform
+    and skewed objects per class, examples_per_batch and no_duplicated_data:
+
+        init_seconds            constructing the prsample, which runs the first init_prsample
+        reinit_seconds          a further init_prsample, as at the start of each epoch
+        find_batch_strides_seconds
+        get_example_seconds     the mean latency of get_example for random batch slots
+        examples_per_second     the throughput of prsample_iterator over an epoch, or over the first
+                                --max-epoch-examples examples of it
+        peak_bytes              the peak memory traced by tracemalloc while constructing the prsample
+
+    Usage, with prsample installed or on PYTHONPATH:
+        python benchmarks/bench_sampler.py [--quick] [--latency-samples N] [--max-epoch-examples N] [--json PATH]
+'''
+import argparse
+import json
+import time
+import tracemalloc
+
+import numpy as np
+import prsample as prs
+import prsample.examples as prse
+
+example_classes = [
+    prse.Single_Example,
+    prse.Ordered_In_Class_Pair_Example,
+    prse.Unordered_In_Class_Pair_Example,
+    prse.Unordered_Out_of_Class_Pair_Example,
+    prse.Pos_Anc_Neg_Triplet_Example,
+    ]
+
+def build_class_list(class_count, mean_objects_per_class, distribution):
+    if distribution == 'uniform':
+        objects_per_class = [mean_objects_per_class] * class_count
+    else:
+        # Zipf like: class i holds objects in proportion to 1/(i+1), with at least 2 objects per class
+        weights = 1.0 / np.arange(1, class_count + 1)
+        objects_per_class = np.maximum(2, np.round(weights / weights.mean() * mean_objects_per_class)).astype(int)
+    return [[str(class_no) + '/' + str(i) for i in range(n)] for class_no, n in enumerate(objects_per_class)]
+
+def time_call(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+def time_epoch(p, max_examples):
+    batch_count = max(1, min(len(p), max_examples // p.examples_per_batch))
+    start = time.perf_counter()
+    for batch_no, batch in enumerate(p):
+        if batch_no + 1 == batch_count:
+            break
+    seconds = time.perf_counter() - start
+    return batch_count, seconds
+
+def run(class_counts = (10, 1000), objects_per_class = (10, 100), batch_sizes = (32, 1024), \
+        latency_samples = 1000, max_epoch_examples = 100000):
+    rng = np.random.default_rng(0)
+    results = []
+    for example_class in example_classes:
+        for class_count in class_counts:
+            for mean_objects_per_class in objects_per_class:
+                for distribution in ['uniform', 'skewed']:
+                    class_list = build_class_list(class_count, mean_objects_per_class, distribution)
+                    for examples_per_batch in batch_sizes:
+                        for no_duplicated_data in [False, True]:
+                            record = dict(example_class = example_class.__name__, class_count = class_count, \
+                                objects_per_class = mean_objects_per_class, distribution = distribution, \
+                                examples_per_batch = examples_per_batch, no_duplicated_data = no_duplicated_data)
+
+                            tracemalloc.start()
+                            start = time.perf_counter()
+                            p = prs.prsample(class_list, examples_per_batch, example_class, \
+                                no_duplicated_data = no_duplicated_data)
+                            record['init_seconds'] = time.perf_counter() - start
+                            record['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+                            tracemalloc.stop()
+
+                            record['total_example_count'] = int(p.total_example_count)
+                            record['examples_per_batch_index'] = int(p.examples_per_batch_index)
+                            record['reinit_seconds'] = time_call(p.init_prsample)
+                            record['find_batch_strides_seconds'] = time_call(p._find_batch_strides, \
+                                p.examples_per_batch, p.examples_per_batch_index)
+
+                            slots = zip(rng.integers(len(p), size = latency_samples).tolist(), \
+                                rng.integers(examples_per_batch, size = latency_samples).tolist())
+                            start = time.perf_counter()
+                            for batch_no, batch_index in slots:
+                                p.get_example(batch_no, batch_index)
+                            record['get_example_seconds'] = (time.perf_counter() - start) / latency_samples
+
+                            batch_count, seconds = time_epoch(p, max_epoch_examples)
+                            record['epoch_batches'] = batch_count
+                            record['full_epoch'] = batch_count == len(p)
+                            record['examples_per_second'] = batch_count * examples_per_batch / seconds
+                            results.append(record)
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--quick', action = 'store_true', help = 'a single small configuration per example class')
+    parser.add_argument('--latency-samples', type = int, default = 1000)
+    parser.add_argument('--max-epoch-examples', type = int, default = 100000)
+    parser.add_argument('--json', default = None)
+    args = parser.parse_args()
+
+    grid = dict(class_counts = (10,), objects_per_class = (10,), batch_sizes = (32,)) if args.quick else {}
+    results = run(latency_samples = args.latency_samples, max_epoch_examples = args.max_epoch_examples, **grid)
+    for r in results:
+        print('{:<36} C {:>5} N {:>4} {:<7} E {:>5} {:<5}  init {:>8.4f}s  strides {:>8.4f}s  get_example {:>6.1f}us  '
+            '{:>10.0f} examples/s  peak {:>8.1f}MB'.format(r['example_class'], r['class_count'], r['objects_per_class'], \
+            r['distribution'], r['examples_per_batch'], str(r['no_duplicated_data']), r['init_seconds'], \
+            r['find_batch_strides_seconds'], r['get_example_seconds'] * 1e6, r['examples_per_second'], \
+            r['peak_bytes'] / 2**20))
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent = 2)
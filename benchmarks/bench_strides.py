@@ -0,0 +1,76 @@
+'''
+    Measures the time taken by prsample._find_batch_strides for batch sizes up to 64k, against the previous
+    implementation, which drew candidates from the global RNG and stepped forward one integer at a time until
+    it found an unused coprime.
+
+    Usage, with prsample installed or on PYTHONPATH:
+        python benchmarks/bench_strides.py [--max-legacy-batch N] [--json PATH]
+'''
+import argparse
+import json
+import time
+from math import gcd
+
+import numpy as np
+import prsample as prs
+import prsample.examples as prse
+
+def legacy_find_batch_strides(examples_per_batch, examples_per_batch_index):
+    batch_strides = np.empty(examples_per_batch, dtype = int)
+    existing_strides = []
+    for batch_index in range(examples_per_batch):
+        stride = np.random.randint(2, examples_per_batch_index)
+
+        init_stride = stride
+        while gcd(stride, examples_per_batch_index) != 1 or stride in existing_strides:
+            stride += 1
+            stride = stride % examples_per_batch_index
+            if stride < 2:
+                stride = 2
+
+            if stride == init_stride:
+                existing_strides = []
+
+        existing_strides.append(stride)
+
+        if len(existing_strides) == examples_per_batch:
+            existing_strides = []
+        batch_strides[batch_index] = stride
+    offsets = np.random.randint(0, examples_per_batch_index, batch_strides.shape)
+    return batch_strides, offsets
+
+def time_call(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+def run(max_legacy_batch = 4096):
+    p = prs.prsample([], 0, prse.Single_Example)
+
+    results = []
+    for examples_per_batch in [64, 256, 1024, 4096, 16384, 65536]:
+        # A few batch counts per batch size: a small dataset, a prime, a number with many small prime factors
+        # and so few units, and a large dataset
+        for examples_per_batch_index in [examples_per_batch // 2 + 3, 1000003, 2 * 3 * 5 * 7 * 11 * 13 * 17 * 19, 2**40 + 15]:
+            record = dict(benchmark = 'find_batch_strides', examples_per_batch = examples_per_batch, \
+                examples_per_batch_index = examples_per_batch_index, \
+                seconds = time_call(p._find_batch_strides, examples_per_batch, examples_per_batch_index))
+            if examples_per_batch <= max_legacy_batch:
+                record['legacy_seconds'] = time_call(legacy_find_batch_strides, examples_per_batch, examples_per_batch_index)
+            results.append(record)
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--max-legacy-batch', type = int, default = 4096)
+    parser.add_argument('--json', default = None)
+    args = parser.parse_args()
+
+    results = run(max_legacy_batch = args.max_legacy_batch)
+    for r in results:
+        print('examples_per_batch {:>6} examples_per_batch_index {:>14}  {:>10.4f}s  legacy {}'.format( \
+            r['examples_per_batch'], r['examples_per_batch_index'], r['seconds'], \
+            '{:.4f}s'.format(r['legacy_seconds']) if 'legacy_seconds' in r else '-'))
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent = 2)
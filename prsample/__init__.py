@@ -1,4 +1,12 @@
 from .prsample import prsample
 from .prsample import get_obj_idx_from_index
 from .prsample import get_class_idx_from_index
+from .prsample import get_obj_idx_from_indices
+from .prsample import get_class_idx_from_indices
+from .prsample import get_class_obj_idx_from_indices
+from .prsample import get_prime_factors
+from .prsample import build_class_list_from_class_dirs
+from .stats import prsample_stats
+from .cache import object_cache
+from .cache import shared_object_cache
 from .version import __version__
\ No newline at end of file
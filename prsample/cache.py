@@ -0,0 +1,355 @@
+import sys
+import numpy as np
+import threading
+from collections import OrderedDict
+
+def _size_of(payload):
+    '''
+        Returns the size in bytes of a loaded object, the nbytes of NumPy arrays and the length of bytes.
+    '''
+    if hasattr(payload, 'nbytes'):
+        return int(payload.nbytes)
+    if isinstance(payload, (bytes, bytearray, memoryview)):
+        return len(payload)
+    return sys.getsizeof(payload)
+
+class object_cache():
+    '''
+        A cache of loaded objects keyed on (class_no, obj_idx), holding at most max_bytes of them and evicting the
+        least recently used first. Pass an instance as the object_loader argument of prsample so that the examples
+        that share an object, as pairs and triplets do, load it once. It can be used from several threads.
+
+        Two threads that miss on the same object at once both load it, the second result replacing the first.
+        Copies of the cache, such as those sent to the worker processes of prefetch, start empty.
+    '''
+    def __init__(self, load_object, max_bytes, size_of = None):
+        """
+            Args:
+                load_object: A function that given an object of the class list returns its loaded form.
+                max_bytes: The maximum total size of the loaded objects held. An object larger than this is
+                    returned without being cached.
+                size_of: A function that returns the size in bytes of a loaded object. By default the nbytes of
+                    NumPy arrays, the length of bytes and sys.getsizeof of anything else.
+        """
+        assert isinstance(max_bytes, int) and max_bytes >= 0, 'max_bytes must be a non-negative int.'
+        self.load_object = load_object
+        self.max_bytes = max_bytes
+        self.size_of = _size_of if size_of is None else size_of
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._payloads = OrderedDict()
+            self._sizes = {}
+            self.bytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def get(self, key, obj):
+        """
+            Get a loaded object, loading it with load_object if it is not held.
+
+            Args:
+                key: The (class_no, obj_idx) of the object.
+                obj: The object, as in the class list.
+
+            Returns:
+                The loaded object.
+        """
+        with self._lock:
+            if key in self._payloads:
+                self._payloads.move_to_end(key)
+                self.hits += 1
+                return self._payloads[key]
+            self.misses += 1
+
+        # Loading is done outside the lock so that other threads can use the cache meanwhile
+        payload = self.load_object(obj)
+        size = self.size_of(payload)
+        if size > self.max_bytes:
+            return payload
+
+        with self._lock:
+            if key in self._payloads:
+                self.bytes -= self._sizes[key]
+            self._payloads[key] = payload
+            self._payloads.move_to_end(key)
+            self._sizes[key] = size
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                evicted_key, _ = self._payloads.popitem(last = False)
+                self.bytes -= self._sizes.pop(evicted_key)
+                self.evictions += 1
+        return payload
+
+    def discard_class(self, class_no):
+        """
+            Drop the objects of a class, whose object indices are changed by remove_objects.
+        """
+        with self._lock:
+            for key in [key for key in self._payloads if key[0] == class_no]:
+                del self._payloads[key]
+                self.bytes -= self._sizes.pop(key)
+
+    def __len__(self):
+        return len(self._payloads)
+
+    def snapshot(self):
+        """
+            Returns:
+                A dict of the hits, misses and evictions since the cache was created or cleared and the number and
+                total size of the objects held.
+        """
+        with self._lock:
+            return {'hits' : self.hits, 'misses' : self.misses, 'evictions' : self.evictions, \
+                'objects' : len(self._payloads), 'bytes' : self.bytes}
+
+    def __getstate__(self):
+        # The lock cannot be pickled and the objects held are not worth sending to another process
+        state = dict(self.__dict__)
+        del state['_lock']
+        state['_payloads'] = OrderedDict()
+        state['_sizes'] = {}
+        state.update(bytes = 0, hits = 0, misses = 0, evictions = 0)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+def _hash_key(key, mask):
+    class_no, obj_idx = key
+    return ((class_no * 0x9E3779B97F4A7C15 + obj_idx) * 0xBF58476D1CE4E5B9 >> 17) & mask
+
+class shared_object_cache(object_cache):
+    '''
+        An object_cache kept in shared memory, so that the worker processes of prefetch, or any processes given a 
+        copy of it, share one set of loaded objects rather than each loading and holding its own.
+
+        The loaded objects must be NumPy arrays, or convertible to them with numpy.asarray, of at most slot_bytes 
+        bytes and not of object dtype. Anything else is returned without being cached. The memory is split into 
+        max_bytes // slot_bytes slots of slot_bytes each, and an index in the same memory, a hash table with linear 
+        probing, maps each (class_no, obj_idx) to its slot. When every slot is in use the least recently used 
+        object is evicted. The index and the counters are shared too, behind a lock.
+
+        The process that creates the cache owns the memory and must call close, or use the cache as a context 
+        manager, to free it. Copies only attach to it.
+    '''
+    _max_ndim = 8
+
+    def __init__(self, load_object, max_bytes, slot_bytes, copy = True):
+        """
+            Args:
+                load_object: A function that given an object of the class list returns its loaded form, a NumPy 
+                    array.
+                max_bytes: The size of the memory the loaded objects are held in.
+                slot_bytes: The size of the largest object that is cached.
+                copy: If True the objects returned are copies. Otherwise they are views of the shared memory, read 
+                    without copying, which are overwritten once the object is evicted and so must be used before 
+                    then.
+        """
+        import multiprocessing
+        from multiprocessing import shared_memory
+
+        assert isinstance(slot_bytes, int) and slot_bytes > 0, 'slot_bytes must be a positive int.'
+        assert isinstance(max_bytes, int) and max_bytes >= slot_bytes, 'max_bytes must be an int of at least slot_bytes.'
+        self.load_object = load_object
+        self.max_bytes = max_bytes
+        self.slot_bytes = slot_bytes
+        self.slot_count = max_bytes // slot_bytes
+        self.copy = copy
+        # The table is kept at most half full so that probe sequences stay short
+        self.table_size = 1 << (2 * self.slot_count - 1).bit_length()
+
+        self._lock = multiprocessing.Lock()
+        self._shm = shared_memory.SharedMemory(create = True, size = self._layout_size())
+        self._owner = True
+        self._attach()
+        self.clear()
+
+    def _layout(self):
+        n = self.slot_count
+        return [('counts', np.int64, (4,)), ('keys', np.int64, (n, 2)), ('last_used', np.int64, (n,)), \
+            ('ndim', np.int64, (n,)), ('shape', np.int64, (n, self._max_ndim)), ('dtype', 'S16', (n,)), \
+            ('table', np.int64, (self.table_size,)), ('data', np.uint8, (n, self.slot_bytes))]
+
+    def _layout_size(self):
+        return sum(np.dtype(dtype).itemsize * int(np.prod(shape)) for _, dtype, shape in self._layout())
+
+    def _attach(self):
+        # Views of the parts of the shared memory, each starting at a multiple of 8 bytes
+        offset = 0
+        for name, dtype, shape in self._layout():
+            array = np.ndarray(shape, dtype = dtype, buffer = self._shm.buf, offset = offset)
+            setattr(self, '_' + name, array)
+            offset += array.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._counts[:] = 0
+            self._keys[:] = -1
+            self._last_used[:] = 0
+            self._table[:] = -1
+
+    @property
+    def hits(self):
+        return int(self._counts[0])
+
+    @property
+    def misses(self):
+        return int(self._counts[1])
+
+    @property
+    def evictions(self):
+        return int(self._counts[2])
+
+    @property
+    def bytes(self):
+        return int(np.count_nonzero(self._keys[:, 0] >= 0)) * self.slot_bytes
+
+    def _find(self, key):
+        # Returns the table position of the key, or of the empty entry that ends its probe sequence
+        mask = self.table_size - 1
+        position = _hash_key(key, mask)
+        while True:
+            slot = self._table[position]
+            if slot < 0 or (self._keys[slot, 0] == key[0] and self._keys[slot, 1] == key[1]):
+                return position
+            position = (position + 1) & mask
+
+    def _remove(self, position):
+        # Deletion with backward shifting, moving up the entries that would no longer be found past the gap
+        mask = self.table_size - 1
+        self._keys[self._table[position]] = -1
+        while True:
+            self._table[position] = -1
+            next_position = position
+            while True:
+                next_position = (next_position + 1) & mask
+                slot = self._table[next_position]
+                if slot < 0:
+                    return
+                home = _hash_key(self._keys[slot].tolist(), mask)
+                # The entry can move to the gap if its home is not in the cyclic range (position, next_position]
+                if (next_position - home) & mask >= (next_position - position) & mask:
+                    break
+            self._table[position] = slot
+            position = next_position
+
+    def _read(self, slot):
+        shape = tuple(self._shape[slot, :self._ndim[slot]].tolist())
+        dtype = np.dtype(self._dtype[slot].decode())
+        payload = np.ndarray(shape, dtype = dtype, buffer = self._data[slot])
+        return payload.copy() if self.copy else payload
+
+    def get(self, key, obj):
+        """
+            Get a loaded object, loading it with load_object if it is not held by any process.
+
+            Args:
+                key: The (class_no, obj_idx) of the object.
+                obj: The object, as in the class list.
+
+            Returns:
+                The loaded object.
+        """
+        key = (int(key[0]), int(key[1]))
+        with self._lock:
+            slot = self._table[self._find(key)]
+            if slot >= 0:
+                self._counts[0] += 1
+                self._counts[3] += 1
+                self._last_used[slot] = self._counts[3]
+                return self._read(slot)
+            self._counts[1] += 1
+
+        # Loading is done outside the lock so that other processes can use the cache meanwhile
+        payload = self.load_object(obj)
+        array = np.asarray(payload)
+        if array.dtype.hasobject or array.nbytes > self.slot_bytes or array.ndim > self._max_ndim:
+            return payload
+
+        with self._lock:
+            position = self._find(key)
+            slot = self._table[position]
+            if slot < 0:
+                free_slots = np.flatnonzero(self._keys[:, 0] < 0)
+                if len(free_slots) > 0:
+                    slot = free_slots[0]
+                else:
+                    slot = int(np.argmin(self._last_used))
+                    self._remove(self._find(self._keys[slot].tolist()))
+                    self._counts[2] += 1
+                    # Removing the evicted entry can move the entries after it
+                    position = self._find(key)
+                self._data[slot, :array.nbytes] = np.ascontiguousarray(array).reshape(-1).view(np.uint8)
+                self._ndim[slot] = array.ndim
+                self._shape[slot, :array.ndim] = array.shape
+                self._dtype[slot] = array.dtype.str.encode()
+                self._keys[slot] = key
+                self._table[position] = slot
+            self._counts[3] += 1
+            self._last_used[slot] = self._counts[3]
+            return self._read(slot)
+
+    def discard_class(self, class_no):
+        """
+            Drop the objects of a class, whose object indices are changed by remove_objects.
+        """
+        with self._lock:
+            for slot in np.flatnonzero(self._keys[:, 0] == class_no).tolist():
+                self._remove(self._find(self._keys[slot].tolist()))
+
+    def __len__(self):
+        return int(np.count_nonzero(self._keys[:, 0] >= 0))
+
+    def snapshot(self):
+        """
+            Returns:
+                A dict of the hits, misses and evictions of all processes since the cache was created or cleared and 
+                the number and total size of the objects held.
+        """
+        with self._lock:
+            return {'hits' : self.hits, 'misses' : self.misses, 'evictions' : self.evictions, \
+                'objects' : len(self), 'bytes' : self.bytes}
+
+    def close(self):
+        """
+            Detach from the shared memory, and free it if this is the process that created the cache.
+        """
+        if self._shm is None:
+            return
+        for name, _, _ in self._layout():
+            setattr(self, '_' + name, None)
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+        self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __getstate__(self):
+        # Copies attach to the same memory by name. The lock can only be sent to processes as they start, such as
+        # the worker processes of prefetch.
+        state = {key : value for key, value in self.__dict__.items() if not isinstance(value, np.ndarray)}
+        state['_shm'] = self._shm.name
+        state['_owner'] = False
+        return state
+
+    def __setstate__(self, state):
+        from multiprocessing import shared_memory
+
+        self.__dict__.update(state)
+        try:
+            # The memory belongs to the process that created it, which should be the only one to free it
+            self._shm = shared_memory.SharedMemory(name = state['_shm'], track = False)
+        except TypeError:
+            # Python before 3.13 has no track argument
+            self._shm = shared_memory.SharedMemory(name = state['_shm'])
+        self._attach()
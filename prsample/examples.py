@@ -1,32 +1,140 @@
 import numpy as np
 import prsample as prs
+from math import comb
+
+def _objects_class_size_and_idx(objects_per_class):
+    '''
+        For every object of every class, class after class, returns the number of objects in its class and its 
+        index within its class.
+    '''
+    objects_per_class = np.asarray(objects_per_class, dtype = int)
+    first_object = np.cumsum(objects_per_class) - objects_per_class
+    class_size = np.repeat(objects_per_class, objects_per_class)
+    obj_idx = np.arange(len(class_size)) - np.repeat(first_object, objects_per_class)
+    return class_size, obj_idx
+
+def _get_cumsum_objects_per_class(class_list):
+    '''
+        Returns the cumulative number of objects per class, starting with zero. This is taken from the index 
+        that prsample builds once per epoch when available.
+    '''
+    if len(class_list) > 0 and 'flat_index' in class_list[0]:
+        return class_list[0]['flat_index']['cumsum_objects_per_class']
+
+    cumsum_objects_per_class = np.zeros(len(class_list) + 1, dtype = int)
+    cumsum_objects_per_class[1:] = np.cumsum([len(c["object_list"]) for c in class_list])
+    return cumsum_objects_per_class
+
+def _get_class_obj_idx_from_flat_idx(obj_flat_idx, cumsum_objects_per_class):
+    '''
+        Returns the class index and object index within that class of an index into all objects of all classes.
+    '''
+    class_idx = np.searchsorted(cumsum_objects_per_class, obj_flat_idx, side = 'right') - 1
+    return class_idx, obj_flat_idx - cumsum_objects_per_class[class_idx]
+
+def _comb(n, k, dtype = None):
+    '''
+        Returns the binomial coefficient n choose k of every entry of the array n, exactly. By default the products 
+        are computed in int64 only if they cannot overflow, and as Python ints otherwise.
+    '''
+    n = np.asarray(n)
+    if dtype is None:
+        max_n = int(np.max(n)) if n.size > 0 else 0
+        dtype = int if max(comb(max_n, j) for j in range(k + 1)) * max_n < 2**63 else object
+    n = n.astype(dtype)
+    result = np.ones(n.shape, dtype = dtype)
+    for j in range(k):
+        # C(n, j) * (n - j) is always a multiple of j + 1
+        result = result * np.maximum(n - j, 0) // (j + 1)
+    return result
+
+def _unrank_combination(rank, k, n):
+    '''
+        Returns the k-combination of range(n) with the given rank in the combinatorial number system, i.e. in 
+        colexicographic order, as a list in increasing order. Each element takes a binary search, O(k log n) in all.
+    '''
+    combination = [0] * k
+    high = n
+    for i in range(k, 0, -1):
+        # The largest c below high with comb(c, i) <= rank
+        low = i - 1
+        high -= 1
+        while low < high:
+            mid = (low + high + 1) // 2
+            if comb(mid, i) <= rank:
+                low = mid
+            else:
+                high = mid - 1
+        combination[i - 1] = low
+        rank -= comb(low, i)
+        high = low
+    return combination
+
+def _unrank_combinations(rank, k, n):
+    '''
+        The vectorized form of _unrank_combination for arrays of ranks and of n, returning an array of shape 
+        rank.shape + (k,).
+    '''
+    rank = np.asarray(rank)
+    n = np.broadcast_to(n, rank.shape)
+    combination = np.zeros(rank.shape + (k,), dtype = int)
+    if rank.size == 0 or k == 0:
+        return combination
+
+    # The binomial coefficients are computed in int64 only if their products cannot overflow
+    max_n = int(np.max(n))
+    dtype = int if comb(max_n, k) * max_n < 2**63 else object
+    rank = rank.astype(dtype)
+
+    high = n.astype(int)
+    for i in range(k, 0, -1):
+        low = np.full(rank.shape, i - 1)
+        high = high - 1
+        while np.any(low < high):
+            mid = (low + high + 1) // 2
+            below = _comb(mid, i, dtype) <= rank
+            low = np.where(below, mid, low)
+            high = np.where(below, high, mid - 1)
+        combination[..., i - 1] = low
+        rank = rank - _comb(low, i, dtype)
+        high = low
+    return combination
+
+def _interleave(class_no, obj_idx):
+    '''
+        Returns the columns class_0, obj_0, class_1, obj_1, ... of arrays of shape (..., k) of class numbers and 
+        object indices.
+    '''
+    return np.stack([class_no, obj_idx], axis = -1).reshape(obj_idx.shape[:-1] + (2 * obj_idx.shape[-1],))
 
 class Nlet_Example():
     '''
         This class represents an example per object.
     '''
+    __slots__ = ('class_obj_pairs',)
+
     def __init__(self, class_obj_pairs):
-        self.class_obj_pairs = class_obj_pairs
+        self.class_obj_pairs = tuple((class_idx, obj_idx) for (class_idx, obj_idx) in class_obj_pairs)
         for (class_idx, obj_idx) in self.class_obj_pairs:
 	        assert class_idx >= 0, "class_idx must be non-negative"
 	        assert obj_idx >= 0, "obj_idx must be non-negative"
         return
 
     def __hash__(self): 
-        return super.__hash__(self.class_obj_pairs)
+        return hash(self.class_obj_pairs)
 
     def __eq__(self, other): 
-        for (class_idx, obj_idx, other_class_idx, other_obj_idx) in zip(self.class_obj_pairs, other.class_obj_pairs):
-        	if (class_idx != other_class_idx) or (obj_idx != other_obj_idx):
-        		return False
-        return True
-
-    def __ne__(self, other): 
-        return not self.__eq__(other)
+        if not isinstance(other, Nlet_Example):
+            return NotImplemented
+        return self.class_obj_pairs == other.class_obj_pairs
 
     def get(self):
         return self.class_obj_pairs
 
+    @classmethod
+    def from_values(cls, values):
+        return cls(zip(values[0::2], values[1::2]))
+
     def is_valid(self, class_list):
 
         for (class_idx, obj_idx) in self.class_obj_pairs:
@@ -43,6 +151,11 @@ class Single_Example():
     '''
         This class represents an example per object.
     '''
+    __slots__ = ('class_idx', 'obj_idx')
+    fields = __slots__
+    # The example counts of a class's objects depend on that class alone
+    class_local_counts = True
+
     def __init__(self, class_idx, obj_idx):
         self.class_idx = class_idx
         self.obj_idx = obj_idx
@@ -51,17 +164,20 @@ class Single_Example():
         return
 
     def __hash__(self): 
-        return super.__hash__((self.class_idx, self.obj_idx))
+        return hash(self.get())
 
     def __eq__(self, other): 
-        return self.class_idx == other.class_idx and  self.obj_idx == other.obj_idx
-
-    def __ne__(self, other): 
-        return not self.__eq__(other)
+        if not isinstance(other, Single_Example):
+            return NotImplemented
+        return self.get() == other.get()
 
     def get(self):
         return (self.class_idx, self.obj_idx)
 
+    @classmethod
+    def from_values(cls, values):
+        return cls(*values)
+
     def is_valid(self, class_list):
         assert self.class_idx >= 0, "class_idx must be non-negative"
         assert self.obj_idx >= 0, "obj_idx must be non-negative"
@@ -74,6 +190,10 @@ class Single_Example():
     def examples_per_obj(class_idx, object_idx, class_list):
         return 1
 
+    @staticmethod
+    def examples_per_objects(objects_per_class):
+        return np.ones(np.sum(objects_per_class, dtype = int), dtype = int)
+
     @staticmethod
     def get_example_from_obj(index, class_list, cumsum_examples_per_class):
         class_idx = prs.get_class_idx_from_index(index, cumsum_examples_per_class)
@@ -81,11 +201,21 @@ class Single_Example():
         assert offset == 0
         return Single_Example(class_list[class_idx]['class_no'], obj_idx)
 
+    @staticmethod
+    def get_examples_from_indices(indices, class_list, cumsum_examples_per_class, flat_index):
+        class_idx, obj_idx, offset = prs.get_class_obj_idx_from_indices(indices, flat_index)
+        assert np.all(offset == 0)
+        class_no = flat_index['class_no'][class_idx]
+        return np.stack([class_no, obj_idx], axis = -1)
+
 
 class Pair_Example():
     '''
         This class represents an example per object pair.
     '''
+    __slots__ = ('class_a', 'obj_a_idx', 'class_b', 'obj_b_idx')
+    fields = __slots__
+
     def __init__(self, class_a, obj_a_idx, class_b, obj_b_idx):
         self.class_a = class_a
         self.obj_a_idx = obj_a_idx        
@@ -94,18 +224,20 @@ class Pair_Example():
         return
 
     def __hash__(self): 
-        return super.__hash__((self.class_a, self.obj_a_idx, self.class_b, self.obj_b_idx))
+        return hash(self.get())
 
     def __eq__(self, other): 
-        return self.class_a == other.class_a and  self.obj_a_idx == other.obj_a_idx and \
-            self.class_b == other.class_b and self.obj_b_idx == other.obj_b_idx
-
-    def __ne__(self, other): 
-        return not self.__eq__(other)
+        if not isinstance(other, Pair_Example):
+            return NotImplemented
+        return self.get() == other.get()
 
     def get(self):
         return (self.class_a, self.obj_a_idx, self.class_b, self.obj_b_idx)
 
+    @classmethod
+    def from_values(cls, values):
+        return cls(*values)
+
     def __str__(self): 
         return str(self.class_a)  + '(' + str(self.obj_a_idx) + ') ' + str(self.class_b) + '(' +str(self.obj_b_idx) + ')'
 
@@ -126,6 +258,9 @@ class Triplet_Example():
     '''
         This class represents an example per object triplet.
     '''
+    __slots__ = ('class_a', 'obj_a_idx', 'class_b', 'obj_b_idx', 'class_c', 'obj_c_idx')
+    fields = __slots__
+
     def __init__(self, class_a, obj_a_idx, class_b, obj_b_idx, class_c, obj_c_idx):
         self.class_a = class_a
         self.obj_a_idx = obj_a_idx        
@@ -136,19 +271,20 @@ class Triplet_Example():
         return
 
     def __hash__(self): 
-        return super.__hash__((self.class_a, self.obj_a_idx, self.class_b, self.obj_b_idx, self.class_c, self.obj_c_idx))
+        return hash(self.get())
 
     def __eq__(self, other): 
-        return self.class_a == other.class_a and self.obj_a_idx == other.obj_a_idx and \
-               self.class_b == other.class_b and self.obj_b_idx == other.obj_b_idx and \
-               self.class_c == other.class_c and self.obj_c_idx == other.obj_c_idx
-
-    def __ne__(self, other): 
-        return not self.__eq__(other)
+        if not isinstance(other, Triplet_Example):
+            return NotImplemented
+        return self.get() == other.get()
 
     def get(self):
         return (self.class_a, self.obj_a_idx, self.class_b, self.obj_b_idx, self.class_c, self.obj_c_idx)
 
+    @classmethod
+    def from_values(cls, values):
+        return cls(*values)
+
     def __str__(self): 
         return str(self.class_a) + '(' + str(self.obj_a_idx) + ') ' \
              + str(self.class_b) + '(' + str(self.obj_b_idx) + ') ' \
@@ -173,6 +309,9 @@ class Triplet_Example():
 
 
 class Pos_Anc_Neg_Triplet_Example(Triplet_Example):
+    __slots__ = ()
+    # The counts depend on the size of the object's class and the number of objects, not on the order of the classes
+    counts_depend_on_order = False
 
     def __init__(self, class_a, obj_a_idx, class_b, obj_b_idx, class_c, obj_c_idx):
         Triplet_Example.__init__(self, class_a, obj_a_idx, class_b, obj_b_idx, class_c, obj_c_idx)
@@ -194,45 +333,62 @@ class Pos_Anc_Neg_Triplet_Example(Triplet_Example):
         n = len(class_list[class_idx]["object_list"])
         unordered_in_class_pos_example_count = n - obj_idx - 1
 
-        unordered_out_of_class_neg_example_count =  sum([len(c["object_list"]) for c in class_list[:class_idx]])  \
-            + sum([len(c["object_list"]) for c in class_list[class_idx+1:]])
+        unordered_out_of_class_neg_example_count = int(_get_cumsum_objects_per_class(class_list)[-1]) - n
 
         return unordered_in_class_pos_example_count * unordered_out_of_class_neg_example_count
 
     @staticmethod
     def get_example_from_obj(index, class_list, cumsum_examples_per_class):
 
-        # print(class_list)
         class_pos_idx = prs.get_class_idx_from_index(index, cumsum_examples_per_class)
         obj_pos_idx, offset = prs.get_obj_idx_from_index(index, class_list[class_pos_idx])
 
         class_anc_idx = class_pos_idx
-        # print('class_anc_idx', class_anc_idx, 'len', len(class_list[class_anc_idx]), class_list[class_anc_idx])
-        remaining_objs_in_class = len(class_list[class_anc_idx]["object_list"]) - obj_pos_idx - 1
+        objs_in_class = len(class_list[class_anc_idx]["object_list"])
+        remaining_objs_in_class = objs_in_class - obj_pos_idx - 1
 
-        # print(remaining_objs_in_class)
         assert remaining_objs_in_class >= 0
 
         obj_anc_idx = (offset % remaining_objs_in_class) + obj_pos_idx + 1
         
         offset //= remaining_objs_in_class
 
-        class_neg_idx = 0
-        obj_neg_idx = offset
-
-        if class_neg_idx == class_anc_idx:
-            class_neg_idx += 1
-        while obj_neg_idx >= len(class_list[class_neg_idx]["object_list"]):
-            obj_neg_idx -= len(class_list[class_neg_idx]["object_list"])
-            class_neg_idx += 1
-
-            if class_neg_idx == class_anc_idx:
-                class_neg_idx += 1
+        # The negative is the offset-th object of all classes in order, skipping over the anchor class
+        cumsum_objects_per_class = _get_cumsum_objects_per_class(class_list)
+        if offset >= cumsum_objects_per_class[class_anc_idx]:
+            offset += objs_in_class
+        class_neg_idx, obj_neg_idx = _get_class_obj_idx_from_flat_idx(offset, cumsum_objects_per_class)
 
         return Pos_Anc_Neg_Triplet_Example( 
             class_list[class_pos_idx]['class_no'], obj_pos_idx, 
             class_list[class_anc_idx]['class_no'], obj_anc_idx, 
-            class_list[class_neg_idx]['class_no'], obj_neg_idx)
+            class_list[class_neg_idx]['class_no'], int(obj_neg_idx))
+
+    @staticmethod
+    def examples_per_objects(objects_per_class):
+        n, obj_idx = _objects_class_size_and_idx(objects_per_class)
+        return (n - obj_idx - 1) * (np.sum(objects_per_class, dtype = int) - n)
+
+    @staticmethod
+    def get_examples_from_indices(indices, class_list, cumsum_examples_per_class, flat_index):
+        class_pos_idx, obj_pos_idx, offset = prs.get_class_obj_idx_from_indices(indices, flat_index)
+        cumsum_objects_per_class = flat_index['cumsum_objects_per_class']
+
+        objs_in_class = cumsum_objects_per_class[class_pos_idx + 1] - cumsum_objects_per_class[class_pos_idx]
+        remaining_objs_in_class = objs_in_class - obj_pos_idx - 1
+        assert np.all(remaining_objs_in_class > 0)
+
+        obj_anc_idx = (offset % remaining_objs_in_class) + obj_pos_idx + 1
+        offset = offset // remaining_objs_in_class
+
+        # The negative is the offset-th object of all classes in order, skipping over the anchor class
+        obj_neg_flat_idx = offset + np.where(offset >= cumsum_objects_per_class[class_pos_idx], objs_in_class, 0)
+        class_neg_idx, obj_neg_idx = _get_class_obj_idx_from_flat_idx(obj_neg_flat_idx, cumsum_objects_per_class)
+
+        class_no = flat_index['class_no']
+        return np.stack([class_no[class_pos_idx], obj_pos_idx, 
+                         class_no[class_pos_idx], obj_anc_idx, 
+                         class_no[class_neg_idx], obj_neg_idx], axis = -1)
 
 
 
@@ -244,6 +400,8 @@ class Pos_Anc_Neg_Triplet_Example(Triplet_Example):
 
 
 class Ordered_In_Class_Pair_Example(Pair_Example):
+    __slots__ = ()
+    class_local_counts = True
 
     def __init__(self, class_a, obj_a_idx, class_b, obj_b_idx):
         Pair_Example.__init__(self, class_a, obj_a_idx, class_b, obj_b_idx)
@@ -260,6 +418,11 @@ class Ordered_In_Class_Pair_Example(Pair_Example):
     def examples_per_obj(class_idx, object_idx, class_list):
         return len(class_list[class_idx]["object_list"])
 
+    @staticmethod
+    def examples_per_objects(objects_per_class):
+        n, _ = _objects_class_size_and_idx(objects_per_class)
+        return n
+
     @staticmethod
     def get_example_from_obj(index, class_list, cumsum_examples_per_class):
 
@@ -268,7 +431,15 @@ class Ordered_In_Class_Pair_Example(Pair_Example):
 
         return Ordered_In_Class_Pair_Example(class_list[class_idx]['class_no'], obj_idx, class_list[class_idx]['class_no'], offset)
 
+    @staticmethod
+    def get_examples_from_indices(indices, class_list, cumsum_examples_per_class, flat_index):
+        class_idx, obj_idx, offset = prs.get_class_obj_idx_from_indices(indices, flat_index)
+        class_no = flat_index['class_no'][class_idx]
+        return np.stack([class_no, obj_idx, class_no, offset], axis = -1)
+
 class Unordered_In_Class_Pair_Example(Pair_Example):
+    __slots__ = ()
+    class_local_counts = True
 
     def __init__(self, class_a, obj_a_idx, class_b, obj_b_idx):
         Pair_Example.__init__(self, class_a, obj_a_idx, class_b, obj_b_idx)
@@ -286,6 +457,11 @@ class Unordered_In_Class_Pair_Example(Pair_Example):
         n = len(class_list[class_idx]["object_list"])
         return n - obj_idx - 1
 
+    @staticmethod
+    def examples_per_objects(objects_per_class):
+        n, obj_idx = _objects_class_size_and_idx(objects_per_class)
+        return n - obj_idx - 1
+
     @staticmethod
     def get_example_from_obj(index, class_list, cumsum_examples_per_class):
 
@@ -296,8 +472,17 @@ class Unordered_In_Class_Pair_Example(Pair_Example):
 
         return Unordered_In_Class_Pair_Example(class_list[class_idx]['class_no'], obj_a_idx, class_list[class_idx]['class_no'], obj_b_idx)
 
+    @staticmethod
+    def get_examples_from_indices(indices, class_list, cumsum_examples_per_class, flat_index):
+        class_idx, obj_a_idx, offset = prs.get_class_obj_idx_from_indices(indices, flat_index)
+        class_no = flat_index['class_no'][class_idx]
+        return np.stack([class_no, obj_a_idx, class_no, obj_a_idx + 1 + offset], axis = -1)
+
 
 class Unordered_Out_of_Class_Pair_Example(Pair_Example):
+    __slots__ = ()
+    # The examples of an object pair it with the objects of the classes after its own
+    counts_depend_on_order = True
 
     def __init__(self, class_a, obj_a_idx, class_b, obj_b_idx):
         Pair_Example.__init__(self, class_a, obj_a_idx, class_b, obj_b_idx)
@@ -311,7 +496,8 @@ class Unordered_Out_of_Class_Pair_Example(Pair_Example):
 
     @staticmethod
     def examples_per_obj(class_idx, obj_idx, class_list):
-        return sum([len(c["object_list"]) for c in class_list[class_idx+1:]])
+        cumsum_objects_per_class = _get_cumsum_objects_per_class(class_list)
+        return int(cumsum_objects_per_class[-1] - cumsum_objects_per_class[class_idx+1])
 
     @staticmethod
     def get_example_from_obj(index, class_list, cumsum_examples_per_class):
@@ -319,14 +505,220 @@ class Unordered_Out_of_Class_Pair_Example(Pair_Example):
         class_a_idx = prs.get_class_idx_from_index(index, cumsum_examples_per_class)
         obj_a_idx, offset = prs.get_obj_idx_from_index(index, class_list[class_a_idx])
 
-        class_b_idx = class_a_idx+1
-        obj_b_idx = offset
+        # Object b is the offset-th object of all classes after class a
+        cumsum_objects_per_class = _get_cumsum_objects_per_class(class_list)
+        class_b_idx, obj_b_idx = _get_class_obj_idx_from_flat_idx(cumsum_objects_per_class[class_a_idx+1] + offset, 
+            cumsum_objects_per_class)
+
+        return Unordered_Out_of_Class_Pair_Example(class_list[class_a_idx]['class_no'], obj_a_idx, class_list[class_b_idx]['class_no'], int(obj_b_idx))
 
-        while obj_b_idx >= len(class_list[class_b_idx]["object_list"]):
-            obj_b_idx -= len(class_list[class_b_idx]["object_list"])
-            class_b_idx += 1
+    @staticmethod
+    def examples_per_objects(objects_per_class):
+        objects_per_class = np.asarray(objects_per_class, dtype = int)
+        objects_in_later_classes = np.sum(objects_per_class) - np.cumsum(objects_per_class)
+        return np.repeat(objects_in_later_classes, objects_per_class)
+
+    @staticmethod
+    def get_examples_from_indices(indices, class_list, cumsum_examples_per_class, flat_index):
+        class_a_idx, obj_a_idx, offset = prs.get_class_obj_idx_from_indices(indices, flat_index)
+        cumsum_objects_per_class = flat_index['cumsum_objects_per_class']
+
+        # Object b is the offset-th object of all classes after class a
+        class_b_idx, obj_b_idx = _get_class_obj_idx_from_flat_idx(cumsum_objects_per_class[class_a_idx + 1] + offset, 
+            cumsum_objects_per_class)
+
+        class_no = flat_index['class_no']
+        return np.stack([class_no[class_a_idx], obj_a_idx, class_no[class_b_idx], obj_b_idx], axis = -1)
+
+class _Sized_Nlet_Example(Nlet_Example):
+    '''
+        The base of the Nlet examples of a fixed number k of objects, set with with_size.
+    '''
+    __slots__ = ()
+    k = None
+    _sized_classes = {}
+
+    @classmethod
+    def with_size(cls, k):
+        '''
+            Returns the subclass of examples of k objects. It is added to this module under the name 
+            cls.__name__ + '_' + str(k), so that it and its functions can be pickled, e.g. for prefetch.
+        '''
+        assert isinstance(k, int) and k >= 2, 'k must be an int of at least 2.'
+        name = cls.__name__ + '_' + str(k)
+        if name not in cls._sized_classes:
+            sized_class = type(name, (cls,), {'__slots__' : (), 'k' : k, '__module__' : __name__, '__qualname__' : name})
+            cls._sized_classes[name] = sized_class
+            globals()[name] = sized_class
+        return cls._sized_classes[name]
+
+    def is_valid(self, class_list):
+        if not Nlet_Example.is_valid(self, class_list):
+            return False
+        assert len(self.class_obj_pairs) == self.k, 'an example must have k objects.'
+        return True
+
+class In_Class_Nlet_Example(_Sized_Nlet_Example):
+    '''
+        An example of k different objects of the same class, for every set of k objects of every class. Use 
+        In_Class_Nlet_Example.with_size(k), e.g. with_size(4) for quadruplets.
+
+        The examples of a set belong to its first object and are ranked in the combinatorial number system, so that
+        object obj_idx of a class of n objects has comb(n - obj_idx - 1, k - 1) examples.
+    '''
+    __slots__ = ()
+    class_local_counts = True
+
+    def is_valid(self, class_list):
+        if not _Sized_Nlet_Example.is_valid(self, class_list):
+            return False
+        class_no, obj_idx = zip(*self.class_obj_pairs)
+        assert len(set(class_no)) == 1, 'the objects must all be of the same class.'
+        assert all(a < b for a, b in zip(obj_idx, obj_idx[1:])), 'the objects must be in increasing order.'
+        return True
+
+    @classmethod
+    def examples_per_obj(cls, class_idx, obj_idx, class_list):
+        n = len(class_list[class_idx]["object_list"])
+        return comb(n - obj_idx - 1, cls.k - 1)
+
+    @classmethod
+    def examples_per_objects(cls, objects_per_class):
+        n, obj_idx = _objects_class_size_and_idx(objects_per_class)
+        return _comb(n - obj_idx - 1, cls.k - 1)
+
+    @classmethod
+    def get_example_from_obj(cls, index, class_list, cumsum_examples_per_class):
+        class_idx = prs.get_class_idx_from_index(index, cumsum_examples_per_class)
+        obj_idx, offset = prs.get_obj_idx_from_index(index, class_list[class_idx])
+
+        n = len(class_list[class_idx]["object_list"])
+        others = _unrank_combination(int(offset), cls.k - 1, n - obj_idx - 1)
+
+        class_no = class_list[class_idx]['class_no']
+        return cls([(class_no, obj_idx)] + [(class_no, obj_idx + 1 + c) for c in others])
+
+    @classmethod
+    def get_examples_from_indices(cls, indices, class_list, cumsum_examples_per_class, flat_index):
+        class_idx, obj_idx, offset = prs.get_class_obj_idx_from_indices(indices, flat_index)
+        cumsum_objects_per_class = flat_index['cumsum_objects_per_class']
+
+        n = cumsum_objects_per_class[class_idx + 1] - cumsum_objects_per_class[class_idx]
+        others = obj_idx[..., np.newaxis] + 1 + _unrank_combinations(offset, cls.k - 1, n - obj_idx - 1)
+
+        obj_idx = np.concatenate([obj_idx[..., np.newaxis], others], axis = -1)
+        class_no = np.repeat(flat_index['class_no'][class_idx][..., np.newaxis], cls.k, axis = -1)
+        return _interleave(class_no, obj_idx)
+
+class Out_of_Class_Nlet_Example(_Sized_Nlet_Example):
+    '''
+        An example of an anchor object and k - 1 different objects of the other classes, for every object and every 
+        set of k - 1 objects of the other classes. Use Out_of_Class_Nlet_Example.with_size(k).
+
+        The sets of an anchor are ranked in the combinatorial number system over all the objects of all classes in 
+        order, skipping the anchor's class, so every object of a class of n objects has comb(N - n, k - 1) examples,
+        where N is the number of objects.
+    '''
+    __slots__ = ()
+    counts_depend_on_order = False
+
+    def is_valid(self, class_list):
+        if not _Sized_Nlet_Example.is_valid(self, class_list):
+            return False
+        anchor_class_no = self.class_obj_pairs[0][0]
+        others = self.class_obj_pairs[1:]
+        assert all(class_no != anchor_class_no for class_no, _ in others), 'the objects must not be of the anchor class.'
+        assert len(set(others)) == len(others), 'the objects must be different.'
+        return True
+
+    @classmethod
+    def examples_per_obj(cls, class_idx, obj_idx, class_list):
+        n = len(class_list[class_idx]["object_list"])
+        return comb(int(_get_cumsum_objects_per_class(class_list)[-1]) - n, cls.k - 1)
+
+    @classmethod
+    def examples_per_objects(cls, objects_per_class):
+        n, _ = _objects_class_size_and_idx(objects_per_class)
+        return _comb(np.sum(objects_per_class, dtype = int) - n, cls.k - 1)
+
+    @classmethod
+    def get_example_from_obj(cls, index, class_list, cumsum_examples_per_class):
+        class_idx = prs.get_class_idx_from_index(index, cumsum_examples_per_class)
+        obj_idx, offset = prs.get_obj_idx_from_index(index, class_list[class_idx])
+
+        cumsum_objects_per_class = _get_cumsum_objects_per_class(class_list)
+        first_object = int(cumsum_objects_per_class[class_idx])
+        n = int(cumsum_objects_per_class[class_idx + 1]) - first_object
+        positions = _unrank_combination(int(offset), cls.k - 1, int(cumsum_objects_per_class[-1]) - n)
+
+        class_obj_pairs = [(class_list[class_idx]['class_no'], obj_idx)]
+        for position in positions:
+            # The position-th object of all classes in order, skipping over the anchor class
+            other_class_idx, other_obj_idx = _get_class_obj_idx_from_flat_idx(position + n * (position >= first_object), 
+                cumsum_objects_per_class)
+            class_obj_pairs.append((class_list[other_class_idx]['class_no'], int(other_obj_idx)))
+        return cls(class_obj_pairs)
+
+    @classmethod
+    def get_examples_from_indices(cls, indices, class_list, cumsum_examples_per_class, flat_index):
+        class_idx, obj_idx, offset = prs.get_class_obj_idx_from_indices(indices, flat_index)
+        cumsum_objects_per_class = flat_index['cumsum_objects_per_class']
+
+        first_object = cumsum_objects_per_class[class_idx][..., np.newaxis]
+        n = cumsum_objects_per_class[class_idx + 1][..., np.newaxis] - first_object
+        positions = _unrank_combinations(offset, cls.k - 1, cumsum_objects_per_class[-1] - n[..., 0])
+        other_class_idx, other_obj_idx = _get_class_obj_idx_from_flat_idx(positions + n * (positions >= first_object), 
+            cumsum_objects_per_class)
+
+        class_no = flat_index['class_no']
+        return _interleave(np.concatenate([class_no[class_idx][..., np.newaxis], class_no[other_class_idx]], axis = -1), 
+            np.concatenate([obj_idx[..., np.newaxis], other_obj_idx], axis = -1))
+
+
+class Example_Batch():
+    '''
+        This class holds a batch of examples of one example class as a single NumPy structured array, with one 
+        int64 field per value of the example, rather than as a list of example objects.
+    '''
+    __slots__ = ('example_class', 'examples')
+
+    def __init__(self, example_class, examples):
+        '''
+            Args:
+                example_class: The class of the examples in the batch.
+                examples: An (N, width) integer array with one row of values per example, as returned by 
+                    get_examples_from_indices.
+        '''
+        examples = np.ascontiguousarray(examples, dtype = np.int64)
+        assert examples.ndim == 2, "examples must be a two dimensional array"
+
+        width = examples.shape[1]
+        fields = getattr(example_class, 'fields', None)
+        if fields is None:
+            fields = sum([('class_' + str(i), 'obj_' + str(i)) for i in range(width // 2)], ())
+        assert len(fields) == width, "examples must have one column per field of example_class"
+
+        self.example_class = example_class
+        self.examples = examples.view([(field, np.int64) for field in fields]).reshape(len(examples))
+        return
+
+    @staticmethod
+    def from_examples(example_class, examples):
+        values = [np.ravel(ex.get()) for ex in examples]
+        return Example_Batch(example_class, np.reshape(values, (len(values), -1)))
 
-        return Unordered_Out_of_Class_Pair_Example(class_list[class_a_idx]['class_no'], obj_a_idx, class_list[class_b_idx]['class_no'], obj_b_idx)
+    def __len__(self):
+        return len(self.examples)
 
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return self.example_class.from_values(self.examples[key].tolist())
+        return Example_Batch(self.example_class, self.array[key])
 
+    def __iter__(self):
+        for values in self.examples.tolist():
+            yield self.example_class.from_values(values)
 
+    @property
+    def array(self):
+        return self.examples.view(np.int64).reshape(len(self.examples), -1)
@@ -0,0 +1,281 @@
+import multiprocessing
+from collections import deque
+
+# The prsample object of a worker process, set once when the worker starts
+_worker_prsample = None
+
+def _init_worker(prsample):
+    global _worker_prsample
+    _worker_prsample = prsample
+
+def _get_worker_batch(batch_no):
+    return _worker_prsample._get_batch(batch_no)
+
+class prsample_process_iterator:
+    ''' 
+        Iterator class that builds batches in a pool of worker processes. Batches are yielded in the same 
+        order as prsample_iterator.
+    '''
+    def __init__(self, prsample, num_workers, prefetch_batches):
+        """
+            Args:
+                prsample: The prsample object to iterate over.
+                num_workers: The number of worker processes.
+                prefetch_batches: The maximum number of batches requested ahead of the one being yielded.
+        """
+        # Set first so that close, which __del__ calls, works if the arguments are rejected
+        self._pool = None
+        assert isinstance(num_workers, int) and num_workers > 0, 'num_workers must be a positive int.'
+        assert isinstance(prefetch_batches, int) and prefetch_batches > 0, 'prefetch_batches must be a positive int.'
+
+        self._prsample = prsample
+        self._index = prsample._take_resume_index()
+        self._prefetch_batches = prefetch_batches
+
+        # The prsample object, including its callbacks, is sent once to each worker. After that only 
+        # batch numbers are sent and each worker maps them with its own copy of the strides and offsets.
+        self._pool = multiprocessing.Pool(num_workers, initializer = _init_worker, initargs = (prsample,))
+        self._pending = deque()
+        self._next_batch_no = self._index
+        self._request_batches()
+
+    def _request_batches(self):
+        while len(self._pending) < self._prefetch_batches and self._next_batch_no < self._prsample.__len__():
+            self._pending.append(self._pool.apply_async(_get_worker_batch, (self._next_batch_no,)))
+            self._next_batch_no += 1
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+
+        if self._pool is not None and self._index < self._prsample.__len__():
+            result = self._pending.popleft()
+            self._request_batches()
+            try:
+                batch = result.get()
+            except BaseException:
+                self.close()
+                raise
+            self._index += 1
+            self._prsample.iter_index = self._index
+            return batch
+        # End of Iteration
+        if self._index >= self._prsample.__len__():
+            self._prsample.iter_index = 0
+        self.close()
+        raise StopIteration
+
+    def close(self):
+        """
+            Stops the worker processes, discarding any batches that have been prefetched.
+        """
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+            self._pending.clear()
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+class prsample_thread_iterator:
+    ''' 
+        Iterator class that fetches the examples of batches in a pool of threads, for get_example_from_obj functions
+        that block on I/O. Batches are yielded in the same order as prsample_iterator.
+    '''
+    def __init__(self, prsample, num_threads, prefetch_batches):
+        """
+            Args:
+                prsample: The prsample object to iterate over.
+                num_threads: The number of threads fetching examples.
+                prefetch_batches: The maximum number of batches requested ahead of the one being yielded.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        # Set first so that close, which __del__ calls, works if the arguments are rejected
+        self._executor = None
+        assert isinstance(num_threads, int) and num_threads > 0, 'num_threads must be a positive int.'
+        assert not (prsample.no_duplicated_data and prsample.batch_policy == 'fill'), \
+            "batch_policy 'fill' is not supported, use prefetch."
+        assert isinstance(prefetch_batches, int) and prefetch_batches > 0, 'prefetch_batches must be a positive int.'
+
+        self._prsample = prsample
+        self._index = prsample._take_resume_index()
+        self._prefetch_batches = prefetch_batches
+
+        self._executor = ThreadPoolExecutor(num_threads)
+        self._pending = deque()
+        self._next_batch_no = self._index
+        self._request_batches()
+
+    def _request_batches(self):
+        p = self._prsample
+        while len(self._pending) < self._prefetch_batches and self._next_batch_no < p.__len__():
+            idx, is_valid = p.get_batch_indices(self._next_batch_no)
+            if not p.no_duplicated_data:
+                is_valid[:] = True
+            self._pending.append([self._executor.submit(self._get_example, i) if v else None \
+                for i, v in zip(idx.tolist(), is_valid.tolist())])
+            self._next_batch_no += 1
+
+    def _get_example(self, index):
+        p = self._prsample
+        example = p.get_example_from_object(index, p._class_list, p._cumsum_examples_per_class)
+        if p.object_loader is not None:
+            # The objects are loaded in the same thread, so a slow object_loader runs concurrently too
+            return p.load_example(example)
+        return example
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+
+        if self._executor is not None and self._index < self._prsample.__len__():
+            futures = self._pending.popleft()
+            self._request_batches()
+            try:
+                batch = [f.result() if f is not None else None for f in futures]
+            except BaseException:
+                self.close()
+                raise
+            self._index += 1
+            self._prsample.iter_index = self._index
+            return batch
+        # End of Iteration
+        if self._index >= self._prsample.__len__():
+            self._prsample.iter_index = 0
+        self.close()
+        raise StopIteration
+
+    def close(self):
+        """
+            Stops the threads, discarding any examples that have been prefetched.
+        """
+        if self._executor is not None:
+            for futures in self._pending:
+                for f in futures:
+                    if f is not None:
+                        f.cancel()
+            self._pending.clear()
+            self._executor.shutdown(wait = True)
+            self._executor = None
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+class prsample_async_iterator:
+    ''' 
+        Asynchronous iterator class that awaits a coroutine per example, with a bounded number of examples in 
+        flight within and across batches. Batches are yielded in the same order as prsample_iterator.
+    '''
+    def __init__(self, prsample, get_example_from_obj, concurrency, prefetch_batches):
+        """
+            Args:
+                prsample: The prsample object to iterate over.
+                get_example_from_obj: A coroutine function with the same arguments as prsample's get_example_from_obj.
+                concurrency: The maximum number of examples being fetched at once.
+                prefetch_batches: The maximum number of batches requested ahead of the one being yielded.
+        """
+        assert isinstance(concurrency, int) and concurrency > 0, 'concurrency must be a positive int.'
+        assert not (prsample.no_duplicated_data and prsample.batch_policy == 'fill'), \
+            "batch_policy 'fill' is not supported."
+        assert isinstance(prefetch_batches, int) and prefetch_batches > 0, 'prefetch_batches must be a positive int.'
+
+        self._prsample = prsample
+        self._get_example_from_obj = get_example_from_obj
+        self._index = prsample._take_resume_index()
+        self._concurrency = concurrency
+        self._prefetch_batches = prefetch_batches
+
+        # The semaphore is created on first use so that it belongs to the running event loop
+        self._semaphore = None
+        self._closed = False
+        self._pending = deque()
+        self._next_batch_no = self._index
+
+    async def _get_example(self, index):
+        import asyncio
+
+        p = self._prsample
+        async with self._semaphore:
+            example = await self._get_example_from_obj(index, p._class_list, p._cumsum_examples_per_class)
+            if p.object_loader is not None:
+                # object_loader blocks, so it is run in the default executor and counts towards concurrency
+                return await asyncio.get_running_loop().run_in_executor(None, p.load_example, example)
+            return example
+
+    def _request_batches(self):
+        import asyncio
+
+        p = self._prsample
+        while len(self._pending) < self._prefetch_batches and self._next_batch_no < p.__len__():
+            idx, is_valid = p.get_batch_indices(self._next_batch_no)
+            if not p.no_duplicated_data:
+                is_valid[:] = True
+            self._pending.append([asyncio.ensure_future(self._get_example(i)) if v else None \
+                for i, v in zip(idx.tolist(), is_valid.tolist())])
+            self._next_batch_no += 1
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        import asyncio
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._concurrency)
+
+        if not self._closed and self._index < self._prsample.__len__():
+            self._request_batches()
+            tasks = self._pending.popleft()
+            self._request_batches()
+            batch_tasks = [t for t in tasks if t is not None]
+            try:
+                if batch_tasks:
+                    await asyncio.wait(batch_tasks, return_when = asyncio.FIRST_EXCEPTION)
+                # The first example of the batch to fail is raised, once the others are cancelled
+                failed = [t for t in batch_tasks if t.done() and not t.cancelled() and t.exception() is not None]
+                if failed:
+                    raise failed[0].exception()
+                examples = iter([t.result() for t in batch_tasks])
+            except BaseException:
+                self._pending.appendleft(tasks)
+                await self.aclose()
+                raise
+            self._index += 1
+            self._prsample.iter_index = self._index
+            return [next(examples) if t is not None else None for t in tasks]
+        # End of Iteration
+        if self._index >= self._prsample.__len__():
+            self._prsample.iter_index = 0
+        raise StopAsyncIteration
+
+    async def aclose(self):
+        """
+            Cancels any examples that are being fetched or have been prefetched.
+        """
+        import asyncio
+
+        tasks = [t for tasks in self._pending for t in tasks if t is not None]
+        self._pending.clear()
+        self._closed = True
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions = True)
+        return
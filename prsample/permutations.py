@@ -0,0 +1,107 @@
+'''
+    Permutations of range(size) that prsample can map the positions of an epoch to example indices with, given as the
+    permutation argument of prsample in place of the default coprime stride per batch_index.
+
+    A permutation class has:
+        random_keys(size, rng)  a classmethod returning an array of keys drawn from the NumPy Generator rng, which
+                                with size determine the permutation
+        __init__(size, keys)
+        forward(x)              the images of an array of ints in range(size)
+        inverse(y)              the inverse of forward
+
+    Neither needs any search, so they can be set up in constant time for any size.
+'''
+import numpy as np
+from math import gcd
+
+class affine_permutation():
+    '''
+        The permutation x -> (a*x + b) % size, with a coprime to size. It is the cheapest but consecutive inputs are
+        always a apart, so its output is visibly structured.
+    '''
+    def __init__(self, size, keys):
+        self.size = size
+        self.a, self.b = [int(key) for key in keys]
+        assert size <= 1 or gcd(self.a, size) == 1, 'a must be coprime to size.'
+        self.inverse_a = pow(self.a, -1, size) if size > 1 else 0
+        # The products fit in int64 when size*size does, otherwise the arithmetic is done on Python ints
+        self._dtype = np.int64 if size * size < 2**63 else object
+
+    @classmethod
+    def random_keys(cls, size, rng):
+        if size <= 1:
+            return np.array([1, 0], dtype = object)
+        while True:
+            a, b = [int.from_bytes(rng.bytes(16), 'little') % size for _ in range(2)]
+            if gcd(a, size) == 1:
+                return np.array([a, b], dtype = object)
+
+    def forward(self, x):
+        x = np.asarray(x, dtype = self._dtype)
+        return (self.a * x + self.b) % max(self.size, 1)
+
+    def inverse(self, y):
+        y = np.asarray(y, dtype = self._dtype)
+        return (self.inverse_a * (y - self.b)) % max(self.size, 1)
+
+def _round_function(right, key, mask):
+    # A 64 bit mixing function, that of splitmix64, of the right half and the round key, truncated to a half
+    z = (right + key) * np.uint64(0x9E3779B97F4A7C15)
+    z ^= z >> np.uint64(32)
+    z *= np.uint64(0xBF58476D1CE4E5B9)
+    z ^= z >> np.uint64(29)
+    return z & mask
+
+class feistel_permutation():
+    '''
+        A balanced Feistel network over the 2*k bit ints, the smallest such domain of at least size, restricted to
+        range(size) by cycle walking: an output of size or more is put through the network again until it is in
+        range. The domain is less than 4*size, so fewer than 4 passes are needed on average and any index maps in
+        O(1). Each round mixes one half with a 64 bit hash of the other half and the round key. Sizes up to 2**64 are
+        supported.
+    '''
+    rounds = 6
+
+    def __init__(self, size, keys):
+        assert size <= 2**64, 'feistel_permutation supports sizes up to 2**64.'
+        self.size = size
+        self.keys = np.asarray(keys, dtype = np.int64).astype(np.uint64)
+        assert len(self.keys) == self.rounds, 'there must be a key per round.'
+        self.half_bits = max(1, -(-(max(size, 2) - 1).bit_length() // 2))
+        self.mask = np.uint64((1 << self.half_bits) - 1)
+
+    @classmethod
+    def random_keys(cls, size, rng):
+        return rng.integers(0, 2**63, size = cls.rounds, dtype = np.int64)
+
+    def _walk(self, x, keys, step):
+        x = np.array(x, dtype = np.uint64, ndmin = 1)
+        y = step(x, keys)
+        outside = np.flatnonzero(y >= np.uint64(self.size)) if self.size < 2**64 else np.zeros(0, dtype = int)
+        while len(outside) > 0:
+            walked = step(y[outside], keys)
+            y[outside] = walked
+            outside = outside[walked >= np.uint64(self.size)]
+        return y
+
+    def _encrypt(self, x, keys):
+        shift = np.uint64(self.half_bits)
+        left, right = x >> shift, x & self.mask
+        for key in keys:
+            left, right = right, left ^ _round_function(right, key, self.mask)
+        return (left << shift) | right
+
+    def _decrypt(self, y, keys):
+        shift = np.uint64(self.half_bits)
+        left, right = y >> shift, y & self.mask
+        for key in keys[::-1]:
+            left, right = right ^ _round_function(left, key, self.mask), left
+        return (left << shift) | right
+
+    def forward(self, x):
+        shape = np.shape(x)
+        return self._walk(x, self.keys, self._encrypt).reshape(shape)
+
+    def inverse(self, y):
+        shape = np.shape(y)
+        return self._walk(y, self.keys, self._decrypt).reshape(shape)
@@ -1,61 +1,424 @@
 import numpy as  np
 from math import gcd
 import bisect
+import time
+
+from .loaders import prsample_process_iterator
+from .loaders import prsample_thread_iterator
+from .loaders import prsample_async_iterator
+from .cache import object_cache
 
 class prsample_iterator:
     ''' Iterator class '''
-    def __init__(self, prsample):
+    def __init__(self, prsample, with_mask = False):
         # Team object reference
         self._prsample = prsample
-        # member variable to keep track of current index
-        self._index = 0
+        # member variable to keep track of current index, which starts at zero unless load_state_dict restored one
+        self._index = prsample._take_resume_index()
+        self._with_mask = with_mask
+
+    def __iter__(self):
+        return self
 
     def __next__(self):
 
         if self._index < self._prsample.__len__():
-            result = [self._prsample.get_example(self._index, batch_index) \
-                for batch_index in range(self._prsample.examples_per_batch)]
+            if self._with_mask:
+                result = self._prsample.get_batch_with_mask(self._index)
+            else:
+                result = self._prsample._get_batch(self._index)
             self._index +=1
+            self._prsample.iter_index = self._index
             return result
         # End of Iteration
+        self._prsample.iter_index = 0
         raise StopIteration
 
-def build_class_list_from_class_dirs(dir_list, file_types):
+class prsample_shard:
+    ''' A view of the batches of a prsample object for one rank of a data parallel job '''
+    def __init__(self, prsample, rank, world_size):
+        assert isinstance(world_size, int) and world_size > 0, 'world_size must be a positive int.'
+        assert isinstance(rank, int) and 0 <= rank < world_size, 'rank must be an int in [0, world_size).'
+        self._prsample = prsample
+        self.rank = rank
+        self.world_size = world_size
+        self.iter_index = 0
+        self._resume_index = 0
+
+    def __getattr__(self, name):
+        # Everything that is not specific to the shard comes from the sharded prsample object
+        if '_prsample' not in self.__dict__:
+            raise AttributeError(name)
+        return getattr(self.__dict__['_prsample'], name)
+
+    def _take_resume_index(self):
+        # The batch that the next iterator starts at, once, after load_state_dict
+        index, self._resume_index = self._resume_index, 0
+        return index
+
+    def __len__(self):
+        """
+            Get the number of batches of this rank, which is the same for every rank.
+
+            Returns:
+                The number of batches of this rank.
+        """
+        return -(-self._prsample.__len__() // self.world_size)
+
+    def _get_global_batch_no(self, batch_no):
+        return self.rank + np.asarray(batch_no, dtype = int) * self.world_size
+
+    def get_example(self, batch_no, batch_index):
+        global_batch_no = int(self._get_global_batch_no(batch_no))
+        if self._prsample.no_duplicated_data and global_batch_no >= self._prsample.__len__():
+            return None
+        return self._prsample.get_example(global_batch_no, batch_index)
+
+    def get_batch_indices(self, batch_no):
+        global_batch_no = self._get_global_batch_no(batch_no)
+        idx, is_valid = self._prsample.get_batch_indices(global_batch_no)
+        is_valid &= (global_batch_no < self._prsample.__len__())[..., np.newaxis]
+        return idx, is_valid
+
+    def get_batch_with_mask(self, batch_no):
+        global_batch_no = int(self._get_global_batch_no(batch_no))
+        if global_batch_no < self._prsample.__len__():
+            return self._prsample.get_batch_with_mask(global_batch_no)
+        idx, is_valid = self.get_batch_indices(batch_no)
+        if not self._prsample.no_duplicated_data:
+            is_valid = np.ones(is_valid.shape, dtype = bool)
+        batch = self._prsample._get_batch_from_indices(idx, is_valid)
+        return self._prsample._load_batch(batch, is_valid), is_valid
+
+    def _get_batch(self, batch_no):
+        return self.get_batch_with_mask(batch_no)[0]
+
+    def __iter__(self):
+       ''' Returns the Iterator object '''
+       return prsample_iterator(self)
+
+    def masked(self):
+        return prsample_iterator(self, with_mask = True)
+
+    def prefetch(self, num_workers = 2, prefetch_batches = 4):
+        return prsample_process_iterator(self, num_workers, prefetch_batches)
+
+    def threaded(self, num_threads = 8, prefetch_batches = 2):
+        return prsample_thread_iterator(self, num_threads, prefetch_batches)
+
+    def aiter(self, get_example_from_obj = None, concurrency = 32, prefetch_batches = 2):
+        return prsample.aiter(self, get_example_from_obj, concurrency, prefetch_batches)
+
+def _list_class_dir(path, extensions, cache):
+    """
+        Lists the files of the given types and the sub directories of a directory. If the modification time of the 
+        directory matches its entry in the cache the cached entry is returned without listing the directory again.
+
+        Returns:
+            A dict with the modification time, the sorted file names and the sorted sub directory names, or None if 
+            the directory cannot be read.
+    """
+    import os
+
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+    entry = cache.get(path)
+    if entry is not None and entry['mtime'] == mtime:
+        return entry
+
+    files = []
+    sub_dirs = []
+    try:
+        with os.scandir(path) as it:
+            for dir_entry in it:
+                # Like glob, hidden files and directories are skipped
+                if dir_entry.name.startswith('.'):
+                    continue
+                # Like glob, symbolic links to directories are followed and a file matches the pattern *.<type>
+                if dir_entry.is_dir():
+                    sub_dirs.append(dir_entry.name)
+                elif any(dir_entry.name.endswith('.' + extension) for extension in extensions) and dir_entry.is_file():
+                    files.append(dir_entry.name)
+    except OSError:
+        return None
+    return {'mtime' : mtime, 'files' : sorted(files), 'sub_dirs' : sorted(sub_dirs)}
+
+def _scan_class_dirs(root, extensions, cache, ancestors = frozenset()):
+    """
+        Walks the directory tree under root, see _list_class_dir. A directory whose real path is that of root, of a 
+        directory above it or of one of ancestors, i.e. one reached through a cycle of symbolic links, is not walked.
+
+        Returns:
+            A tuple (class_dirs, scanned) where class_dirs maps every directory with matching files to a sorted list 
+            of their paths and scanned maps every directory walked to its entry.
+    """
+    import os
+
+    class_dirs = {}
+    scanned = {}
+    dirs = [(root, ancestors)]
+    while dirs:
+        path, ancestors = dirs.pop()
+        real_path = os.path.realpath(path)
+        if real_path in ancestors:
+            continue
+        entry = _list_class_dir(path, extensions, cache)
+        if entry is None:
+            continue
+        scanned[path] = entry
+        if entry['files']:
+            class_dirs[path] = [os.path.join(path, name) for name in entry['files']]
+        dirs += [(os.path.join(path, name), ancestors | {real_path}) for name in entry['sub_dirs']]
+
+    return class_dirs, scanned
+
+def build_class_list_from_class_dirs(dir_list, file_types, num_threads = 1, cache_path = None):
     """
-        Builds a list of classes where each class is given by a directory of files. 
+        Builds a list of classes where each class is given by a directory of files. Every directory under the 
+        directories of dir_list that holds files of the given types becomes a class, in order of directory path, 
+        with its files in order of path.
+
+        Args:
+            dir_list: A list of the directories to search.
+            file_types: A list of the file extensions to include, without the leading dot, e.g. 'png' or 'tar.gz'.
+            num_threads: The number of threads to walk the top level directories with.
+            cache_path: The path of a manifest file. If given, the directories whose modification time has not
+                changed since the manifest was written are not listed again and the manifest is updated.
+
+        Returns:
+            A list of classes, each a list of file paths.
     """
-    import glob
     import os
+    import json
 
-    file_list = []
+    extensions = {str(file_type) for file_type in file_types}
+
+    cache = {}
+    if cache_path is not None and os.path.exists(cache_path):
+        with open(cache_path, 'r') as f:
+            manifest = json.load(f)
+        if sorted(extensions) == manifest['file_types']:
+            cache = manifest['dirs']
+
+    roots = []
     for path in dir_list:
             path = os.path.expanduser(path)
             path = os.path.expandvars(path)
             path = os.path.normpath(path)
+            roots.append(path)
+
+    class_dirs = {}
+    scanned = {}
+    if num_threads > 1:
+        from concurrent.futures import ThreadPoolExecutor
+
+        # The top level directories are listed first and the trees under them walked in parallel
+        top_level_dirs = []
+        top_level_ancestors = []
+        for root in roots:
+            entry = _list_class_dir(root, extensions, cache)
+            if entry is None:
+                continue
+            scanned[root] = entry
+            if entry['files']:
+                class_dirs[root] = [os.path.join(root, name) for name in entry['files']]
+            top_level_dirs += [os.path.join(root, name) for name in entry['sub_dirs']]
+            top_level_ancestors += [frozenset([os.path.realpath(root)])] * len(entry['sub_dirs'])
+
+        with ThreadPoolExecutor(num_threads) as executor:
+            for tree_class_dirs, tree_scanned in executor.map(lambda d, a : _scan_class_dirs(d, extensions, cache, a), \
+                    top_level_dirs, top_level_ancestors):
+                class_dirs.update(tree_class_dirs)
+                scanned.update(tree_scanned)
+    else:
+        for root in roots:
+            tree_class_dirs, tree_scanned = _scan_class_dirs(root, extensions, cache)
+            class_dirs.update(tree_class_dirs)
+            scanned.update(tree_scanned)
+
+    if cache_path is not None:
+        temp_path = cache_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({'file_types' : sorted(extensions), 'dirs' : scanned}, f)
+        os.replace(temp_path, cache_path)
+
+    return [class_dirs[path] for path in sorted(class_dirs)]
+
+def _is_probable_prime(n):
+    if n < 2:
+        return False
+    small_primes = [2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37]
+    for p in small_primes:
+        if n % p == 0:
+            return n == p
+    d = n - 1
+    r = 0
+    while d % 2 == 0:
+        d //= 2
+        r += 1
+    # These bases make the Miller-Rabin test deterministic for n < 3.3e24
+    for a in small_primes:
+        x = pow(a, d, n)
+        if x == 1 or x == n - 1:
+            continue
+        for _ in range(r - 1):
+            x = x * x % n
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+def _find_factor(n):
+    # Pollard's rho with Floyd's cycle detection, n must be an odd composite
+    c = 1
+    while True:
+        x = y = 2
+        d = 1
+        while d == 1:
+            x = (x * x + c) % n
+            y = (y * y + c) % n
+            y = (y * y + c) % n
+            d = gcd(abs(x - y), n)
+        if d != n:
+            return d
+        c += 1
+
+def get_prime_factors(n):
+    """
+        Get the distinct prime factors of an integer.
+
+        Args:
+            n: A positive integer.
+
+        Returns:
+            A sorted list of the distinct prime factors of n.
+    """
+    factors = set()
+    for p in [2, 3, 5]:
+        while n % p == 0:
+            factors.add(p)
+            n //= p
+    remaining = [n] if n > 1 else []
+    while remaining:
+        m = remaining.pop()
+        if _is_probable_prime(m):
+            factors.add(m)
+        else:
+            d = _find_factor(m)
+            remaining += [d, m // d]
+    return sorted(factors)
+
+# Index arithmetic that can reach this is done on Python ints in object arrays rather than in int64
+_INT64_LIMIT = 2**63
+
+def _as_counts(counts):
+    """
+        Returns the numbers of examples of objects as an int64 array, or as Python ints in an object array if any 
+        does not fit in int64.
+    """
+    counts = np.asarray(counts)
+    if counts.dtype == object and counts.size > 0 and max(counts.tolist()) >= _INT64_LIMIT:
+        return counts
+    return counts.astype(int)
+
+def _random_integers(rng, low, high, size):
+    """
+        Draws size random integers in [low, high) from rng, as Python ints in an object array if high does not 
+        fit in int64.
+    """
+    if high <= _INT64_LIMIT:
+        return rng.integers(low, high, size)
+    # 64 more bits than the range so that the bias of the modulo is negligible
+    byte_count = (high - low).bit_length() // 8 + 9
+    return np.array([low + int.from_bytes(rng.bytes(byte_count), 'little') % (high - low) for _ in range(size)], \
+        dtype = object)
+
+def _load_array(file_name, mmap_mode):
+    try:
+        return np.load(file_name, mmap_mode = mmap_mode)
+    except ValueError:
+        # Object arrays, which hold the index of datasets too large for int64, cannot be memory mapped
+        return np.load(file_name, allow_pickle = True)
+
+def get_class_idx_from_indices(indices, cumsum_examples_per_class):
+    """
+        Get the class index of every example index in an array.
+
+        Args:
+            indices: An array of example indices.
+            cumsum_examples_per_class: The cumulative number of examples per class, starting with zero.
+
+        Returns:
+            An array of class indices, one per example index.
+    """
+    class_idx = np.searchsorted(cumsum_examples_per_class, indices, side = 'right') - 1
+    assert np.all(class_idx >= 0), 'cannot have negative classes'
+    return class_idx
+
+def get_obj_idx_from_indices(indices, cumsum_examples_per_object):
+    """
+        Get the object index and offset within the object of every example index in an array.
+
+        Args:
+            indices: An array of example indices.
+            cumsum_examples_per_object: The cumulative number of examples per object.
+
+        Returns:
+            A tuple (obj_idx, offset) of arrays, one entry per example index.
+    """
+    obj_idx = np.searchsorted(cumsum_examples_per_object, indices, side = 'right') - 1
+    assert np.all(obj_idx >= 0), 'cannot have negative object indicies'
+
+    offset = indices - cumsum_examples_per_object[obj_idx]
+    assert np.all(offset >= 0), 'cannot have negative offsets'
+    if isinstance(offset, np.ndarray) and offset.dtype == object and (offset.size == 0 or offset.max() < _INT64_LIMIT):
+        # The offset within an object fits in int64 even when the example indices do not
+        offset = offset.astype(np.int64)
+
+    return obj_idx, offset
 
-            for file_type in file_types:
-                file_list += glob.glob(os.path.join(path, '**', '*.' + str(file_type)))
+def get_class_obj_idx_from_indices(indices, flat_index):
+    """
+        Get the class index, object index and offset within the object of every example index in an array 
+        with a search over the classes and then one over the flattened object index.
 
-    class_path_list = {os.path.dirname(path) for path in file_list}
+        Args:
+            indices: An array of example indices.
+            flat_index: The flattened object index built by prsample.init_prsample.
 
-    class_list = []
-    for class_path in class_path_list:
-        class_list.append([path for path in file_list if os.path.dirname(path) == class_path])
+        Returns:
+            A tuple (class_idx, obj_idx, offset) of arrays, one entry per example index.
+    """
+    cumsum_examples_per_class = flat_index['cumsum_examples_per_class']
+    class_idx = get_class_idx_from_indices(indices, cumsum_examples_per_class)
+    class_no = flat_index['class_no'][class_idx]
 
-    return class_list
+    # Each class's objects are stored from where the class starts in the index, which does not change when the 
+    # classes are shuffled
+    stored_indices = indices - cumsum_examples_per_class[class_idx] + flat_index['stored_first_example_per_class'][class_no]
+    flat_obj_idx, offset = get_obj_idx_from_indices(stored_indices, flat_index['cumsum_examples_per_object'])
+    obj_idx = flat_obj_idx - flat_index['stored_first_object_per_class'][class_no]
+    return class_idx, obj_idx, offset
 
 def get_class_idx_from_index(index, cumsum_examples_per_class):
     """
-        Get an example for batch_no and batch_index.
+        Get the class index of an example index.
 
         Args:
-            batch_no: The number of the batch.
-            batch_index: The index of the example from within the batch.
+            index: The example index.
+            cumsum_examples_per_class: The cumulative number of examples per class, starting with zero.
 
         Returns:
-            The requested example.
+            The class index.
     """
+    if not isinstance(index, (int, np.integer)):
+        return int(get_class_idx_from_indices(index, cumsum_examples_per_class))
 
+    # A single index is faster to look up with bisect than with the array search and its checks
     class_idx = bisect.bisect(cumsum_examples_per_class, index) - 1
     assert class_idx >= 0, 'cannot have negative classes'
     return class_idx
@@ -63,31 +426,42 @@ def get_class_idx_from_index(index, cumsum_examples_per_class):
 
 def get_obj_idx_from_index(index, class_dict):
     """
-        Get an example for batch_no and batch_index.
+        Get the object index and the offset within the object of an example index.
 
         Args:
-            batch_no: The number of the batch.
-            batch_index: The index of the example from within the batch.
+            index: The example index.
+            class_dict: The class that the example index falls within.
 
         Returns:
-            The requested example.
+            A tuple (obj_idx, offset).
     """
+    # The per class cumsum is a view of the class's part of the flattened index, starting from the examples stored 
+    # before it rather than from those of the classes before it in this epoch
     cumsum_examples_per_object = class_dict['cumsum_examples_per_object']
+    stored_index = index - class_dict['first_example'] + cumsum_examples_per_object[0]
+    if not isinstance(index, (int, np.integer)):
+        obj_idx, offset = get_obj_idx_from_indices(stored_index, cumsum_examples_per_object)
+        return int(obj_idx), offset
 
-    obj_idx = bisect.bisect(cumsum_examples_per_object, index) - 1
+    obj_idx = bisect.bisect(cumsum_examples_per_object, stored_index) - 1
     assert obj_idx >= 0, 'cannot have negative object indicies'
 
-    offset = index - cumsum_examples_per_object[obj_idx]
+    offset = stored_index - cumsum_examples_per_object[obj_idx]
     assert offset >= 0, 'cannot have negative offsets'
-
     return obj_idx, offset
 
 class prsample:
 
-    def __init__(self, class_list, examples_per_batch, examples_per_obj, get_example_from_obj, 
+    def __init__(self, class_list, examples_per_batch, examples_per_obj, get_example_from_obj = None, 
                 no_duplicated_data = False, 
                 shuffle = True, 
-                seed = 69):
+                seed = 69,
+                plan = None,
+                stats = None,
+                batch_policy = 'pad',
+                object_loader = None,
+                locality_window = None,
+                permutation = None):
         """
             Creates a prsample object. The data that the sampling will be over is a list of classes. Each class should be described 
             by a list of all objects within that class.
@@ -95,13 +469,52 @@ class prsample:
             Two functions must be defined: examples_per_obj and get_example_from_obj. The function examples_per_obj must return 
             the integer number of examples that the given object can generate. 
 
+            Alternatively an example class, such as those in prsample.examples, can be given in place of examples_per_obj. 
+            Its examples_per_obj and get_example_from_obj are used and, if the class defines get_examples_from_indices, 
+            whole batches are generated with it as NumPy arrays rather than as lists of example objects. If the class 
+            defines examples_per_objects, which given the number of objects in each class returns the number of examples 
+            of every object, it is used in place of calling examples_per_obj once per object. If the class sets 
+            class_local_counts, meaning the counts of a class's objects depend on that class alone, the counts of each 
+            class are kept between epochs and only the classes changed by add_objects, add_class or remove_objects are 
+            counted again. If the class sets class_local_counts, or sets counts_depend_on_order to False because the 
+            counts depend on the sizes of the classes but not on their order, the index over the objects is kept 
+            between epochs and only the class level part of it, of one entry per class, is built again for the new 
+            order of the classes. Otherwise, as with examples_per_obj given as a function, the counts are taken to 
+            depend on the order and every object is counted again each epoch.
+
             Args:
                 class_list: A list of classes within each a list of objects that make that class.
                 examples_per_batch: The batch size in examples. 
-                examples_per_obj: A function that given a class returns the number of examples that can be derived from it.
-                get_example_from_obj: A complimentary function to examples_per_obj that returns a given example from the class
+                examples_per_obj: A function that given a class returns the number of examples that can be derived from it,
+                    or an example class.
+                get_example_from_obj: A complimentary function to examples_per_obj that returns a given example from the class.
+                    Not required when examples_per_obj is an example class.
                 shuffle: If true the the class list will be shuffled between epochs.
                 seed: An integer to seed the random number generator.
+                plan: The path of a sampling plan written by save_plan. If given the plan is memory mapped 
+                    instead of building the index for the first epoch.
+                stats: A prsample_stats object to collect timers and counters in, see prsample.stats. If None, 
+                    the default, nothing is collected.
+                batch_policy: How batches are laid out when no_duplicated_data is set. With 'pad', the default, 
+                    the slots whose index is past the end of the data are left empty, as None or as rows of -1, 
+                    wherever they fall in the epoch. With 'compact' the examples are packed into full batches and 
+                    only the last batch of the epoch has empty slots, at its end. With 'fill' the examples are 
+                    packed as with 'compact' and the empty slots of the last batch are filled with the first 
+                    examples of the next epoch, which then starts after them. See get_batch_with_mask for the 
+                    mask of the slots that hold examples.
+                object_loader: A function that given an object of the class list returns its loaded form, or a 
+                    prsample.object_cache wrapping one. If given, batches are lists with, for each slot, a tuple of 
+                    the loaded objects of the example, or None for an empty slot. See load_example.
+                locality_window: If given, an int that trades randomness for locality of the objects fetched. The 
+                    batch slots of an epoch, batch after batch, are split into windows of locality_window slots, 
+                    each of which takes a block of as many consecutive example indices, i.e. of adjacent objects 
+                    of a class. The order of the blocks is drawn with a coprime stride over the blocks and the 
+                    order within each block with a coprime stride over the block. Each epoch still uses every 
+                    example once. The default, None, spreads every batch over the whole of the data.
+                permutation: If given, a permutation class from prsample.permutations, such as feistel_permutation, 
+                    that maps the batch slots of an epoch, batch after batch, to the example indices in place of the 
+                    default coprime stride per batch_index. Its keys are drawn each epoch without any search. Cannot 
+                    be used with locality_window.
         """
 
         self._class_list = []
@@ -110,11 +523,34 @@ class prsample:
             data['class_no'] = class_no
             data['object_list'] = object_list
             self._class_list.append(data)
+        # The class dicts by class number, for updates to the class list
+        self._classes = list(self._class_list)
+        self._added_classes = []
+        self._flat_index = {}
+        self._object_index_valid = False
+        # The array, with room to spare, that the index over the objects is the start of once it has been spliced. 
+        # Only this object appends to it, so the arrays of saved states are never modified.
+        self._object_index_buffer = None
 
         assert isinstance(examples_per_batch, int) , 'examples_per_batch must be an int type.'
         # assert examples_per_batch > 0, 'examples_per_batch must be positive.'
         self.examples_per_batch = examples_per_batch
 
+        self.get_examples_from_indices = None
+        self.examples_per_objects = None
+        self.class_local_counts = False
+        self.counts_depend_on_order = True
+        if isinstance(examples_per_obj, type):
+            example_class = examples_per_obj
+            examples_per_obj = example_class.examples_per_obj
+            if get_example_from_obj is None:
+                get_example_from_obj = example_class.get_example_from_obj
+            self.get_examples_from_indices = getattr(example_class, 'get_examples_from_indices', None)
+            self.examples_per_objects = getattr(example_class, 'examples_per_objects', None)
+            self.class_local_counts = getattr(example_class, 'class_local_counts', False)
+            # Counts that are not class local are only taken not to depend on the order if the class says so
+            self.counts_depend_on_order = getattr(example_class, 'counts_depend_on_order', not self.class_local_counts)
+
         assert callable(examples_per_obj), "examples_per_obj must be a function."
         assert callable(get_example_from_obj), "get_example_from_obj must be a function."
         self.examples_per_object = examples_per_obj
@@ -122,23 +558,47 @@ class prsample:
 
         assert isinstance(shuffle, bool) , 'shuffle must be an bool type.'
         self.shuffle = shuffle
-        self.unshuffled_class_list = class_list
+        self.unshuffled_class_list = list(class_list)
         
         assert isinstance(seed, int) , 'seed must be an int type.'
         self.seed = seed
+        self._rng = np.random.default_rng(seed)
+        self.epoch_count = 0
+        self.iter_index = 0
+        self._resume_index = 0
+        self.stats = stats
+
+        assert isinstance(no_duplicated_data, bool) , 'no_duplicated_data must be an bool type.'
+        self.no_duplicated_data = no_duplicated_data
+        assert batch_policy in ('pad', 'compact', 'fill'), "batch_policy must be 'pad', 'compact' or 'fill'."
+        self.batch_policy = batch_policy
+        self._fill_offset = 0
+        self._invalid_positions = None
+        self._next_epoch = None
+        self.object_loader = object_loader
+        assert locality_window is None or (isinstance(locality_window, int) and locality_window > 0), \
+            'locality_window must be None or a positive int.'
+        self.locality_window = locality_window
+        assert permutation is None or locality_window is None, 'permutation cannot be used with locality_window.'
+        self.permutation = permutation
         
-        if self.examples_per_batch > 0:
+        if self.examples_per_batch > 0 and plan is not None:
+            self.load_plan(plan)
+        elif self.examples_per_batch > 0:
             self.init_prsample()
         else:
             self.examples_per_batch_index = 0
+            self.number_of_batches = 0
             self.total_example_count = 0
             # self._cumsum_examples_per_class = np.zeros(len(self._class_list) + 1, dtype=int)
 
-        assert isinstance(no_duplicated_data, bool) , 'no_duplicated_data must be an bool type.'
-        self.no_duplicated_data = no_duplicated_data
-
         return
 
+    def _take_resume_index(self):
+        # The batch that the next iterator starts at, once, after load_state_dict
+        index, self._resume_index = self._resume_index, 0
+        return index
+
     def __len__(self):
         """
             Get the number of batches that the class list enumerates to, i.e. after withdrawing this many batches
@@ -147,7 +607,7 @@ class prsample:
             Returns:
                 The total number of batches.
         """
-        return self.examples_per_batch_index
+        return self.number_of_batches
 
     def get_example(self, batch_no, batch_index):
         """
@@ -162,27 +622,388 @@ class prsample:
         """
         if self.examples_per_batch == 0:
             return None
-        if self.no_duplicated_data:
-            idx, is_valid = self._batch_to_idx(batch_no, batch_index, self.examples_per_batch, self.batch_strides, \
-                self.examples_per_batch_index, self.total_example_count, self.offsets)
-            if is_valid:
-                return self.get_example_from_object(idx, self._class_list, self._cumsum_examples_per_class)
-            else:
-                return None
+        stats = self.stats
+        if stats is not None:
+            start = time.perf_counter()
+
+        # With a dense batch_policy the example can come from the next epoch, which p is then
+        p = self
+        if self._is_dense():
+            p, idx, is_valid = self._get_dense_index(batch_no, batch_index)
+        else:
+            idx, is_valid = self._get_raw_indices(batch_no, batch_index)
+
+        if stats is not None:
+            mapped = time.perf_counter()
+            stats.add_time('mapping', mapped - start)
+        if self.no_duplicated_data and not is_valid:
+            if stats is not None:
+                stats.add_count('invalid_slots')
+            return None
+
+        example = p.get_example_from_object(idx, p._class_list, p._cumsum_examples_per_class)
+        if stats is not None:
+            stats.add_time('fetch', time.perf_counter() - mapped)
+            stats.add_count('examples')
+        return example
+
+    def get_batch_indices(self, batch_no):
+        """
+            Get the example indices for every example of a batch, or of a range of batches, in one pass.
+
+            Args:
+                batch_no: The number of the batch, or an array of batch numbers.
+
+            Returns:
+                A tuple (idx, is_valid) of arrays. For an integer batch_no both have shape (examples_per_batch,), 
+                for an array of batch numbers they have shape batch_no.shape + (examples_per_batch,). Entries of
+                idx where is_valid is False wrap around to the start of the data. With batch_policy 'fill' the 
+                empty slots of the last batch are those filled from the next epoch.
+        """
+        batch_no = np.asarray(batch_no, dtype = int if self.examples_per_batch_index < _INT64_LIMIT else object)[..., np.newaxis]
+        batch_index = np.arange(self.examples_per_batch)
+        if self.examples_per_batch == 0:
+            shape = batch_no.shape[:-1] + (0,)
+            return np.zeros(shape, dtype = int), np.zeros(shape, dtype = bool)
+
+        if self.stats is not None:
+            start = time.perf_counter()
+
+        if self._is_dense():
+            idx, is_valid = self._get_dense_indices(self._fill_offset + batch_no * self.examples_per_batch + batch_index)
         else:
+            idx, is_valid = self._get_raw_indices(batch_no, batch_index)
+
+        if self.stats is not None:
+            self.stats.add_time('mapping', time.perf_counter() - start)
+        return idx, is_valid
+
+    def _is_dense(self):
+        return self.no_duplicated_data and self.batch_policy != 'pad'
+
+    def _get_invalid_positions(self):
+        """
+            Returns the sorted positions, batch_no * examples_per_batch + batch_index, of the slots whose index is 
+            past the end of the data. There are fewer than examples_per_batch of them, one for each batch_index 
+            whose index is past the end in the last stride point.
+        """
+        if self._invalid_positions is None:
+            E, L, T = self.examples_per_batch, self.examples_per_batch_index, int(self.total_example_count)
+            unwraped_idx = np.array([T + i for i in range(E * L - T)], dtype = int if E * L < _INT64_LIMIT else object)
+            batch_no, batch_index = self._get_batch_from_idx(unwraped_idx)
+            self._invalid_positions = np.sort(batch_no * E + batch_index)
+        return self._invalid_positions
+
+    def _get_dense_indices(self, positions):
+        """
+            Get the indices of the examples at the given positions of the epoch with the empty slots taken out, i.e. 
+            position n is the n-th example of the epoch in order of batch and then of slot.
+
+            Returns:
+                A tuple (idx, is_valid) of arrays with the shape of positions. Positions past the end of the data 
+                are not valid.
+        """
+        T = self.total_example_count
+        if T == 0:
+            return np.zeros(positions.shape, dtype = int), np.zeros(positions.shape, dtype = bool)
+        is_valid = positions < T
+        positions = positions % T
+
+        # The position in the epoch with the empty slots is the position without them plus the number of empty slots
+        # before it
+        invalid_positions = self._get_invalid_positions()
+        positions = positions + np.searchsorted(invalid_positions - np.arange(len(invalid_positions)), positions, side = 'right')
+
+        E = self.examples_per_batch
+        idx, _ = self._get_raw_indices(positions // E, positions % E)
+        return idx, is_valid
+
+    def _get_next_epoch(self):
+        """
+            Returns a copy of the prsample object as it will be after init_prsample, which leaves this object as it 
+            is, to fill the last batch of an epoch from with batch_policy 'fill'.
+        """
+        if self._next_epoch is None:
+            import copy
+
+            next_epoch = copy.copy(self)
+            class_dicts = {id(c) : dict(c) for c in self._classes}
+            next_epoch._classes = [class_dicts[id(c)] for c in self._classes]
+            next_epoch._class_list = [class_dicts[id(c)] for c in self._class_list]
+            next_epoch._added_classes = [class_dicts[id(c)] for c in self._added_classes]
+            next_epoch.unshuffled_class_list = list(self.unshuffled_class_list)
+            next_epoch._flat_index = dict(self._flat_index)
+            next_epoch.stats = None
+            next_epoch.init_prsample()
+            self._next_epoch = next_epoch
+        return self._next_epoch
+
+    def _is_filled(self, batch_no):
+        return self.batch_policy == 'fill' and self.no_duplicated_data and batch_no == self.number_of_batches - 1
+
+    def _get_dense_index(self, batch_no, batch_index):
+        # Returns the prsample object the slot takes its example from, with the index of the example and whether 
+        # the slot holds one
+        p = self
+        position = self._fill_offset + batch_no * self.examples_per_batch + batch_index
+        if position >= self.total_example_count and self._is_filled(batch_no):
+            p = self._get_next_epoch()
+            position -= self.total_example_count
+
+        idx, is_valid = p._get_dense_indices(np.array([position]))
+        return p, idx[0], is_valid[0]
+
+    def get_class_obj_idx(self, indices):
+        """
+            Get the class index, object index and offset within the object of every example index in an array.
+
+            Args:
+                indices: An array of example indices.
+
+            Returns:
+                A tuple (class_idx, obj_idx, offset) of arrays, one entry per example index.
+        """
+        return get_class_obj_idx_from_indices(np.asarray(indices), self._flat_index)
+
+    def _get_batch(self, batch_no):
+        return self.get_batch_with_mask(batch_no)[0]
+
+    def get_batch_with_mask(self, batch_no):
+        """
+            Get a batch together with the mask of the slots that hold an example, so that the empty slots left by 
+            no_duplicated_data can be dropped or masked without looking at each slot. Without no_duplicated_data 
+            every slot holds an example.
+
+            Args:
+                batch_no: The number of the batch.
+
+            Returns:
+                A tuple (batch, mask) where batch is as yielded by iterating over the prsample object and mask is a
+                bool array of shape (examples_per_batch,).
+        """
+        idx, is_valid = self.get_batch_indices(batch_no)
+        if not self.no_duplicated_data:
+            is_valid = np.ones(is_valid.shape, dtype = bool)
+        batch = self._get_batch_from_indices(idx, is_valid)
+
+        if self._is_filled(batch_no) and not np.all(is_valid):
+            # The empty slots at the end of the last batch take the first examples of the next epoch
+            next_epoch = self._get_next_epoch()
+            missing = np.flatnonzero(~is_valid)
+            next_idx, next_is_valid = next_epoch._get_dense_indices(np.arange(len(missing)))
+            examples = next_epoch._get_examples_from_indices(next_idx, next_is_valid)
+            if isinstance(batch, np.ndarray):
+                batch[missing] = examples
+            else:
+                for i, example in zip(missing.tolist(), examples):
+                    batch[i] = example
+            is_valid = is_valid.copy()
+            is_valid[missing] = next_is_valid
+
+        return self._load_batch(batch, is_valid), is_valid
+
+    def _load_batch(self, batch, is_valid):
+        if self.object_loader is None:
+            return batch
+        return [self.load_example(example) if v else None for example, v in zip(batch, is_valid.tolist())]
+
+    def load_example(self, example):
+        """
+            Load the objects of an example with object_loader.
+
+            Args:
+                example: An example object or a row of a batch generated as a NumPy array, of class numbers and 
+                    object indices.
+
+            Returns:
+                A tuple of the loaded objects, in the order of the example's objects.
+        """
+        if not isinstance(example, np.ndarray):
+            example = example.get()
+        values = np.ravel(example).tolist()
+        return tuple(self.load_object(class_no, obj_idx) for class_no, obj_idx in zip(values[0::2], values[1::2]))
+
+    def load_object(self, class_no, obj_idx):
+        """
+            Load an object with object_loader, through its cache if it is a prsample.object_cache.
+        """
+        obj = self.unshuffled_class_list[class_no][obj_idx]
+        if isinstance(self.object_loader, object_cache):
+            return self.object_loader.get((class_no, obj_idx), obj)
+        return self.object_loader(obj)
+
+    def masked(self):
+        """
+            Get an iterator that yields a tuple (batch, mask) per batch, see get_batch_with_mask.
+        """
+        return prsample_iterator(self, with_mask = True)
+
+    def _get_batch_from_indices(self, idx, is_valid):
+        if self.stats is None:
+            return self._get_examples_from_indices(idx, is_valid)
+
+        start = time.perf_counter()
+        examples = self._get_examples_from_indices(idx, is_valid)
+        self.stats.add_time('fetch', time.perf_counter() - start)
+
+        valid_count = int(np.count_nonzero(is_valid)) if self.no_duplicated_data else is_valid.size
+        self.stats.add_count('batches', int(np.prod(is_valid.shape[:-1])))
+        self.stats.add_count('examples', valid_count)
+        self.stats.add_count('invalid_slots', is_valid.size - valid_count)
+        return examples
 
-            idx, _ = self._batch_to_idx(batch_no, batch_index, self.examples_per_batch, self.batch_strides, \
-                self.examples_per_batch_index, self.total_example_count, self.offsets)
-            return self.get_example_from_object(idx, self._class_list, self._cumsum_examples_per_class)
+    def _get_examples_from_indices(self, idx, is_valid):
+        if not self.no_duplicated_data:
+            is_valid = np.ones(is_valid.shape, dtype = bool)
+
+        if self.get_examples_from_indices is not None:
+            examples = self.get_examples_from_indices(idx, self._class_list, self._cumsum_examples_per_class, self._flat_index)
+            # Slots without an example are filled with -1
+            examples[~is_valid] = -1
+            return examples
+
+        return [self.get_example_from_object(i, self._class_list, self._cumsum_examples_per_class) if v else None \
+            for i, v in zip(idx.tolist(), is_valid.tolist())]
 
     def _batch_to_idx(self, index, batch_index, examples_per_batch, batch_strides, \
             examples_per_batch_index, total_example_count, offsets):
         
-        stride_point = batch_strides[batch_index] * (index+batch_index) + offsets[batch_index]
-        unwraped_idx = batch_index + examples_per_batch*(stride_point%examples_per_batch_index)
+        if (examples_per_batch_index + examples_per_batch) * examples_per_batch_index < _INT64_LIMIT and \
+                examples_per_batch * examples_per_batch_index < _INT64_LIMIT:
+            stride_point = batch_strides[batch_index] * (index+batch_index) + offsets[batch_index]
+            unwraped_idx = batch_index + examples_per_batch*(stride_point%examples_per_batch_index)
+
+            idx = unwraped_idx%total_example_count
+            return idx, unwraped_idx < total_example_count
+
+        # The product of a stride and a batch number can overflow int64, so the same arithmetic is done exactly on
+        # Python ints
+        index = np.asarray(index, dtype = object)
+        stride_point = np.asarray(batch_strides, dtype = object)[batch_index] * (index + batch_index) + \
+            np.asarray(offsets, dtype = object)[batch_index]
+        unwraped_idx = batch_index + examples_per_batch * (stride_point % examples_per_batch_index)
+
+        idx = unwraped_idx % total_example_count
+        is_valid = unwraped_idx < total_example_count
+        if isinstance(idx, np.ndarray):
+            is_valid = is_valid.astype(bool)
+            if total_example_count <= _INT64_LIMIT:
+                idx = idx.astype(np.int64)
+        return idx, is_valid
+
+    def _get_raw_indices(self, batch_no, batch_index):
+        """
+            Get the example indices of batch slots, before any batch_policy, with locality_window if it is set and 
+            with a coprime stride per batch_index otherwise.
+
+            Returns:
+                A tuple (idx, is_valid) as for get_batch_indices.
+        """
+        if self.locality_window is not None:
+            if self.examples_per_batch * self.examples_per_batch_index >= _INT64_LIMIT:
+                batch_no = np.asarray(batch_no, dtype = object)
+            return self._window_to_idx(batch_no * self.examples_per_batch + batch_index)
+        if self.permutation is not None:
+            return self._permutation_to_idx(batch_no * self.examples_per_batch + batch_index)
+        return self._batch_to_idx(batch_no, batch_index, self.examples_per_batch, self.batch_strides, \
+            self.examples_per_batch_index, self.total_example_count, self.offsets)
+
+    def _set_window_size(self):
+        # The windows are no larger than the data, and there is at least one so that the mapping is defined
+        T = int(self.total_example_count)
+        self.window_size = max(1, min(self.locality_window, T))
+        self.window_count = max(1, -(-T // self.window_size))
+
+    def _window_fits_int64(self):
+        W, n = self.window_size, self.window_count
+        return max(W * W, n * n, (n + 1) * W, self.examples_per_batch * self.examples_per_batch_index) < _INT64_LIMIT
+
+    def _window_to_idx(self, positions):
+        """
+            The mapping of locality_window. Position n of the epoch, batch_no*examples_per_batch + batch_index, is 
+            in window n // window_size, which takes the block of example indices given by the stride and offset 
+            batch_strides[0] and offsets[0] over the window_count blocks. Within the block it takes the index given 
+            by the stride batch_strides[1] over the window_size indices, turned by offsets[1] times one more than 
+            the block number. Positions past the last block map to themselves, past the end of the data.
 
-        idx = unwraped_idx%total_example_count
-        return idx, unwraped_idx < total_example_count
+            Returns:
+                A tuple (idx, is_valid) as for get_batch_indices.
+        """
+        W, n, T = self.window_size, self.window_count, self.total_example_count
+        block_stride, within_stride = self.batch_strides
+        block_offset, within_offset = self.offsets
+        positions = np.asarray(positions, dtype = int if self._window_fits_int64() else object)
+
+        block = (block_stride * (positions // W) + block_offset) % n
+        within = (within_stride * (positions % W) + within_offset * (block + 1)) % W
+        unwraped_idx = np.where(positions < n * W, block * W + within, positions)
+
+        idx = unwraped_idx % T
+        is_valid = (unwraped_idx < T).astype(bool)
+        if idx.dtype == object and T <= _INT64_LIMIT:
+            idx = idx.astype(np.int64)
+        if idx.ndim == 0:
+            return idx[()], is_valid[()]
+        return idx, is_valid
+
+    def _window_from_idx(self, idx):
+        # The inverse of _window_to_idx for indices below examples_per_batch*examples_per_batch_index
+        W, n = self.window_size, self.window_count
+        inverse_block_stride, inverse_within_stride = [pow(int(stride), -1, m) for stride, m in zip(self.batch_strides, (n, W))]
+        block_offset, within_offset = [int(offset) for offset in self.offsets]
+        idx = np.asarray(idx, dtype = int if self._window_fits_int64() else object)
+
+        block = idx // W
+        within = (inverse_within_stride * ((idx % W - within_offset * (block + 1)) % W)) % W
+        window = (inverse_block_stride * ((block - block_offset) % n)) % n
+        return np.where(idx < n * W, window * W + within, idx)
+
+    def _set_permutation(self, keys):
+        self.permutation_keys = keys
+        self._permutation = self.permutation(int(self.total_example_count), keys)
+
+    def _permutation_to_idx(self, positions):
+        """
+            The mapping of a permutation class. Position n of the epoch, batch_no*examples_per_batch + batch_index, 
+            takes the example index the permutation maps it to, and positions past the end of the data map to 
+            themselves.
+
+            Returns:
+                A tuple (idx, is_valid) as for get_batch_indices.
+        """
+        T = int(self.total_example_count)
+        dtype = int if self.examples_per_batch * self.examples_per_batch_index < _INT64_LIMIT else object
+        scalar = np.ndim(positions) == 0
+        positions = np.array(positions, dtype = dtype, ndmin = 1)
+
+        unwraped_idx = positions.copy()
+        inside = positions < T
+        unwraped_idx[inside] = np.asarray(self._permutation.forward(positions[inside])).astype(dtype)
+
+        idx = unwraped_idx % T
+        is_valid = (unwraped_idx < T).astype(bool)
+        if dtype == object and T <= _INT64_LIMIT:
+            idx = idx.astype(np.int64)
+        if scalar:
+            return idx[0], is_valid[0]
+        return idx, is_valid
+
+    def _permutation_from_idx(self, idx):
+        # The inverse of _permutation_to_idx for indices below examples_per_batch*examples_per_batch_index
+        T = int(self.total_example_count)
+        dtype = int if self.examples_per_batch * self.examples_per_batch_index < _INT64_LIMIT else object
+        positions = np.array(idx, dtype = dtype, ndmin = 1)
+        inside = positions < T
+        positions[inside] = np.asarray(self._permutation.inverse(positions[inside])).astype(dtype)
+        return positions.reshape(np.shape(idx))
+
+    def _find_window_strides(self):
+        # A stride and offset over the blocks and another over the indices within a block
+        block_stride, block_offset = self._find_batch_strides(1, self.window_count)
+        within_stride, within_offset = self._find_batch_strides(1, self.window_size)
+        dtype = int if max(self.window_count, self.window_size) <= _INT64_LIMIT else object
+        return np.array([block_stride[0], within_stride[0]], dtype = dtype), \
+            np.array([block_offset[0], within_offset[0]], dtype = dtype)
 
     def _is_coprime(self, a, b):
         return gcd(a, b) == 1
@@ -191,92 +1012,609 @@ class prsample:
 
         if examples_per_batch_index <= 2:
             batch_strides = np.ones(examples_per_batch, dtype = int)
-            offsets = np.zeros(batch_strides.shape)
+            offsets = np.zeros(batch_strides.shape, dtype = int)
             return batch_strides, offsets
 
         # return np.ones(examples_per_batch, dtype = int)
         assert examples_per_batch_index > 1, 'too many examples per batch'
 
-        batch_strides = np.empty(examples_per_batch, dtype = int)
-        #There must be enough coprimes numbers, i.e. examples_per_batch < copime_count(existing_strides)
-        existing_strides = []
-        for batch_index in range(examples_per_batch):
-            stride = np.random.randint(2, examples_per_batch_index)
-
-            init_stride = stride
-            while not self._is_coprime(stride, examples_per_batch_index) or stride in existing_strides:
-                stride += 1
-                stride = stride % examples_per_batch_index
-                if stride < 2:
-                    stride = 2
-
-                if stride == init_stride:
-                    existing_strides = []
-
-            existing_strides.append(stride)
-
-            if len(existing_strides) == examples_per_batch:
-                existing_strides = []
-            batch_strides[batch_index] = stride
-        offsets = np.random.randint(0, examples_per_batch_index, batch_strides.shape)
+        # The strides are drawn from the units modulo examples_per_batch_index, other than 1. They are all different 
+        # until every unit has been used, after which they start over.
+        prime_factors = get_prime_factors(examples_per_batch_index)
+        unit_count = examples_per_batch_index
+        for p in prime_factors:
+            unit_count = unit_count // p * (p - 1)
+        unit_count -= 1
+
+        def is_coprime(candidates):
+            mask = np.ones(candidates.shape, dtype = bool)
+            for p in prime_factors:
+                mask &= (candidates % p) != 0
+            return mask
+
+        if examples_per_batch_index <= max(8 * examples_per_batch, 1 << 16):
+            # Small enough to list every unit
+            units = np.arange(2, examples_per_batch_index)
+            units = units[is_coprime(units)]
+            rounds = -(-examples_per_batch // len(units))
+            batch_strides = np.concatenate([self._rng.permutation(units) for _ in range(rounds)])[:examples_per_batch]
+        else:
+            # There are far more units than strides needed, so draw candidates and reject non-units and repeats
+            batch_strides = []
+            existing_strides = set()
+            while len(batch_strides) < examples_per_batch:
+                candidates = _random_integers(self._rng, 2, examples_per_batch_index, \
+                    2 * (examples_per_batch - len(batch_strides)) + 16)
+                for stride in candidates[is_coprime(candidates)].tolist():
+                    if stride in existing_strides:
+                        continue
+                    existing_strides.add(stride)
+                    batch_strides.append(stride)
+                    if len(existing_strides) == unit_count:
+                        existing_strides = set()
+                    if len(batch_strides) == examples_per_batch:
+                        break
+            batch_strides = np.array(batch_strides, dtype = int if examples_per_batch_index <= _INT64_LIMIT else object)
+
+        offsets = _random_integers(self._rng, 0, examples_per_batch_index, examples_per_batch)
         return batch_strides, offsets
 
     def __iter__(self):
        ''' Returns the Iterator object '''
        return prsample_iterator(self)
 
+    def shard(self, rank, world_size):
+        """
+            Get a view of the prsample object that yields only the batches of one of world_size ranks. Rank r 
+            gets batches r, r + world_size, r + 2*world_size, ... so the ranks need no communication. Every rank 
+            has the same number of batches, ranks that run past the last batch get batches with no valid examples
+            if no_duplicated_data is set, so that together the ranks see every example exactly once per epoch.
+
+            Args:
+                rank: The rank of this process, from 0 to world_size - 1.
+                world_size: The number of ranks.
 
-    def init_prsample(self):
+            Returns:
+                A prsample_shard view, which follows the prsample object through epochs.
+        """
+        return prsample_shard(self, rank, world_size)
 
-        self.iter_index = 0
-        
-        self.seed += 1
-        np.random.seed(self.seed)
+    def prefetch(self, num_workers = 2, prefetch_batches = 4):
+        """
+            Get an iterator that builds batches in a pool of worker processes, in the same order as iterating 
+            over the prsample object. The callbacks must be picklable, e.g. functions defined at module level.
 
-        if self.shuffle:
-            np.random.shuffle(self._class_list)
+            Args:
+                num_workers: The number of worker processes.
+                prefetch_batches: The maximum number of batches requested ahead of the one being yielded.
+
+            Returns:
+                An iterator over the batches, which should be closed if it is not run to the end.
+        """
+        return prsample_process_iterator(self, num_workers, prefetch_batches)
+
+    def threaded(self, num_threads = 8, prefetch_batches = 2):
+        """
+            Get an iterator that calls get_example_from_obj from a pool of threads, for functions that block on I/O.
+            Examples of the current and the next prefetch_batches batches are fetched concurrently and batches are 
+            yielded in the same order as iterating over the prsample object, as lists of examples, or of their 
+            loaded objects if object_loader is set.
+
+            Args:
+                num_threads: The number of threads fetching examples.
+                prefetch_batches: The maximum number of batches requested ahead of the one being yielded.
+
+            Returns:
+                An iterator over the batches, which should be closed if it is not run to the end.
+        """
+        return prsample_thread_iterator(self, num_threads, prefetch_batches)
+
+    def aiter(self, get_example_from_obj = None, concurrency = 32, prefetch_batches = 2):
+        """
+            Get an asynchronous iterator, for use with async for, that awaits a coroutine per example. Up to 
+            concurrency examples of the current and the next prefetch_batches batches are fetched at once and 
+            batches are yielded in the same order as iterating over the prsample object, as lists of examples. 
+            With object_loader the examples are loaded in the default executor, as they are by iterating.
+
+            Args:
+                get_example_from_obj: A coroutine function taking the same arguments as get_example_from_obj. If 
+                    None, the prsample object's get_example_from_obj is run in the default executor.
+                concurrency: The maximum number of examples being fetched at once.
+                prefetch_batches: The maximum number of batches requested ahead of the one being yielded.
+
+            Returns:
+                An asynchronous iterator over the batches.
+        """
+        if get_example_from_obj is None:
+            get_example_from_object = self.get_example_from_object
+
+            async def get_example_from_obj(index, class_list, cumsum_examples_per_class):
+                import asyncio
+                return await asyncio.get_running_loop().run_in_executor(None, get_example_from_object, \
+                    index, class_list, cumsum_examples_per_class)
 
-        class_count = len(self._class_list)
-        class_example_counts = np.zeros(class_count, dtype = int)
-        running_class_example_count = 0
-        for class_idx in range(class_count):
-            object_list = self._class_list[class_idx]['object_list']
+        return prsample_async_iterator(self, get_example_from_obj, concurrency, prefetch_batches)
 
-            examples_per_object = [self.examples_per_object(class_idx, obj_idx, self._class_list) for obj_idx in range(len(object_list))]
-            
-            cumsum_examples_per_object = np.zeros(len(examples_per_object)+1, dtype=int)
+
+    # The keys of the flattened index that hold the objects of every class and where each class starts in it, which 
+    # are kept between epochs as long as the counts do not depend on the order of the classes
+    _object_index_keys = ['cumsum_examples_per_object', 'stored_first_object_per_class', 'stored_first_example_per_class']
+
+    def _build_object_index(self):
+        """
+            Counts the examples of every object and builds the cumsum over every object of every class, class after
+            class in order of class number, so that it does not change when the classes are shuffled.
+        """
+        class_count = len(self._classes)
+        if self.class_local_counts:
+            self._count_examples_per_object([c for c in self._classes if 'examples_per_object' not in c])
+            examples_per_object = np.concatenate([np.zeros(0, dtype = int)] + [c['examples_per_object'] for c in self._classes])
+        elif self.counts_depend_on_order:
+            # Counted in the order of the epoch, then put in order of class number
+            objects_per_class = np.array([len(c['object_list']) for c in self._class_list], dtype = int)
+            counts = np.split(self._count_examples_per_object(self._class_list), np.cumsum(objects_per_class)[:-1])
+            class_idx = np.argsort([c['class_no'] for c in self._class_list])
+            examples_per_object = np.concatenate([np.zeros(0, dtype = int)] + [counts[i] for i in class_idx])
+        else:
+            examples_per_object = self._count_examples_per_object(self._classes)
+
+        # If the total could overflow int64 it is kept as Python ints
+        if np.sum(examples_per_object, dtype = float) < _INT64_LIMIT / 2:
+            cumsum_examples_per_object = np.zeros(len(examples_per_object) + 1, dtype = int)
             cumsum_examples_per_object[1:] = np.cumsum(examples_per_object)
-            cumsum_examples_per_object += running_class_example_count
+        else:
+            cumsum_examples_per_object = np.zeros(len(examples_per_object) + 1, dtype = object)
+            cumsum_examples_per_object[1:] = np.cumsum(examples_per_object.astype(object))
 
-            self._class_list[class_idx]['cumsum_examples_per_object'] = cumsum_examples_per_object
-            class_example_counts[class_idx] = sum(examples_per_object)
-            running_class_example_count += class_example_counts[class_idx]
+        stored_first_object_per_class = np.zeros(class_count, dtype = int)
+        stored_first_object_per_class[1:] = np.cumsum([len(c['object_list']) for c in self._classes[:-1]])
 
-        self._cumsum_examples_per_class = np.zeros(len(class_example_counts) + 1, dtype=int)
-        self._cumsum_examples_per_class[1:] = np.cumsum(class_example_counts)    
+        self._flat_index['cumsum_examples_per_object'] = cumsum_examples_per_object
+        self._flat_index['stored_first_object_per_class'] = stored_first_object_per_class
+        self._flat_index['stored_first_example_per_class'] = cumsum_examples_per_object[stored_first_object_per_class]
+        self._object_index_valid = True
+        self._object_index_buffer = None
+        return
 
-        self.total_example_count = self._cumsum_examples_per_class[-1]
+    def _splice_object_index(self, class_dicts):
+        """
+            Counts the examples of the objects of the given classes, whose counts are class local, and appends their 
+            cumsums to the end of the flattened index, where they replace the parts of the index those classes had. 
+            The classes are found by where they start in the index, so the other classes are neither moved nor 
+            counted again. The parts replaced are dropped by building the index in full once they outnumber the 
+            objects in use.
+        """
+        cumsum_examples_per_object = self._flat_index['cumsum_examples_per_object']
+        objects_per_class = np.array([len(c['object_list']) for c in class_dicts], dtype = int)
+        object_count = sum(len(c['object_list']) for c in self._classes)
+        if len(cumsum_examples_per_object) - 1 + np.sum(objects_per_class) > 2 * object_count:
+            self._build_object_index()
+            return
+
+        examples_per_object = self._count_examples_per_object(class_dicts)
+        end = cumsum_examples_per_object[-1]
+        dtype = cumsum_examples_per_object.dtype
+        if dtype != object and float(end) + np.sum(examples_per_object, dtype = float) >= _INT64_LIMIT / 2:
+            dtype = np.dtype(object)
+        if dtype == object:
+            examples_per_object = examples_per_object.astype(object)
+        appended = end + np.cumsum(examples_per_object)
+
+        # The cumsums are written after the end of the index in the buffer, if it has room, so that the index is not
+        # copied. Otherwise the index is copied to a new buffer of twice the size needed.
+        used, size = len(cumsum_examples_per_object), len(cumsum_examples_per_object) + len(appended)
+        buffer = self._object_index_buffer
+        if buffer is None or cumsum_examples_per_object.base is not buffer or buffer.dtype != dtype or len(buffer) < size:
+            buffer = np.zeros(2 * size, dtype = dtype)
+            buffer[:used] = cumsum_examples_per_object
+            self._object_index_buffer = buffer
+        buffer[used:size] = appended
+        cumsum_examples_per_object = buffer[:size]
+
+        # Each class starts at the last entry before its objects, i.e. at the end of the index as it was for the first
+        first_object = used - 1 + np.cumsum(objects_per_class) - objects_per_class
+        class_count = len(self._classes)
+        stored_first_object_per_class = np.zeros(class_count, dtype = int)
+        stored_first_object_per_class[:len(self._flat_index['stored_first_object_per_class'])] = \
+            self._flat_index['stored_first_object_per_class']
+        stored_first_object_per_class[[c['class_no'] for c in class_dicts]] = first_object
+
+        self._flat_index['cumsum_examples_per_object'] = cumsum_examples_per_object
+        self._flat_index['stored_first_object_per_class'] = stored_first_object_per_class
+        self._flat_index['stored_first_example_per_class'] = cumsum_examples_per_object[stored_first_object_per_class]
+        return
 
-        self.number_of_batches = int(np.ceil(self.total_example_count / self.examples_per_batch))
+    def _stored_examples_per_class(self):
+        # The number of examples of each class, in order of class number
+        first_object = self._flat_index['stored_first_object_per_class']
+        objects_per_class = np.array([len(c['object_list']) for c in self._classes], dtype = int)
+        cumsum_examples_per_object = self._flat_index['cumsum_examples_per_object']
+        return cumsum_examples_per_object[first_object + objects_per_class] - cumsum_examples_per_object[first_object]
+
+    def _set_class_cumsums(self):
+        """
+            Points the per class cumsum_examples_per_object of every class at its part of the flattened index, and 
+            sets the index of the first example of each class in this epoch.
+        """
+        cumsum_examples_per_object = self._flat_index['cumsum_examples_per_object']
+        stored_first_object_per_class = self._flat_index['stored_first_object_per_class'].tolist()
+        first_example = self._flat_index['cumsum_examples_per_class'].tolist()
+        for class_idx, class_dict in enumerate(self._class_list):
+            first_object = stored_first_object_per_class[class_dict['class_no']]
+            class_dict['flat_index'] = self._flat_index
+            class_dict['cumsum_examples_per_object'] = \
+                cumsum_examples_per_object[first_object:first_object+len(class_dict['object_list'])+1]
+            class_dict['first_example'] = first_example[class_idx]
+        return
 
-        self.examples_per_batch_index = int(np.ceil(self.total_example_count/self.examples_per_batch))
+    def _count_examples_per_object(self, class_dicts):
+        """
+            Counts the examples of every object of the given classes, class after class, keeping the counts of each
+            class in the class dict if the counts are class local.
+        """
+        objects_per_class = np.array([len(c['object_list']) for c in class_dicts], dtype = int)
+        if self.examples_per_objects is not None:
+            examples_per_object = _as_counts(self.examples_per_objects(objects_per_class))
+            assert examples_per_object.shape == (np.sum(objects_per_class),), \
+                'examples_per_objects must return one count per object.'
+        else:
+            class_idx = {c['class_no'] : class_idx for class_idx, c in enumerate(self._class_list)}
+            examples_per_object = _as_counts([self.examples_per_object(class_idx[c['class_no']], obj_idx, self._class_list) \
+                for c in class_dicts for obj_idx in range(len(c['object_list']))])
+
+        if self.class_local_counts:
+            for c, counts in zip(class_dicts, np.split(examples_per_object, np.cumsum(objects_per_class)[:-1])):
+                c['examples_per_object'] = counts
+        return examples_per_object
+
+    def _apply_updates(self):
+        """
+            Applies the changes made by add_objects, add_class and remove_objects since the last epoch.
+
+            Returns:
+                A list of the class dicts of the classes changed or added.
+        """
+        changed_classes = []
+        for c in self._classes:
+            if 'pending_object_list' in c:
+                c['object_list'] = c.pop('pending_object_list')
+                self.unshuffled_class_list[c['class_no']] = c['object_list']
+                c.pop('examples_per_object', None)
+                if isinstance(self.object_loader, object_cache):
+                    self.object_loader.discard_class(c['class_no'])
+                changed_classes.append(c)
+        for c in self._added_classes:
+            self.unshuffled_class_list.append(c['object_list'])
+            self._class_list.append(c)
+            if not any(c is changed for changed in changed_classes):
+                changed_classes.append(c)
+        self._added_classes = []
+        # Without class local counts a change to one class can change the counts of every class
+        if len(changed_classes) > 0 and not self.class_local_counts:
+            self._object_index_valid = False
+        return changed_classes
+
+    def _get_pending_object_list(self, class_no):
+        assert isinstance(class_no, int) and 0 <= class_no < len(self._classes), 'class_no must be an existing class.'
+        c = self._classes[class_no]
+        if 'pending_object_list' not in c:
+            c['pending_object_list'] = list(c['object_list'])
+        return c['pending_object_list']
+
+    def add_objects(self, class_no, objects):
+        """
+            Add objects to the end of a class. Like the other updates this takes effect from the next epoch, i.e. the 
+            next call to init_prsample. If the counts are class local only the objects of the classes changed are 
+            counted again and added to the index over the objects, costing time in proportion to their number. 
+            Otherwise every object is counted again and the index built again.
+
+            Args:
+                class_no: The number of the class, i.e. its index in the class list given to the constructor.
+                objects: A list of the objects to add.
+        """
+        self._get_pending_object_list(class_no).extend(objects)
+        self._next_epoch = None
+        return
+
+    def add_class(self, objects):
+        """
+            Add a class, taking effect from the next epoch.
+
+            Args:
+                objects: A list of the objects of the class.
+
+            Returns:
+                The class number of the new class.
+        """
+        data = {}
+        data['class_no'] = len(self._classes)
+        data['object_list'] = list(objects)
+        self._classes.append(data)
+        self._added_classes.append(data)
+        self._next_epoch = None
+        return data['class_no']
+
+    def remove_objects(self, class_no, obj_indices):
+        """
+            Remove objects from a class, taking effect from the next epoch. The objects after those removed move 
+            down to fill the gaps.
+
+            Args:
+                class_no: The number of the class, i.e. its index in the class list given to the constructor.
+                obj_indices: The indices of the objects to remove, within the class as it will be after the updates
+                    made so far.
+        """
+        object_list = self._get_pending_object_list(class_no)
+        obj_indices = sorted(set(obj_indices), reverse = True)
+        assert all(isinstance(obj_idx, (int, np.integer)) and 0 <= obj_idx < len(object_list) for obj_idx in obj_indices), \
+            'obj_indices must be indices of objects of the class.'
+        for obj_idx in obj_indices:
+            del object_list[obj_idx]
+        self._next_epoch = None
+        return
+
+    def init_prsample(self):
+
+        if self.stats is not None:
+            if self.epoch_count > 0:
+                self.stats.end_epoch(self.epoch_count)
+            start = time.perf_counter()
+
+        # With batch_policy 'fill' the epoch starts after the examples that filled the last batch of the epoch before
+        if self.batch_policy == 'fill' and self.epoch_count > 0 and self.examples_per_batch > 0:
+            self._fill_offset = -(int(self.total_example_count) - self._fill_offset) % self.examples_per_batch
+        self._invalid_positions = None
+        self._next_epoch = None
+
+        self.iter_index = 0
+        self._resume_index = 0
+        self.epoch_count += 1
+
+        changed_classes = self._apply_updates()
+        
+        self.seed += 1
+        self._rng = np.random.default_rng(self.seed)
+
+        if self.shuffle:
+            self._rng.shuffle(self._class_list)
+
+        # The class level part of the index is shared with every class so that the scalar example
+        # functions, which only see the class list, can use it
+        class_no = np.array([c['class_no'] for c in self._class_list], dtype = int)
+        objects_per_class = np.array([len(c['object_list']) for c in self._class_list], dtype = int)
+        cumsum_objects_per_class = np.zeros(len(self._class_list) + 1, dtype = int)
+        cumsum_objects_per_class[1:] = np.cumsum(objects_per_class)
+
+        object_index = self._flat_index if self._object_index_valid and not self.counts_depend_on_order else {}
+        self._flat_index = {key : object_index[key] for key in self._object_index_keys if key in object_index}
+        self._flat_index['cumsum_objects_per_class'] = cumsum_objects_per_class
+        self._flat_index['class_no'] = class_no
+        for class_dict in self._class_list:
+            class_dict['flat_index'] = self._flat_index
+
+        if len(object_index) == 0:
+            self._build_object_index()
+        elif len(changed_classes) > 0:
+            self._splice_object_index(changed_classes)
+
+        # Only the class level cumsum depends on the order of the classes
+        examples_per_class = self._stored_examples_per_class()[class_no]
+        self._cumsum_examples_per_class = np.zeros(len(self._class_list) + 1, dtype = examples_per_class.dtype)
+        self._cumsum_examples_per_class[1:] = np.cumsum(examples_per_class)
+        self._flat_index['cumsum_examples_per_class'] = self._cumsum_examples_per_class
+        self._set_class_cumsums()
+
+        self.total_example_count = self._cumsum_examples_per_class[-1]
+
+        if self.locality_window is None:
+            self.examples_per_batch_index = -(-int(self.total_example_count) // self.examples_per_batch)
+        else:
+            # The batches cover whole windows, and there are none without data
+            self._set_window_size()
+            self.examples_per_batch_index = -(-self.window_count * self.window_size // self.examples_per_batch) \
+                if self.total_example_count > 0 else 0
+        self._fill_offset = min(self._fill_offset, int(self.total_example_count))
+        self._set_number_of_batches()
 
         # print('examples_per_batch_index', self.examples_per_batch_index)
         # print('examples_per_batch', self.examples_per_batch)
 
         # Find the strides for the 
-        self.batch_strides, self.offsets = self._find_batch_strides(self.examples_per_batch, self.examples_per_batch_index)
+        if self.stats is not None:
+            strides_start = time.perf_counter()
+        if self.permutation is not None:
+            # The permutation needs no strides
+            self._set_permutation(self.permutation.random_keys(int(self.total_example_count), self._rng))
+            self.batch_strides, self.offsets = np.zeros(0, dtype = int), np.zeros(0, dtype = int)
+        elif self.locality_window is None:
+            self.batch_strides, self.offsets = self._find_batch_strides(self.examples_per_batch, self.examples_per_batch_index)
+        else:
+            self.batch_strides, self.offsets = self._find_window_strides()
         # print('batch_strides', self.batch_strides)
         # print()
+        if self.stats is not None:
+            end = time.perf_counter()
+            self.stats.add_time('stride_search', end - strides_start)
+            self.stats.add_time('init', end - start)
         return
 
-    def run_self_checks(self):
+    def _set_number_of_batches(self):
+        if self.batch_policy == 'fill' and self.no_duplicated_data:
+            self.number_of_batches = -(-(int(self.total_example_count) - self._fill_offset) // self.examples_per_batch)
+        else:
+            self.number_of_batches = self.examples_per_batch_index
+
+    def __getstate__(self):
+        # Copies, such as those sent to the worker processes of prefetch, do not get the room to spare of the index, 
+        # which they must not append to
+        state = dict(self.__dict__)
+        state['_object_index_buffer'] = None
+        return state
+
+    def state_dict(self):
+        """
+            Get the sampling state, from which load_state_dict can resume at the next batch without rebuilding 
+            anything. The arrays are shared with the prsample object, which replaces rather than modifies them.
+
+            Returns:
+                A dict of the seed, epoch count, shuffled class order, index arrays, batch strides, offsets, the 
+                position within the epoch of the iterator that last yielded a batch and the number of examples the 
+                epoch starts after with batch_policy 'fill'.
+        """
+        state = {}
+        state['examples_per_batch'] = self.examples_per_batch
+        state['seed'] = self.seed
+        state['epoch_count'] = self.epoch_count
+        state['iter_index'] = self.iter_index
         if self.examples_per_batch > 0:
+            state['total_example_count'] = int(self.total_example_count)
+            state['examples_per_batch_index'] = self.examples_per_batch_index
+            state['batch_strides'] = self.batch_strides
+            state['offsets'] = self.offsets
+            state['fill_offset'] = self._fill_offset
+            if self.permutation is not None:
+                state['permutation_keys'] = self.permutation_keys
+            state['cumsum_examples_per_class'] = self._cumsum_examples_per_class
+            state['flat_index'] = dict(self._flat_index)
+        return state
+
+    def load_state_dict(self, state):
+        """
+            Restore the sampling state from state_dict. The next iterator then continues from the batch after the 
+            last one taken when the state was saved, later iterators start at the beginning of the epoch as usual. 
+            The cost does not depend on how far into the epoch that was.
+
+            Args:
+                state: A dict returned by state_dict of a prsample object over the same class list.
+        """
+        assert state['examples_per_batch'] == self.examples_per_batch, 'examples_per_batch must match the saved state.'
+
+        self.seed = state['seed']
+        self.epoch_count = state['epoch_count']
+        self.iter_index = state['iter_index']
+        self._resume_index = state['iter_index']
+        if self.examples_per_batch > 0:
+            flat_index = dict(state['flat_index'])
+            assert len(flat_index['class_no']) == len(self._class_list), 'the class list must match the saved state.'
+
+            classes = {c['class_no'] : c for c in self._class_list}
+            self._class_list = [classes[class_no] for class_no in flat_index['class_no'].tolist()]
+            self._flat_index = flat_index
+            self._object_index_valid = True
+            self._object_index_buffer = None
+            self._set_class_cumsums()
+
+            self._cumsum_examples_per_class = state['cumsum_examples_per_class']
+            self.total_example_count = state['total_example_count']
+            self.examples_per_batch_index = state['examples_per_batch_index']
+            self.batch_strides = state['batch_strides']
+            self.offsets = state['offsets']
+            if self.locality_window is not None:
+                self._set_window_size()
+            if self.permutation is not None:
+                self._set_permutation(state['permutation_keys'])
+            self._fill_offset = int(state.get('fill_offset', 0))
+            self._set_number_of_batches()
+        self._invalid_positions = None
+        self._next_epoch = None
+        return
+
+    def save_plan(self, path):
+        """
+            Write the sampling state to a directory, with one .npy file per array, so that other processes can 
+            memory map it with load_plan rather than each building and holding their own index.
+
+            Args:
+                path: The directory to write the plan to, which is created if needed.
+        """
+        import os
+        import json
+
+        os.makedirs(path, exist_ok = True)
+        state = self.state_dict()
+        meta = {}
+        for key, value in state.items():
+            if isinstance(value, dict):
+                for array_key, array in value.items():
+                    np.save(os.path.join(path, key + '.' + array_key + '.npy'), array)
+                meta[key] = sorted(value.keys())
+            elif isinstance(value, np.ndarray):
+                np.save(os.path.join(path, key + '.npy'), value)
+            else:
+                meta[key] = value
+
+        with open(os.path.join(path, 'plan.json'), 'w') as f:
+            json.dump(meta, f)
+        return
+
+    def load_plan(self, path, mmap_mode = 'r'):
+        """
+            Restore the sampling state from a directory written by save_plan. The arrays are memory mapped, so 
+            processes that load the same plan share one copy of them and only the class list is touched.
+
+            Args:
+                path: The directory the plan was written to.
+                mmap_mode: The mode to memory map the arrays with, see numpy.load.
+        """
+        import os
+        import json
+
+        with open(os.path.join(path, 'plan.json'), 'r') as f:
+            meta = json.load(f)
+
+        state = {}
+        for key, value in meta.items():
+            if isinstance(value, list):
+                state[key] = {array_key : _load_array(os.path.join(path, key + '.' + array_key + '.npy'), mmap_mode) \
+                    for array_key in value}
+            else:
+                state[key] = value
+        for key in ['batch_strides', 'offsets', 'cumsum_examples_per_class', 'permutation_keys']:
+            file_name = os.path.join(path, key + '.npy')
+            if os.path.exists(file_name):
+                state[key] = _load_array(file_name, mmap_mode)
+
+        self.load_state_dict(state)
+        return
+
+    def run_self_checks(self, sample_size = None, confidence = 0.99, chunk_size = 1 << 20, seed = None):
+        """
+            Checks that every example index is used exactly once by the batches of an epoch and that the examples 
+            are all different and valid.
+
+            Args:
+                sample_size: If None every batch and example is checked. Otherwise this many random batch slots, 
+                    example indices and examples are checked.
+                confidence: The confidence level of the bound returned when sampling.
+                chunk_size: The number of batch slots to check at a time when checking every batch.
+                seed: The seed of the random samples. The sampling state of the prsample is not changed.
+
+            Returns:
+                The upper bound, at the given confidence, on the fraction of batch slots, example indices or examples 
+                that could be wrong. This is 0 when every batch and example is checked.
+        """
+        # Without any batch slots or examples there is nothing to check, nor to draw samples from
+        if self.examples_per_batch == 0 or self.examples_per_batch_index == 0 or self.total_example_count == 0:
+            return 0.0
+
+        if sample_size is None:
             self._test_example_mapping(self.total_example_count, self._class_list, \
                     self.unshuffled_class_list, self.get_example_from_object, self._cumsum_examples_per_class)
-            self._test_batch_to_index_mapping(self.examples_per_batch, self.examples_per_batch_index, \
-                    self.batch_strides, self.total_example_count, self.offsets)
-        return
+            E, L, T = self.examples_per_batch, self.examples_per_batch_index, self.total_example_count
+            get_raw_batch_indices = lambda batch_no: self._get_raw_indices(batch_no[:, np.newaxis], np.arange(E))
+            self._test_batch_to_index_mapping(get_raw_batch_indices, E, L, T, T, chunk_size)
+            if self._is_dense():
+                # The examples the epoch starts after were taken by the last batch of the epoch before
+                self._test_batch_to_index_mapping(self.get_batch_indices, E, self.number_of_batches, T, \
+                    T - self._fill_offset, chunk_size)
+            return 0.0
+
+        rng = np.random.default_rng(seed)
+        self._test_sampled_batch_to_index_mapping(rng, sample_size)
+        self._test_sampled_example_mapping(rng, sample_size)
+
+        # None of the samples failed, so by the rule of three the failure rate is below -ln(1 - confidence)/n
+        return -np.log1p(-confidence) / sample_size
 
     # This test that given all expected indicies all outputs are unique
     def _test_example_mapping(self, total_example_count, class_list, unshuffled_class_list,
@@ -292,14 +1630,80 @@ class prsample:
                     assert(ex.is_valid(unshuffled_class_list))
         assert len(seen_examples) == total_example_count, str(len(seen_examples)) + ' ' + str(total_example_count)
 
-    def _test_batch_to_index_mapping(self, examples_per_batch, examples_per_batch_index, batch_strides, \
-            total_example_count, offsets):
-        seen_indicies = set()
-        for index in range(examples_per_batch_index):
-            for batch_index in range(examples_per_batch):
-                idx, is_valid = self._batch_to_idx(index, batch_index, examples_per_batch, batch_strides, \
-                    examples_per_batch_index, total_example_count, offsets)
-                if is_valid:
-                    seen_indicies.add(idx)
-
-        assert len(seen_indicies) == total_example_count, 'seen_indicies: ' + str(len(seen_indicies)) + ' total_example_count: ' +  str(total_example_count)
+    def _test_batch_to_index_mapping(self, get_batch_indices, examples_per_batch, batch_count, total_example_count, \
+            expected_count, chunk_size):
+        # A bit per example index is set as it is seen. Each chunk of batches is sorted so that the bits of a byte
+        # can be set together.
+        seen_indicies = np.zeros((total_example_count + 7) // 8, dtype = np.uint8)
+        seen_count = 0
+        batches_per_chunk = max(1, chunk_size // examples_per_batch)
+        for first_batch in range(0, batch_count, batches_per_chunk):
+            batch_no = np.arange(first_batch, min(first_batch + batches_per_chunk, batch_count))
+            idx, is_valid = get_batch_indices(batch_no)
+            idx = np.sort(idx[is_valid])
+            if len(idx) == 0:
+                continue
+            assert idx[0] >= 0 and idx[-1] < total_example_count, 'index out of range'
+            assert np.all(idx[1:] != idx[:-1]), 'index seen twice'
+
+            byte_idx = idx >> 3
+            bits = np.left_shift(1, idx & 7).astype(np.uint8)
+            assert not np.any(seen_indicies[byte_idx] & bits), 'index seen twice'
+
+            byte_start = np.flatnonzero(np.r_[True, byte_idx[1:] != byte_idx[:-1]])
+            seen_indicies[byte_idx[byte_start]] |= np.bitwise_or.reduceat(bits, byte_start)
+            seen_count += len(idx)
+
+        # No index was seen twice so every index was seen if the counts match
+        assert seen_count == expected_count, 'seen_indicies: ' + str(seen_count) + ' expected_count: ' + \
+            str(expected_count)
+
+    def _get_batch_from_idx(self, idx):
+        """
+            The inverse of get_batch_indices for example indices below examples_per_batch*examples_per_batch_index.
+
+            Returns:
+                A tuple (batch_no, batch_index) of arrays.
+        """
+        E, L = self.examples_per_batch, self.examples_per_batch_index
+        if self.locality_window is not None or self.permutation is not None:
+            positions = self._window_from_idx(idx) if self.locality_window is not None else self._permutation_from_idx(idx)
+            return (positions // E).astype(int if L < _INT64_LIMIT else object), (positions % E).astype(int)
+
+        batch_index = (idx % E).astype(int)
+        stride_point = idx // E
+        inverse_strides = np.array([pow(int(stride), -1, L) for stride in self.batch_strides], dtype = object)
+        offsets = np.asarray(self.offsets, dtype = object)
+        batch_no = (inverse_strides[batch_index] * ((stride_point - offsets[batch_index]) % L) - batch_index) % L
+        return batch_no.astype(int if L < _INT64_LIMIT else object), batch_index
+
+    def _test_sampled_batch_to_index_mapping(self, rng, sample_size):
+        E, L, total = self.examples_per_batch, self.examples_per_batch_index, self.total_example_count
+        moduli = [L] * len(self.batch_strides) if self.locality_window is None else [self.window_count, self.window_size]
+        assert all(self._is_coprime(int(stride), m) for stride, m in zip(self.batch_strides, moduli)), \
+            'batch stride not coprime'
+
+        # Random batch slots map to indices that map back to the same slots
+        batch_no = _random_integers(rng, 0, L, sample_size)
+        batch_index = rng.integers(E, size = sample_size)
+        idx, is_valid = self._get_raw_indices(batch_no, batch_index)
+        assert np.all((idx >= 0) & (idx < total)), 'index out of range'
+        inverse_batch_no, inverse_batch_index = self._get_batch_from_idx(idx[is_valid])
+        assert np.array_equal(inverse_batch_no, batch_no[is_valid]), 'batch slots share an index'
+        assert np.array_equal(inverse_batch_index, batch_index[is_valid]), 'batch slots share an index'
+
+        # Random indices are used by a batch slot
+        idx = _random_integers(rng, 0, total, sample_size)
+        batch_no, batch_index = self._get_batch_from_idx(idx)
+        forward_idx, is_valid = self._get_raw_indices(batch_no, batch_index)
+        assert np.all(is_valid) and np.array_equal(forward_idx, idx), 'index not used by any batch'
+
+    def _test_sampled_example_mapping(self, rng, sample_size):
+        seen_examples = {}
+        for idx in _random_integers(rng, 0, self.total_example_count, sample_size).tolist():
+            ex = self.get_example_from_object(idx, self._class_list, self._cumsum_examples_per_class)
+            assert ex is not None, 'no example for index ' + str(idx)
+            assert seen_examples.setdefault(ex, idx) == idx, 'indices ' + str(seen_examples[ex]) + ' and ' + \
+                str(idx) + ' give the same example'
+            if ex.is_valid != None:
+                assert ex.is_valid(self.unshuffled_class_list)
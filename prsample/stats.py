@@ -0,0 +1,74 @@
+class prsample_stats():
+    '''
+        Timers and counters for the phases of a prsample. Pass an instance as the stats argument of prsample to
+        turn them on, without one the prsample only checks that stats is None on each call.
+
+        The phases timed are:
+            init: init_prsample, including the stride search
+            stride_search: _find_batch_strides
+            mapping: batch numbers to example indices
+            fetch: example indices to examples, i.e. get_example_from_obj or get_examples_from_indices
+
+        The counters are:
+            batches: the batches built
+            examples: the examples built, one per valid slot
+            invalid_slots: the slots left empty under no_duplicated_data
+
+        Batches built in the worker processes of prefetch are not counted, as each worker has its own copy.
+    '''
+    def __init__(self, callback = None):
+        """
+            Args:
+                callback: Called with the totals of each epoch as it ends, see end_epoch.
+        """
+        self.callback = callback
+        self.reset()
+
+    def reset(self):
+        self.seconds = {}
+        self.counts = {}
+        self.epochs = []
+        self._epoch_seconds = {}
+        self._epoch_counts = {}
+
+    def add_time(self, phase, seconds):
+        self.seconds[phase] = self.seconds.get(phase, 0.0) + seconds
+        self._epoch_seconds[phase] = self._epoch_seconds.get(phase, 0.0) + seconds
+
+    def add_count(self, name, count = 1):
+        self.counts[name] = self.counts.get(name, 0) + count
+        self._epoch_counts[name] = self._epoch_counts.get(name, 0) + count
+
+    def end_epoch(self, epoch):
+        """
+            Closes the totals of an epoch, appends them to epochs and passes them to the callback.
+
+            Args:
+                epoch: The number of the epoch, the epoch_count of the prsample.
+
+            Returns:
+                A dict of the epoch number and the seconds and counts of the epoch.
+        """
+        totals = {'epoch' : epoch, 'seconds' : self._epoch_seconds, 'counts' : self._epoch_counts}
+        self.epochs.append(totals)
+        self._epoch_seconds = {}
+        self._epoch_counts = {}
+        if self.callback is not None:
+            self.callback(totals)
+        return totals
+
+    def snapshot(self):
+        """
+            Returns:
+                A dict of the seconds and counts since the last reset, those of the current epoch and the list of
+                the totals of each epoch that has ended.
+        """
+        return {'seconds' : dict(self.seconds), 'counts' : dict(self.counts), \
+            'epoch' : {'seconds' : dict(self._epoch_seconds), 'counts' : dict(self._epoch_counts)}, \
+            'epochs' : list(self.epochs)}
+
+    def __getstate__(self):
+        # Copies sent to worker processes do not report back, so the callback is not needed there and may not pickle
+        state = dict(self.__dict__)
+        state['callback'] = None
+        return state
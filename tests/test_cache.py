@@ -0,0 +1,183 @@
+import threading
+import pytest
+import numpy as np
+import prsample as prs
+import prsample.examples as prse
+
+from test_prsample import build_class_list
+
+def load_object(obj):
+    return np.full(4, int(obj), dtype = np.int64)
+
+class counted_loader():
+    def __init__(self):
+        self.loads = []
+        self._lock = threading.Lock()
+
+    def __call__(self, obj):
+        with self._lock:
+            self.loads.append(obj)
+        return load_object(obj)
+
+def assert_loaded_batches_equal(batches, expected_batches):
+    assert len(batches) == len(expected_batches)
+    for batch, expected_batch in zip(batches, expected_batches):
+        assert len(batch) == len(expected_batch)
+        for loaded_example, expected_example in zip(batch, expected_batch):
+            if expected_example is None:
+                assert loaded_example is None
+            else:
+                assert len(loaded_example) == len(expected_example)
+                assert all(np.array_equal(a, b) for a, b in zip(loaded_example, expected_example))
+
+def test_object_cache():
+
+    loader = counted_loader()
+    # Room for two of the 32 byte objects
+    cache = prs.object_cache(loader, 64)
+
+    assert np.array_equal(cache.get((0, 0), '5'), load_object('5'))
+    cache.get((0, 1), '6')
+    cache.get((0, 0), '5')
+    # (0, 1) is the least recently used
+    cache.get((1, 0), '7')
+    assert cache.snapshot() == {'hits' : 1, 'misses' : 3, 'evictions' : 1, 'objects' : 2, 'bytes' : 64}
+    cache.get((0, 0), '5')
+    cache.get((0, 1), '6')
+    assert loader.loads == ['5', '6', '7', '6']
+
+    cache.discard_class(1)
+    assert len(cache) == 2
+    cache.discard_class(0)
+    assert len(cache) == 0 and cache.bytes == 0
+
+    # Objects larger than the budget are not cached
+    small_cache = prs.object_cache(loader, 16)
+    small_cache.get((0, 0), '5')
+    assert len(small_cache) == 0 and small_cache.snapshot()['misses'] == 1
+    return
+
+@pytest.mark.parametrize("batched", [True, False])
+@pytest.mark.parametrize("example_class", [prse.Ordered_In_Class_Pair_Example, prse.Pos_Anc_Neg_Triplet_Example])
+def test_object_loader(example_class, batched):
+    import asyncio
+
+    class_list = build_class_list(4, lambda x : x + 2)
+    args = [example_class] if batched else [example_class.examples_per_obj, example_class.get_example_from_obj]
+    p = prs.prsample(class_list, 5, *args, seed = 2)
+    loader = counted_loader()
+    cache = prs.object_cache(loader, 1 << 20)
+    q = prs.prsample(class_list, 5, *args, seed = 2, object_loader = cache)
+
+    object_count = sum(len(c) for c in class_list)
+    for index, (batch, loaded_batch) in enumerate(zip(p, q)):
+        for example, loaded_example in zip(batch, loaded_batch):
+            values = np.ravel(example if batched else example.get()).tolist()
+            objects = [class_list[class_no][obj_idx] for class_no, obj_idx in zip(values[0::2], values[1::2])]
+            assert len(loaded_example) == len(objects)
+            for obj, loaded_object in zip(objects, loaded_example):
+                assert np.array_equal(loaded_object, load_object(obj))
+
+    # Each object is loaded once however many examples it is in
+    assert sorted(loader.loads) == sorted(set(loader.loads))
+    assert len(loader.loads) == object_count
+    assert cache.snapshot()['hits'] > 0
+
+    # Without a cache the loader is called for every object of every example
+    r = prs.prsample(class_list, 5, *args, seed = 2, object_loader = load_object)
+    assert_loaded_batches_equal([r._get_batch(index) for index in range(len(r))], \
+        [q._get_batch(index) for index in range(len(q))])
+
+    # aiter loads the examples too
+    async def collect():
+        return [batch async for batch in r.aiter(concurrency = 3)]
+
+    assert_loaded_batches_equal(asyncio.run(collect()), list(q))
+    return
+
+def test_object_loader_threaded():
+    import asyncio
+
+    class_list = build_class_list(4, lambda x : x + 2)
+    loader = counted_loader()
+    p = prs.prsample(class_list, 5, prse.Ordered_In_Class_Pair_Example.examples_per_obj, 
+        prse.Ordered_In_Class_Pair_Example.get_example_from_obj, seed = 2, no_duplicated_data = True, 
+        object_loader = prs.object_cache(loader, 1 << 20))
+
+    expected = list(p)
+    p.object_loader.clear()
+    with p.threaded(num_threads = 4) as batches:
+        assert_loaded_batches_equal(list(batches), expected)
+    assert p.object_loader.snapshot()['hits'] > 0
+
+    # Copies of the cache, as sent to worker processes, start empty
+    with p.prefetch(num_workers = 2) as batches:
+        assert_loaded_batches_equal(list(batches), expected)
+
+    async def collect():
+        return [batch async for batch in p.aiter(concurrency = 4)]
+
+    p.object_loader.clear()
+    assert_loaded_batches_equal(asyncio.run(collect()), expected)
+    assert p.object_loader.snapshot()['hits'] > 0
+    return
+
+def test_shared_object_cache():
+
+    loader = counted_loader()
+    # Room for three of the 32 byte objects
+    with prs.shared_object_cache(loader, 100, 32) as cache:
+        assert cache.slot_count == 3
+        for obj_idx in range(3):
+            assert np.array_equal(cache.get((0, obj_idx), str(obj_idx)), load_object(str(obj_idx)))
+        cache.get((0, 0), '0')
+        # (0, 1) is the least recently used
+        cache.get((1, 0), '7')
+        assert cache.snapshot() == {'hits' : 1, 'misses' : 4, 'evictions' : 1, 'objects' : 3, 'bytes' : 96}
+        for key, obj in [((0, 0), '0'), ((0, 2), '2'), ((1, 0), '7')]:
+            assert np.array_equal(cache.get(key, obj), load_object(obj))
+        assert loader.loads == ['0', '1', '2', '7']
+
+        cache.discard_class(0)
+        assert len(cache) == 1 and np.array_equal(cache.get((1, 0), '7'), load_object('7'))
+
+    # Objects that do not fit in a slot, or are not arrays, are not cached
+    with prs.shared_object_cache(lambda obj : obj, 64, 16) as cache:
+        assert np.array_equal(cache.get((0, 0), np.zeros(4)), np.zeros(4))
+        assert cache.get((0, 1), ['a', 1]) == ['a', 1]
+        assert len(cache) == 0
+    return
+
+def test_shared_object_cache_index():
+
+    # Many objects through few slots, so that entries are removed from the middle of probe sequences
+    rng = np.random.default_rng(0)
+    with prs.shared_object_cache(load_object, 8 * 32, 32, copy = False) as cache:
+        held = []
+        for obj in rng.integers(40, size = 1000).tolist():
+            key = (obj % 3, obj)
+            assert np.array_equal(cache.get(key, str(obj)), load_object(str(obj)))
+            if key in held:
+                held.remove(key)
+            held = held[-7:] + [key]
+            assert len(cache) == len(held)
+        snapshot = cache.snapshot()
+        assert snapshot['hits'] + snapshot['misses'] == 1000
+        assert snapshot['misses'] - snapshot['evictions'] == 8
+    return
+
+def test_shared_object_loader_prefetch():
+
+    class_list = build_class_list(4, lambda x : x + 2)
+    loader = counted_loader()
+    with prs.shared_object_cache(loader, 1 << 16, 64) as cache:
+        p = prs.prsample(class_list, 5, prse.Pos_Anc_Neg_Triplet_Example, seed = 2, object_loader = cache)
+        with p.prefetch(num_workers = 2) as batches:
+            batches = list(batches)
+        # The workers loaded every object once between them
+        assert len(cache) == sum(len(c) for c in class_list)
+        assert loader.loads == []
+        expected = [p._get_batch(index) for index in range(len(p))]
+        assert_loaded_batches_equal(batches, expected)
+        assert loader.loads == []
+    return
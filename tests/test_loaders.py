@@ -0,0 +1,210 @@
+import pytest
+import numpy as np
+import prsample as prs
+import prsample.examples as prse
+
+from test_prsample import build_class_list
+
+def failing_get_example_from_obj(index, class_list, cumsum_examples_per_class):
+    if index == 3:
+        raise ValueError('cannot load example 3')
+    return prse.Single_Example.get_example_from_obj(index, class_list, cumsum_examples_per_class)
+
+def assert_batches_equal(batches, expected_batches):
+    assert len(batches) == len(expected_batches)
+    for batch, expected_batch in zip(batches, expected_batches):
+        if isinstance(expected_batch, np.ndarray):
+            assert np.array_equal(batch, expected_batch)
+        else:
+            assert batch == expected_batch
+
+@pytest.mark.parametrize("example_class", [prse.Single_Example, prse.Pos_Anc_Neg_Triplet_Example])
+@pytest.mark.parametrize("no_duplicated_data",[True, False])
+@pytest.mark.parametrize("batched", [True, False])
+def test_prefetch(batched, no_duplicated_data, example_class):
+
+    class_list = build_class_list(5, lambda x : x + 1)
+    if batched:
+        p = prs.prsample(class_list, 7, example_class, seed = 2, no_duplicated_data = no_duplicated_data)
+    else:
+        p = prs.prsample(class_list, 7, example_class.examples_per_obj, example_class.get_example_from_obj, 
+            seed = 2, no_duplicated_data = no_duplicated_data)
+
+    with p.prefetch(num_workers = 3, prefetch_batches = 2) as batches:
+        assert_batches_equal(list(batches), list(p))
+    return
+
+def test_prefetch_worker_error():
+
+    class_list = build_class_list(3, lambda x : 4)
+    p = prs.prsample(class_list, 2, prse.Single_Example.examples_per_obj, failing_get_example_from_obj, shuffle = False)
+
+    batches = p.prefetch(num_workers = 2)
+    with pytest.raises(ValueError):
+        list(batches)
+    assert batches._pool is None
+    return
+
+def test_prefetch_close():
+
+    class_list = build_class_list(3, lambda x : 4)
+    p = prs.prsample(class_list, 2, prse.Single_Example)
+
+    batches = p.prefetch(num_workers = 2)
+    next(batches)
+    batches.close()
+    with pytest.raises(StopIteration):
+        next(batches)
+    return
+
+@pytest.mark.parametrize("example_class", [prse.Single_Example, prse.Pos_Anc_Neg_Triplet_Example])
+@pytest.mark.parametrize("no_duplicated_data",[True, False])
+def test_threaded(no_duplicated_data, example_class):
+
+    class_list = build_class_list(5, lambda x : x + 1)
+    p = prs.prsample(class_list, 7, example_class.examples_per_obj, example_class.get_example_from_obj, 
+        seed = 2, no_duplicated_data = no_duplicated_data)
+
+    with p.threaded(num_threads = 4, prefetch_batches = 3) as batches:
+        assert_batches_equal(list(batches), list(p))
+    return
+
+def test_threaded_error():
+
+    class_list = build_class_list(3, lambda x : 4)
+    p = prs.prsample(class_list, 2, prse.Single_Example.examples_per_obj, failing_get_example_from_obj, shuffle = False)
+
+    with pytest.raises(ValueError):
+        list(p.threaded(num_threads = 2))
+    return
+
+@pytest.mark.parametrize("example_class", [prse.Single_Example, prse.Pos_Anc_Neg_Triplet_Example])
+@pytest.mark.parametrize("no_duplicated_data",[True, False])
+@pytest.mark.parametrize("use_coroutine",[True, False])
+def test_aiter(use_coroutine, no_duplicated_data, example_class):
+    import asyncio
+
+    class_list = build_class_list(5, lambda x : x + 1)
+    p = prs.prsample(class_list, 7, example_class.examples_per_obj, example_class.get_example_from_obj, 
+        seed = 2, no_duplicated_data = no_duplicated_data)
+
+    async def get_example_from_obj(index, class_list, cumsum_examples_per_class):
+        await asyncio.sleep(0.001 * (index % 3))
+        return example_class.get_example_from_obj(index, class_list, cumsum_examples_per_class)
+
+    async def collect():
+        return [batch async for batch in p.aiter(get_example_from_obj if use_coroutine else None, concurrency = 5)]
+
+    assert_batches_equal(asyncio.run(collect()), list(p))
+    return
+
+def test_aiter_error():
+    import asyncio
+
+    class_list = build_class_list(3, lambda x : 4)
+    p = prs.prsample(class_list, 2, prse.Single_Example.examples_per_obj, failing_get_example_from_obj, shuffle = False)
+
+    async def get_example_from_obj(index, class_list, cumsum_examples_per_class):
+        return failing_get_example_from_obj(index, class_list, cumsum_examples_per_class)
+
+    async def collect():
+        return [batch async for batch in p.aiter(get_example_from_obj)]
+
+    with pytest.raises(ValueError):
+        asyncio.run(collect())
+
+    # The other examples being fetched when one fails are cancelled rather than left to run
+    q = prs.prsample(build_class_list(1, lambda x : 16), 16, prse.Single_Example, shuffle = False)
+    finished = []
+
+    async def slow_get_example_from_obj(index, class_list, cumsum_examples_per_class):
+        if index == 0:
+            raise ValueError('the first example fails')
+        await asyncio.sleep(0.1)
+        finished.append(index)
+        return prse.Single_Example.get_example_from_obj(index, class_list, cumsum_examples_per_class)
+
+    async def collect_slow():
+        with pytest.raises(ValueError):
+            [batch async for batch in q.aiter(slow_get_example_from_obj, prefetch_batches = 1)]
+        # The event loop keeps running, as it would in an application
+        await asyncio.sleep(0.3)
+
+    asyncio.run(collect_slow())
+    assert finished == []
+    return
+
+def test_shard_loaders():
+
+    class_list = build_class_list(5, lambda x : x + 1)
+    p = prs.prsample(class_list, 3, prse.Single_Example.examples_per_obj, prse.Single_Example.get_example_from_obj, 
+        no_duplicated_data = True)
+    s = p.shard(1, 3)
+
+    with s.prefetch(num_workers = 2) as batches:
+        assert_batches_equal(list(batches), list(s))
+    with s.threaded(num_threads = 2) as batches:
+        assert_batches_equal(list(batches), list(s))
+    return
+
+def test_prefetch_with_stats():
+
+    stats = prs.prsample_stats(callback = lambda totals : None)
+    p = prs.prsample(build_class_list(5, lambda x : x + 2), 4, prse.Single_Example, stats = stats)
+    expected = list(p)
+    with p.prefetch(num_workers = 2) as batches:
+        assert_batches_equal(list(batches), expected)
+    assert stats.callback is not None
+    # The batches built by the workers are not counted
+    assert stats.snapshot()['counts']['batches'] == len(p)
+    return
+
+def test_prefetch_nlet_examples():
+
+    p = prs.prsample(build_class_list(4, lambda x : x + 3), 5, prse.In_Class_Nlet_Example.with_size(3), seed = 1)
+    with p.prefetch(num_workers = 2) as batches:
+        assert_batches_equal(list(batches), list(p))
+    return
+
+@pytest.mark.parametrize("batch_policy", ['compact', 'fill'])
+def test_prefetch_dense_batches(batch_policy):
+
+    p = prs.prsample(build_class_list(5, lambda x : x + 1), 4, prse.Single_Example, seed = 2, no_duplicated_data = True, 
+        batch_policy = batch_policy)
+    with p.prefetch(num_workers = 2) as batches:
+        assert_batches_equal(list(batches), list(p))
+    if batch_policy == 'compact':
+        with p.threaded(num_threads = 2) as batches:
+            assert len(list(batches)) == len(p)
+    else:
+        with pytest.raises(AssertionError):
+            p.threaded(num_threads = 2)
+    return
+
+def test_loader_bad_arguments():
+
+    p = prs.prsample(build_class_list(3, lambda x : x + 1), 2, prse.Single_Example)
+    with pytest.raises(AssertionError):
+        p.prefetch(num_workers = 0)
+    with pytest.raises(AssertionError):
+        p.threaded(num_threads = 0)
+    return
+
+def test_loaders_resume():
+
+    p = prs.prsample(build_class_list(5, lambda x : x + 1), 3, prse.Single_Example.examples_per_obj, 
+        prse.Single_Example.get_example_from_obj, seed = 2)
+    expected = list(p)
+    batches = iter(p)
+    next(batches)
+    next(batches)
+    state = p.state_dict()
+
+    # Each loader starts at the beginning of the epoch unless it follows load_state_dict
+    for loader in [lambda : p.prefetch(num_workers = 2), lambda : p.threaded(num_threads = 2)]:
+        with loader() as batches:
+            assert_batches_equal(list(batches), expected)
+        p.load_state_dict(state)
+        with loader() as batches:
+            assert_batches_equal(list(batches), expected[2:])
+    return
@@ -0,0 +1,88 @@
+import pytest
+import numpy as np
+import prsample as prs
+import prsample.examples as prse
+import prsample.permutations as prp
+
+from test_prsample import build_class_list, Wide_Batch_Index_Example
+
+permutation_list = [prp.affine_permutation, prp.feistel_permutation]
+
+@pytest.mark.parametrize("permutation", permutation_list)
+@pytest.mark.parametrize("size", [0, 1, 2, 3, 16, 17, 255, 1000, 4099])
+def test_permutation(size, permutation):
+
+    p = permutation(size, permutation.random_keys(size, np.random.default_rng(size)))
+    y = np.asarray(p.forward(np.arange(size))).astype(np.int64)
+    assert np.array_equal(np.sort(y), np.arange(size))
+    assert np.array_equal(np.asarray(p.inverse(y)).astype(np.int64), np.arange(size))
+    return
+
+@pytest.mark.parametrize("size", [2**40 + 7, 2**63 + 5, 2**64])
+def test_feistel_permutation_wide(size):
+
+    p = prp.feistel_permutation(size, prp.feistel_permutation.random_keys(size, np.random.default_rng(0)))
+    x = np.array([0, 1, 2, size // 2, size - 1], dtype = np.uint64)
+    y = p.forward(x)
+    assert all(v < size for v in y.tolist()) and len(set(y.tolist())) == len(x)
+    assert np.array_equal(p.inverse(y), x)
+    return
+
+def pair_chi_square(sequence, size, buckets = 8):
+    # The counts of the buckets of consecutive pairs against those of independent uniform draws
+    bucket = sequence * buckets // size
+    counts = np.bincount(bucket[:-1] * buckets + bucket[1:], minlength = buckets * buckets)
+    expected = (len(sequence) - 1) / (buckets * buckets)
+    return np.sum((counts - expected) ** 2 / expected) / (buckets * buckets - 1)
+
+def test_feistel_permutation_randomness():
+
+    size = 100003
+    keys = prp.feistel_permutation.random_keys(size, np.random.default_rng(1))
+    y = prp.feistel_permutation(size, keys).forward(np.arange(size)).astype(np.int64)
+    # Consecutive outputs are as if independent, where those of an affine permutation are a fixed step apart
+    assert pair_chi_square(y, size) < 2
+    assert abs(np.corrcoef(y[:-1], y[1:])[0, 1]) < 0.02
+    assert len(set(np.diff(y).tolist())) > size // 2
+
+    keys = prp.affine_permutation.random_keys(size, np.random.default_rng(1))
+    y = prp.affine_permutation(size, keys).forward(np.arange(size)).astype(np.int64)
+    assert len(set((np.diff(y) % size).tolist())) == 1
+    return
+
+@pytest.mark.parametrize("permutation", permutation_list)
+@pytest.mark.parametrize("batch_policy", ['pad', 'compact', 'fill'])
+@pytest.mark.parametrize("no_duplicated_data",[True, False])
+@pytest.mark.parametrize("examples_per_batch", [1, 4, 9])
+def test_prsample_permutation(examples_per_batch, no_duplicated_data, batch_policy, permutation, tmp_path):
+
+    class_list = build_class_list(6, lambda x : x + 1)
+    p = prs.prsample(class_list, examples_per_batch, prse.Unordered_In_Class_Pair_Example, seed = 2, \
+        no_duplicated_data = no_duplicated_data, batch_policy = batch_policy, permutation = permutation)
+    assert len(p.batch_strides) == 0
+
+    for epoch in range(3):
+        p.run_self_checks()
+        assert p.run_self_checks(sample_size = 50, seed = epoch) > 0
+        for batch_no in range(len(p)):
+            ex = p.get_example(batch_no, 0)
+            batch = p._get_batch(batch_no)
+            assert (ex is None and batch[0][0] == -1) or tuple(batch[0]) == ex.get()
+        p.init_prsample()
+
+    p.save_plan(str(tmp_path))
+    q = prs.prsample(class_list, examples_per_batch, prse.Unordered_In_Class_Pair_Example, seed = 7, \
+        no_duplicated_data = no_duplicated_data, batch_policy = batch_policy, permutation = permutation, \
+        plan = str(tmp_path))
+    assert all(np.array_equal(q._get_batch(batch_no), p._get_batch(batch_no)) for batch_no in range(len(p)))
+    return
+
+def test_prsample_permutation_wide():
+
+    class_list = build_class_list(3, lambda x : x + 2)
+    p = prs.prsample(class_list, 5, Wide_Batch_Index_Example, no_duplicated_data = True, \
+        permutation = prp.feistel_permutation)
+    assert p.run_self_checks(sample_size = 200, seed = 1) > 0
+    idx, is_valid = p.get_batch_indices([0, 1, len(p) - 1])
+    assert np.all(is_valid[:2])
+    return
@@ -1,3 +1,5 @@
+import os
+import itertools
 import pytest
 import numpy as np
 import prsample as prs
@@ -84,6 +86,32 @@ def test_run_self_checks(examples_per_batch, no_duplicated_data, example_class):
     p.run_self_checks()
     return
 
+@pytest.mark.parametrize("example_class", example_list)
+@pytest.mark.parametrize("no_duplicated_data",[True, False])
+@pytest.mark.parametrize("examples_per_batch",[1, 3, 8, 17])
+def test_run_self_checks_sampled(examples_per_batch, no_duplicated_data, example_class):
+    object_list = build_class_list(3, lambda x : np.random.randint(3, 12))
+    p = prs.prsample(object_list, examples_per_batch, example_class, no_duplicated_data = no_duplicated_data)
+    assert p.run_self_checks(chunk_size = 7) == 0
+    bound = p.run_self_checks(sample_size = 200, confidence = 0.95, seed = 1)
+    assert bound == pytest.approx(-np.log(0.05) / 200)
+
+    # Classes too small for any pair give no examples to sample
+    empty = prs.prsample([['a'], ['b']], examples_per_batch, prse.Unordered_In_Class_Pair_Example, \
+        no_duplicated_data = no_duplicated_data)
+    assert empty.run_self_checks() == 0 and empty.run_self_checks(sample_size = 200, seed = 1) == 0
+    return
+
+@pytest.mark.parametrize("sample_size",[None, 1000])
+def test_run_self_checks_finds_bad_strides(sample_size):
+    object_list = build_class_list(4, lambda x : 6 + x)
+    p = prs.prsample(object_list, 3, prse.Single_Example)
+    assert p.examples_per_batch_index % 2 == 0
+    p.batch_strides = np.full(3, 2)
+    with pytest.raises(AssertionError):
+        p.run_self_checks(sample_size = sample_size, seed = 1)
+    return
+
 @pytest.mark.parametrize("example_class", example_list)
 @pytest.mark.parametrize("no_duplicated_data",[True, False])
 @pytest.mark.parametrize("examples_per_batch", [i for i in range(0, 18)])
@@ -205,8 +233,839 @@ def test_shared_object_singles(examples_per_batch, no_duplicated_data, example_c
         assert empty_p_example_count == 0
     return
 
+@pytest.mark.parametrize("example_class", example_list)
+@pytest.mark.parametrize("no_duplicated_data",[True, False])
+@pytest.mark.parametrize("examples_per_batch", [i for i in range(0, 12)])
+def test_get_batch_indices(examples_per_batch, no_duplicated_data, example_class):
+
+    class_list = build_class_list(5, lambda x : x)
+    p = prs.prsample(class_list, examples_per_batch, example_class.examples_per_obj, \
+        example_class.get_example_from_obj, seed = 2, no_duplicated_data = no_duplicated_data)
+
+    all_idx, all_is_valid = p.get_batch_indices(np.arange(p.__len__()))
+    assert all_idx.shape == (p.__len__(), examples_per_batch)
+
+    for index, batch in enumerate(p):
+        idx, is_valid = p.get_batch_indices(index)
+        assert np.array_equal(idx, all_idx[index])
+        assert np.array_equal(is_valid, all_is_valid[index])
+        for batch_index in range(examples_per_batch):
+            expected_idx, expected_is_valid = p._batch_to_idx(index, batch_index, p.examples_per_batch, \
+                p.batch_strides, p.examples_per_batch_index, p.total_example_count, p.offsets)
+            assert idx[batch_index] == expected_idx
+            assert is_valid[batch_index] == expected_is_valid
+            assert batch[batch_index] == p.get_example(index, batch_index)
+    return
+
+@pytest.mark.parametrize("example_class", example_list)
+@pytest.mark.parametrize("examples_per_batch",[1, 7])
+def test_get_class_obj_idx(examples_per_batch, example_class):
+
+    class_list = build_class_list(6, lambda x : x)
+    p = prs.prsample(class_list, examples_per_batch, example_class.examples_per_obj, \
+        example_class.get_example_from_obj, seed = 3)
+
+    indices = np.arange(p.total_example_count)
+    class_idx, obj_idx, offset = p.get_class_obj_idx(indices)
+
+    for index in indices:
+        expected_class_idx = prs.get_class_idx_from_index(index, p._cumsum_examples_per_class)
+        expected_obj_idx, expected_offset = prs.get_obj_idx_from_index(index, p._class_list[expected_class_idx])
+        assert class_idx[index] == expected_class_idx
+        assert obj_idx[index] == expected_obj_idx
+        assert offset[index] == expected_offset
+    return
+
+@pytest.mark.parametrize("example_class", example_list)
+@pytest.mark.parametrize("objects_per_class", [lambda x : x, lambda x : 4, lambda x : (3 * x) % 5])
+def test_get_examples_from_indices(objects_per_class, example_class):
+
+    class_list = build_class_list(6, objects_per_class)
+    p = prs.prsample(class_list, 5, example_class, seed = 4)
+
+    indices = np.arange(p.total_example_count)
+    examples = example_class.get_examples_from_indices(indices, p._class_list, p._cumsum_examples_per_class, p._flat_index)
+
+    for index in indices:
+        ex = example_class.get_example_from_obj(index, p._class_list, p._cumsum_examples_per_class)
+        assert tuple(examples[index]) == ex.get()
+    return
+
+@pytest.mark.parametrize("example_class", example_list)
+@pytest.mark.parametrize("no_duplicated_data",[True, False])
+@pytest.mark.parametrize("examples_per_batch", [1, 6, 13])
+def test_batched_iterator(examples_per_batch, no_duplicated_data, example_class):
+
+    class_list = build_class_list(5, lambda x : x)
+    p = prs.prsample(class_list, examples_per_batch, example_class, seed = 2, no_duplicated_data = no_duplicated_data)
+
+    for index, batch in enumerate(p):
+        assert batch.shape[0] == examples_per_batch
+        for batch_index in range(examples_per_batch):
+            ex = p.get_example(index, batch_index)
+            if ex is None:
+                assert np.all(batch[batch_index] == -1)
+            else:
+                assert tuple(batch[batch_index]) == ex.get()
+    return
+
+@pytest.mark.parametrize("example_class", example_list)
+@pytest.mark.parametrize("objects_per_class", [lambda x : x, lambda x : 4, lambda x : (3 * x) % 5])
+def test_examples_per_objects(objects_per_class, example_class):
+
+    class_list = build_class_list(7, objects_per_class)
+    p = prs.prsample(class_list, 5, example_class, seed = 4)
+    q = prs.prsample(class_list, 5, example_class.examples_per_obj, example_class.get_example_from_obj, seed = 4)
+
+    assert np.array_equal(p._flat_index['cumsum_examples_per_object'], q._flat_index['cumsum_examples_per_object'])
+    assert np.array_equal(p._cumsum_examples_per_class, q._cumsum_examples_per_class)
+    return
+
+@pytest.mark.parametrize("example_class", [prse.Unordered_Out_of_Class_Pair_Example, prse.Pos_Anc_Neg_Triplet_Example])
+def test_out_of_class_without_flat_index(example_class):
+
+    class_list = build_class_list(6, lambda x : (3 * x) % 5)
+    p = prs.prsample(class_list, 5, example_class, seed = 4)
+
+    bare_class_list = [{k : v for k, v in c.items() if k != 'flat_index'} for c in p._class_list]
+    for index in range(p.total_example_count):
+        ex = example_class.get_example_from_obj(index, p._class_list, p._cumsum_examples_per_class)
+        bare_ex = example_class.get_example_from_obj(index, bare_class_list, p._cumsum_examples_per_class)
+        assert ex == bare_ex
+    return
+
+@pytest.mark.parametrize("example_class", example_list)
+def test_example_hash(example_class):
+
+    class_list = build_class_list(5, lambda x : x)
+    p = prs.prsample(class_list, 3, example_class, seed = 4)
+
+    for index in range(p.total_example_count):
+        ex = example_class.get_example_from_obj(index, p._class_list, p._cumsum_examples_per_class)
+        same_ex = example_class.from_values(ex.get())
+        assert ex is not same_ex
+        assert ex == same_ex
+        assert hash(ex) == hash(same_ex)
+        assert len({ex, same_ex}) == 1
+        assert not hasattr(ex, '__dict__')
+        # Other types are never equal
+        assert ex != 3 and not ex == 3 and ex != ex.get()
+    return
+
+def test_nlet_example_hash():
+
+    ex = prse.Nlet_Example([(0, 1), (2, 3), (4, 5)])
+    assert ex == prse.Nlet_Example.from_values([0, 1, 2, 3, 4, 5])
+    assert ex != prse.Nlet_Example([(0, 1), (2, 3), (4, 6)])
+    assert len({ex, prse.Nlet_Example([(0, 1), (2, 3), (4, 5)])}) == 1
+    return
+
+@pytest.mark.parametrize("example_class", example_list)
+def test_example_batch(example_class):
+
+    class_list = build_class_list(5, lambda x : x)
+    p = prs.prsample(class_list, 7, example_class, seed = 4)
+
+    for batch in p:
+        example_batch = prse.Example_Batch(example_class, batch)
+        assert len(example_batch) == len(batch)
+        assert np.array_equal(example_batch.array, batch)
+        assert np.array_equal(example_batch.examples[example_class.fields[0]], batch[:, 0])
+
+        examples = list(example_batch)
+        assert [ex.get() for ex in examples] == [tuple(row) for row in batch.tolist()]
+        assert example_batch[1] == examples[1]
+        assert np.array_equal(prse.Example_Batch.from_examples(example_class, examples).array, batch)
+        assert np.array_equal(example_batch[2:4].array, batch[2:4])
+    return
+
+@pytest.mark.parametrize("example_class", example_list)
+@pytest.mark.parametrize("no_duplicated_data",[True, False])
+@pytest.mark.parametrize("world_size", [1, 2, 3, 7])
+@pytest.mark.parametrize("examples_per_batch", [1, 4, 9])
+def test_shard(examples_per_batch, world_size, no_duplicated_data, example_class):
+
+    class_list = build_class_list(5, lambda x : x + 1)
+    p = prs.prsample(class_list, examples_per_batch, example_class.examples_per_obj, \
+        example_class.get_example_from_obj, seed = 2, no_duplicated_data = no_duplicated_data)
+
+    shards = [p.shard(rank, world_size) for rank in range(world_size)]
+    assert all([s.__len__() == shards[0].__len__() for s in shards])
+    assert shards[0].__len__() * world_size >= p.__len__()
+
+    seen_examples = []
+    for s in shards:
+        for index, batch in enumerate(s):
+            assert len(batch) == examples_per_batch
+            for batch_index in range(examples_per_batch):
+                assert batch[batch_index] == s.get_example(index, batch_index)
+            seen_examples += [ex for ex in batch if ex is not None]
+
+    if no_duplicated_data:
+        assert len(seen_examples) == p.total_example_count
+    assert len(set(seen_examples)) == p.total_example_count
+    return
+
+@pytest.mark.parametrize("example_class", example_list)
+@pytest.mark.parametrize("no_duplicated_data",[True, False])
+@pytest.mark.parametrize("batches_taken", [0, 1, 3])
+def test_state_dict(batches_taken, no_duplicated_data, example_class):
+
+    class_list = build_class_list(5, lambda x : x + 1)
+    p = prs.prsample(class_list, 4, example_class.examples_per_obj, example_class.get_example_from_obj, \
+        seed = 2, no_duplicated_data = no_duplicated_data)
+    p.init_prsample()
+
+    batches = iter(p)
+    for _ in range(batches_taken):
+        next(batches)
+    state = p.state_dict()
+
+    q = prs.prsample(class_list, 4, example_class.examples_per_obj, example_class.get_example_from_obj, \
+        seed = 7, no_duplicated_data = no_duplicated_data)
+    q.load_state_dict(state)
+
+    assert q.epoch_count == p.epoch_count == 2
+    assert list(q) == list(batches)
+    assert q.iter_index == 0
+
+    # The following epochs match too
+    p.init_prsample()
+    q.init_prsample()
+    assert list(q) == list(p)
+    return
+
+def test_iterator_restarts():
+
+    class_list = build_class_list(5, lambda x : x + 1)
+    p = prs.prsample(class_list, 2, prse.Single_Example)
+
+    expected_batches = list(p)
+    assert np.array_equal(next(iter(p)), expected_batches[0])
+    assert np.array_equal(next(iter(p)), expected_batches[0])
+
+    # Every iterator yields the whole epoch, however far others got
+    for batch in p:
+        break
+    a, b = iter(p), iter(p)
+    assert np.array_equal(np.array(list(a)), np.array(expected_batches))
+    assert np.array_equal(np.array(list(b)), np.array(expected_batches))
+    assert np.array_equal(np.array(list(p)), np.array(expected_batches))
+
+    # Only the first iterator after load_state_dict resumes
+    batches = iter(p)
+    for _ in range(3):
+        next(batches)
+    state = p.state_dict()
+    p.load_state_dict(state)
+    assert np.array_equal(np.array(list(p)), np.array(expected_batches[3:]))
+    assert np.array_equal(np.array(list(p)), np.array(expected_batches))
+    return
+
+@pytest.mark.parametrize("example_class", example_list)
+@pytest.mark.parametrize("examples_per_batch", [0, 3])
+def test_save_plan(examples_per_batch, example_class, tmp_path):
+
+    class_list = build_class_list(5, lambda x : x + 1)
+    p = prs.prsample(class_list, examples_per_batch, example_class.examples_per_obj, example_class.get_example_from_obj, 
+        seed = 2, no_duplicated_data = True)
+
+    batches = iter(p)
+    if p.__len__() > 0:
+        next(batches)
+    p.save_plan(str(tmp_path))
+
+    q = prs.prsample(class_list, examples_per_batch, example_class.examples_per_obj, example_class.get_example_from_obj, 
+        no_duplicated_data = True, plan = str(tmp_path))
+    if examples_per_batch > 0:
+        assert isinstance(q._flat_index['cumsum_examples_per_object'], np.memmap)
+        assert isinstance(q.batch_strides, np.memmap)
+    assert list(q) == list(batches)
+
+    if examples_per_batch > 0:
+        p.init_prsample()
+        q.init_prsample()
+        assert list(q) == list(p)
+    return
+
+@pytest.mark.parametrize("n", [1, 2, 3, 4, 12, 97, 2**16, 3 * 5 * 7 * 11 * 13, 2**31 - 1, 600851475143, 2**61 - 1, 10**18 + 9])
+def test_get_prime_factors(n):
+    from math import prod
+
+    factors = prs.get_prime_factors(n)
+    assert factors == sorted(set(factors))
+    m = n
+    for p in factors:
+        assert all([p % q != 0 for q in range(2, min(p, 1000))])
+        while m % p == 0:
+            m //= p
+    assert m == 1
+    return
+
+@pytest.mark.parametrize("examples_per_batch", [1, 5, 64, 1000])
+@pytest.mark.parametrize("examples_per_batch_index", [3, 4, 7, 30, 210, 1 << 17, 3 * 5 * 7 * 11 * 13 * 17 * 19, 2**40 + 15])
+def test_find_batch_strides(examples_per_batch_index, examples_per_batch):
+    from math import gcd
+
+    p = prs.prsample([], 0, prse.Single_Example, seed = 5)
+    batch_strides, offsets = p._find_batch_strides(examples_per_batch, examples_per_batch_index)
+
+    assert batch_strides.shape == offsets.shape == (examples_per_batch,)
+    assert np.all((offsets >= 0) & (offsets < examples_per_batch_index))
+    assert all([gcd(stride, examples_per_batch_index) == 1 and 2 <= stride < examples_per_batch_index \
+        for stride in batch_strides.tolist()])
+
+    unit_count = len([i for i in range(2, min(examples_per_batch_index, 10**5)) if gcd(i, examples_per_batch_index) == 1])
+    assert len(set(batch_strides.tolist())) == min(examples_per_batch, unit_count)
+    return
+
+def test_global_rng_untouched():
+
+    np.random.seed(11)
+    expected = np.random.randint(0, 1000, 10)
+
+    np.random.seed(11)
+    prs.prsample(build_class_list(5, lambda x : x + 1), 3, prse.Single_Example).init_prsample()
+    assert np.array_equal(np.random.randint(0, 1000, 10), expected)
+    return
+
+count_calls = []
+
+class Counted_Single_Example(prse.Single_Example):
+    __slots__ = ()
+    examples_per_objects = None
+
+    @staticmethod
+    def examples_per_obj(class_idx, object_idx, class_list):
+        count_calls.append(class_list[class_idx]['class_no'])
+        return 1
+
+@pytest.mark.parametrize("example_class", example_list)
+@pytest.mark.parametrize("use_example_class", [True, False])
+def test_dataset_updates(use_example_class, example_class):
+
+    class_list = build_class_list(5, lambda x : x + 2)
+    if use_example_class:
+        p = prs.prsample(class_list, 4, example_class, seed = 2)
+    else:
+        p = prs.prsample(class_list, 4, example_class.examples_per_obj, example_class.get_example_from_obj, seed = 2)
+
+    total_example_count = p.total_example_count
+    p.add_objects(1, ['a', 'b', 'c'])
+    assert p.add_class(['d', 'e']) == 5
+    p.remove_objects(3, [0, 2])
+    p.remove_objects(1, [5])
+
+    # Indices outside the class are rejected before any object is removed
+    for obj_indices in [[-1], [0, 9]]:
+        with pytest.raises(AssertionError):
+            p.remove_objects(2, obj_indices)
+
+    # Nothing changes until the next epoch
+    assert p.total_example_count == total_example_count
+    assert p.unshuffled_class_list == class_list
+    p.run_self_checks()
+
+    p.init_prsample()
+
+    expected_class_list = [list(c) for c in class_list] + [['d', 'e']]
+    expected_class_list[1] += ['a', 'b']
+    del expected_class_list[3][2]
+    del expected_class_list[3][0]
+    assert p.unshuffled_class_list == expected_class_list
+    assert class_list == build_class_list(5, lambda x : x + 2)
+
+    q = prs.prsample(expected_class_list, 4, example_class, seed = 2)
+    assert p.total_example_count == q.total_example_count
+    p.run_self_checks()
+    return
+
+def test_dataset_updates_recount_changed_classes():
+
+    class_list = build_class_list(5, lambda x : x + 2)
+    p = prs.prsample(class_list, 4, Counted_Single_Example, seed = 2)
+    assert sorted(count_calls) == sorted(sum([[class_no] * len(c) for class_no, c in enumerate(class_list)], []))
+
+    del count_calls[:]
+    p.init_prsample()
+    assert count_calls == []
+
+    p.add_objects(2, ['a'])
+    p.add_class(['b', 'c'])
+    p.init_prsample()
+    assert sorted(count_calls) == [2] * 5 + [5] * 2
+    assert p.total_example_count == sum([len(c) for c in class_list]) + 3
+    p.run_self_checks()
+    return
+
+def all_objects_and_offsets(p):
+    class_idx, obj_idx, offset = p.get_class_obj_idx(np.arange(int(p.total_example_count)))
+    return sorted(zip(p._flat_index['class_no'][class_idx].tolist(), obj_idx.tolist(), offset.tolist()))
+
+@pytest.mark.parametrize("example_class", [prse.Single_Example, prse.Ordered_In_Class_Pair_Example])
+def test_dataset_updates_splice(example_class):
+
+    class_list = build_class_list(5, lambda x : x + 2)
+    p = prs.prsample(class_list, 4, example_class, seed = 2)
+    state = p.state_dict()
+    saved = all_objects_and_offsets(p)
+
+    for update in range(12):
+        p.add_objects(update % 4, ['a'] * (update + 1))
+        if update % 3 == 0:
+            p.add_class(['b', 'c'])
+        if update % 2 == 1:
+            p.remove_objects((update + 2) % 5, [0])
+        # Replacing an object of the largest class leaves its old part of the index unused
+        p.remove_objects(4, [0])
+        p.add_objects(4, ['d'])
+        p.init_prsample()
+
+        # The classes changed are appended to the index in place of their old parts, which are dropped once they 
+        # outnumber the objects in use
+        assert len(p._flat_index['cumsum_examples_per_object']) - 1 <= 2 * sum(len(c) for c in p.unshuffled_class_list)
+        q = prs.prsample(p.unshuffled_class_list, 4, example_class, seed = 2)
+        assert p.total_example_count == q.total_example_count
+        assert all_objects_and_offsets(p) == all_objects_and_offsets(q)
+        p.run_self_checks()
+
+    # The arrays of a saved state are not changed by later updates
+    r = prs.prsample(class_list, 4, example_class, seed = 2)
+    r.load_state_dict(state)
+    assert all_objects_and_offsets(r) == saved
+    return
+
+@pytest.mark.parametrize("example_class", example_list)
+@pytest.mark.parametrize("no_duplicated_data",[True, False])
+def test_stats(example_class, no_duplicated_data):
+    epochs = []
+    stats = prs.prsample_stats(callback = epochs.append)
+    object_list = build_class_list(4, lambda x : x + 3)
+    p = prs.prsample(object_list, 7, example_class, no_duplicated_data = no_duplicated_data, stats = stats)
+    snapshot = stats.snapshot()
+    assert set(snapshot['seconds']) == {'init', 'stride_search'}
+    assert snapshot['seconds']['stride_search'] <= snapshot['seconds']['init']
+
+    for batch in p:
+        pass
+    invalid_slots = len(p) * p.examples_per_batch - p.total_example_count if no_duplicated_data else 0
+    p.get_example(0, 0)
+    snapshot = stats.snapshot()
+    assert snapshot['counts']['batches'] == len(p)
+    assert snapshot['counts']['examples'] + snapshot['counts'].get('invalid_slots', 0) == (len(p) * p.examples_per_batch) + 1
+    assert snapshot['counts']['invalid_slots'] - invalid_slots in [0, 1]
+    assert {'init', 'stride_search', 'mapping', 'fetch'} == set(snapshot['seconds'])
+    assert snapshot['epoch']['counts'] == snapshot['counts']
+    assert epochs == []
+
+    p.init_prsample()
+    assert [e['epoch'] for e in epochs] == [1]
+    assert epochs[0]['counts'] == snapshot['counts']
+    assert stats.snapshot()['epochs'] == epochs
+    assert stats.snapshot()['epoch']['counts'] == {}
+    assert set(stats.snapshot()['epoch']['seconds']) == {'init', 'stride_search'}
+
+    stats.reset()
+    assert stats.snapshot() == {'seconds' : {}, 'counts' : {}, 'epoch' : {'seconds' : {}, 'counts' : {}}, 'epochs' : []}
+    return
+
+@pytest.mark.parametrize("batch_policy", ['compact', 'fill'])
+def test_stats_dense_get_example(batch_policy):
+    stats = prs.prsample_stats()
+    p = prs.prsample(build_class_list(4, lambda x : x + 3), 7, prse.Single_Example, no_duplicated_data = True, 
+        batch_policy = batch_policy, stats = stats)
+    stats.reset()
+
+    examples = [p.get_example(batch_no, batch_index) for batch_no in range(len(p)) for batch_index in range(7)]
+    counts = stats.snapshot()['counts']
+    assert counts['examples'] == len([e for e in examples if e is not None])
+    assert counts['examples'] + counts.get('invalid_slots', 0) == len(p) * 7
+    assert {'mapping', 'fetch'} == set(stats.snapshot()['seconds'])
+    return
+
+def brute_force_nlets(nlet_class, class_list):
+    objects = [(class_no, obj_idx) for class_no, c in enumerate(class_list) for obj_idx in range(len(c))]
+    k = nlet_class.k
+    if issubclass(nlet_class, prse.In_Class_Nlet_Example):
+        return {n for class_no in range(len(class_list)) for n in itertools.combinations(
+            [(class_no, obj_idx) for obj_idx in range(len(class_list[class_no]))], k)}
+    return {(a,) + n for a in objects for n in itertools.combinations([o for o in objects if o[0] != a[0]], k - 1)}
+
+@pytest.mark.parametrize("nlet_class", [prse.In_Class_Nlet_Example, prse.Out_of_Class_Nlet_Example])
+@pytest.mark.parametrize("k", [2, 3, 4, 5])
+@pytest.mark.parametrize("no_duplicated_data",[True, False])
+def test_nlet_examples(nlet_class, k, no_duplicated_data):
+
+    if nlet_class is prse.In_Class_Nlet_Example:
+        class_list = build_class_list(5, lambda x : (2 * x) % 5 + 2)
+    else:
+        class_list = build_class_list(5, lambda x : x % 3 + 1)
+    example_class = nlet_class.with_size(k)
+    assert nlet_class.with_size(k) is example_class
+    assert getattr(prse, nlet_class.__name__ + '_' + str(k)) is example_class
+
+    p = prs.prsample(class_list, 7, example_class, no_duplicated_data = no_duplicated_data, seed = 5)
+    q = prs.prsample(class_list, 7, example_class.examples_per_obj, example_class.get_example_from_obj, 
+        no_duplicated_data = no_duplicated_data, seed = 5)
+    p.run_self_checks()
+
+    expected = brute_force_nlets(example_class, class_list)
+    assert p.total_example_count == len(expected)
+    examples = {example_class.get_example_from_obj(index, p._class_list, p._cumsum_examples_per_class).get() \
+        for index in range(p.total_example_count)}
+    assert {e[:1] + tuple(sorted(e[1:])) for e in examples} == {e[:1] + tuple(sorted(e[1:])) for e in expected}
+
+    for batch, q_batch in zip(p, q):
+        assert [None if row[0] == -1 else example_class.from_values(row.tolist()) for row in batch] == q_batch
+    return
+
+@pytest.mark.parametrize("k", [5, 6])
+def test_nlet_examples_large_class(k):
+    from math import comb
+
+    # The counts fit in int64 for k = 5, though the products that give them do not, and do not for k = 6
+    class_list = [list(range(100000))]
+    example_class = prse.In_Class_Nlet_Example.with_size(k)
+    counts = example_class.examples_per_objects([len(class_list[0])])
+    assert counts[0] == comb(len(class_list[0]) - 1, k - 1) and counts[-1] == 0 and min(counts) >= 0
+
+    p = prs.prsample(class_list, 64, example_class, seed = 1)
+    q = prs.prsample(class_list, 64, example_class.examples_per_obj, example_class.get_example_from_obj, seed = 1)
+    assert p.total_example_count == q.total_example_count == comb(len(class_list[0]), k)
+    assert p.run_self_checks(sample_size = 50, seed = 1) > 0
+    return
+
+class Counted_Order_Dependent_Example(Counted_Single_Example):
+    __slots__ = ()
+    class_local_counts = False
+    counts_depend_on_order = True
+
+class Counted_Order_Independent_Example(Counted_Order_Dependent_Example):
+    __slots__ = ()
+    counts_depend_on_order = False
+
+@pytest.mark.parametrize("example_class", [Counted_Order_Dependent_Example, Counted_Order_Independent_Example])
+def test_reshuffle_reuses_counts(example_class):
+
+    class_list = build_class_list(6, lambda x : x + 1)
+    p = prs.prsample(class_list, 4, example_class, seed = 3)
+    cumsum_examples_per_object = p._flat_index['cumsum_examples_per_object']
+
+    del count_calls[:]
+    class_no = p._flat_index['class_no']
+    p.init_prsample()
+    assert not np.array_equal(class_no, p._flat_index['class_no'])
+    if example_class.counts_depend_on_order:
+        assert len(count_calls) == sum(len(c) for c in class_list)
+    else:
+        assert count_calls == []
+        assert p._flat_index['cumsum_examples_per_object'] is cumsum_examples_per_object
+    p.run_self_checks()
+
+    # An update builds the object index again
+    del count_calls[:]
+    p.add_objects(0, ['a'])
+    p.init_prsample()
+    assert len(count_calls) == sum(len(c) for c in class_list) + 1
+    p.run_self_checks()
+    return
+
+class Undeclared_Out_of_Class_Pair_Example():
+    # Counts that depend on the order of the classes, from a class that sets neither attribute
+    examples_per_obj = staticmethod(prse.Unordered_Out_of_Class_Pair_Example.examples_per_obj)
+    get_example_from_obj = staticmethod(prse.Unordered_Out_of_Class_Pair_Example.get_example_from_obj)
+
+def test_reshuffle_undeclared_counts():
+
+    p = prs.prsample(build_class_list(6, lambda x : x + 1), 4, Undeclared_Out_of_Class_Pair_Example, seed = 3)
+    assert p.counts_depend_on_order
+    for epoch in range(3):
+        p.run_self_checks()
+        p.init_prsample()
+    return
+
+@pytest.mark.parametrize("example_class", example_list)
+def test_reshuffled_batches(example_class):
+
+    class_list = build_class_list(7, lambda x : (3 * x) % 5 + 1)
+    p = prs.prsample(class_list, 5, example_class, seed = 4)
+    q = prs.prsample(class_list, 5, example_class.examples_per_obj, example_class.get_example_from_obj, seed = 4)
+    for epoch in range(3):
+        assert np.array_equal(p._flat_index['class_no'], q._flat_index['class_no'])
+        assert np.array_equal(p._cumsum_examples_per_class, q._cumsum_examples_per_class)
+        for batch, examples in zip(p, q):
+            assert [tuple(e) for e in batch] == [e.get() for e in examples]
+        p.run_self_checks()
+        p.init_prsample()
+        q.init_prsample()
+    return
+
+class Wide_Example(prse.Pair_Example):
+    ''' Every object has examples_per_object_count examples, object b is the offset within object a '''
+    __slots__ = ()
+    examples_per_object_count = 2**61
+    is_valid = None
+
+    @classmethod
+    def examples_per_obj(cls, class_idx, object_idx, class_list):
+        return cls.examples_per_object_count
+
+    @classmethod
+    def examples_per_objects(cls, objects_per_class):
+        return np.full(np.sum(objects_per_class), cls.examples_per_object_count, dtype = int)
+
+    @classmethod
+    def get_example_from_obj(cls, index, class_list, cumsum_examples_per_class):
+        class_idx = prs.get_class_idx_from_index(index, cumsum_examples_per_class)
+        obj_idx, offset = prs.get_obj_idx_from_index(index, class_list[class_idx])
+        return cls(class_list[class_idx]['class_no'], obj_idx, class_list[class_idx]['class_no'], int(offset))
+
+    @staticmethod
+    def get_examples_from_indices(indices, class_list, cumsum_examples_per_class, flat_index):
+        class_idx, obj_idx, offset = prs.get_class_obj_idx_from_indices(indices, flat_index)
+        class_no = flat_index['class_no'][class_idx]
+        return np.stack([class_no, obj_idx, class_no, offset], axis = -1)
+
+class Wide_Batch_Index_Example(Wide_Example):
+    __slots__ = ()
+    examples_per_object_count = 2**40
+
+# Only the batch arithmetic overflows int64, the example count overflows int64 with few and with many batches
+@pytest.mark.parametrize("example_class, examples_per_batch", [(Wide_Batch_Index_Example, 1), \
+    (Wide_Batch_Index_Example, 5), (Wide_Example, 1), (Wide_Example, 64)])
+def test_wide_index_arithmetic(example_class, examples_per_batch, tmp_path):
+    class_list = build_class_list(3, lambda x : x + 2)
+    p = prs.prsample(class_list, examples_per_batch, example_class, no_duplicated_data = True)
+    total = sum(len(c) for c in class_list) * example_class.examples_per_object_count
+    assert p.total_example_count == total
+    assert p.examples_per_batch_index == -(-total // examples_per_batch)
+    if example_class is Wide_Example:
+        assert total > 2**63
+
+    # The indices match the same arithmetic on Python ints
+    E, L = examples_per_batch, p.examples_per_batch_index
+    batch_no = [0, 1, L // 3, L - 2, L - 1]
+    idx, is_valid = p.get_batch_indices(batch_no)
+    for b, batch_idx, batch_is_valid in zip(batch_no, idx.tolist(), is_valid.tolist()):
+        for s in range(E):
+            unwraped_idx = s + E * ((int(p.batch_strides[s]) * (b + s) + int(p.offsets[s])) % L)
+            assert batch_idx[s] == unwraped_idx % total
+            assert batch_is_valid[s] == (unwraped_idx < total)
+
+    examples = next(iter(p))
+    assert np.all(examples[:, 3] < example_class.examples_per_object_count)
+    for s in range(E):
+        assert p.get_example(0, s).get() == tuple(examples[s])
+
+    assert p.run_self_checks(sample_size = 200, seed = 1) > 0
+
+    p.save_plan(str(tmp_path))
+    q = prs.prsample(class_list, examples_per_batch, example_class, no_duplicated_data = True, plan = str(tmp_path))
+    assert q.total_example_count == total
+    assert all(np.array_equal(a, b) for a, b in zip(q.get_batch_indices(batch_no), (idx, is_valid)))
+    return
+
+def get_batch_examples(batch):
+    return [tuple(ex) for ex in batch if ex[0] != -1] if isinstance(batch, np.ndarray) else \
+        [ex for ex in batch if ex is not None]
+
+@pytest.mark.parametrize("example_class", [prse.Single_Example, prse.Unordered_In_Class_Pair_Example, \
+    prse.Pos_Anc_Neg_Triplet_Example])
+@pytest.mark.parametrize("batch_policy", ['pad', 'compact'])
+@pytest.mark.parametrize("examples_per_batch", [1, 4, 7])
+def test_compact_batches(examples_per_batch, batch_policy, example_class):
+
+    class_list = build_class_list(5, lambda x : x + 1)
+    p = prs.prsample(class_list, examples_per_batch, example_class, seed = 2, no_duplicated_data = True, \
+        batch_policy = batch_policy)
+    p.run_self_checks()
+    p.run_self_checks(sample_size = 100)
+
+    seen_examples = []
+    for index, (batch, mask) in enumerate(p.masked()):
+        assert np.array_equal(mask, [ex[0] != -1 for ex in batch])
+        if batch_policy == 'compact':
+            # Only the last batch has empty slots, at its end
+            assert np.array_equal(mask, np.arange(examples_per_batch) < p.total_example_count - index * examples_per_batch)
+        for batch_index in range(examples_per_batch):
+            ex = p.get_example(index, batch_index)
+            assert (ex is None) != mask[batch_index]
+            if ex is not None:
+                assert tuple(batch[batch_index]) == ex.get()
+        seen_examples += get_batch_examples(batch)
+    assert len(seen_examples) == len(set(seen_examples)) == p.total_example_count
+    return
+
+@pytest.mark.parametrize("batched", [True, False])
+@pytest.mark.parametrize("examples_per_batch", [1, 4, 7])
+def test_fill_batches(examples_per_batch, batched):
+
+    class_list = build_class_list(5, lambda x : x + 1)
+    example_class = prse.Unordered_In_Class_Pair_Example
+    args = [example_class] if batched else [example_class.examples_per_obj, example_class.get_example_from_obj]
+    p = prs.prsample(class_list, examples_per_batch, *args, seed = 2, no_duplicated_data = True, batch_policy = 'fill')
+    total = p.total_example_count
+
+    # Every batch is full and the stream of examples covers each epoch exactly once, the examples that fill the 
+    # last batch of an epoch being the first ones of the next
+    stream = []
+    for epoch in range(4):
+        p.run_self_checks()
+        for index in range(len(p)):
+            batch, mask = p.get_batch_with_mask(index)
+            assert np.all(mask)
+            for batch_index in range(examples_per_batch):
+                ex = p.get_example(index, batch_index)
+                assert (tuple(batch[batch_index]) == ex.get()) if batched else (batch[batch_index] == ex)
+            stream += get_batch_examples(batch)
+        p.init_prsample()
+    assert len(stream) >= 3 * total
+    for epoch in range(len(stream) // total):
+        assert len(set(stream[epoch * total : (epoch + 1) * total])) == total
+
+    # The offset into the epoch is part of the state
+    state = p.state_dict()
+    q = prs.prsample(class_list, examples_per_batch, *args, seed = 7, no_duplicated_data = True, batch_policy = 'fill')
+    q.load_state_dict(state)
+    assert len(q) == len(p)
+    for index in range(len(p)):
+        assert get_batch_examples(q.get_batch_with_mask(index)[0]) == get_batch_examples(p.get_batch_with_mask(index)[0])
+    return
+
+@pytest.mark.parametrize("batch_policy", ['compact', 'fill'])
+@pytest.mark.parametrize("world_size", [1, 2, 3])
+def test_dense_shard(world_size, batch_policy):
+
+    class_list = build_class_list(5, lambda x : x + 1)
+    p = prs.prsample(class_list, 4, prse.Single_Example, seed = 2, no_duplicated_data = True, batch_policy = batch_policy)
+
+    batches = [p.get_batch_with_mask(index) for index in range(len(p))]
+    for rank in range(world_size):
+        s = p.shard(rank, world_size)
+        for index, (batch, mask) in enumerate(s.masked()):
+            global_index = rank + index * world_size
+            if global_index < len(p):
+                assert np.array_equal(batch, batches[global_index][0])
+                assert np.array_equal(mask, batches[global_index][1])
+            else:
+                assert not np.any(mask)
+    return
+
+@pytest.mark.parametrize("example_class", [prse.Single_Example, prse.Unordered_In_Class_Pair_Example])
+@pytest.mark.parametrize("batch_policy", ['pad', 'compact', 'fill'])
+@pytest.mark.parametrize("no_duplicated_data",[True, False])
+@pytest.mark.parametrize("examples_per_batch", [1, 4, 9])
+@pytest.mark.parametrize("locality_window", [1, 3, 16, 1000])
+def test_locality_window(locality_window, examples_per_batch, no_duplicated_data, batch_policy, example_class):
+
+    class_list = build_class_list(6, lambda x : x + 1)
+    p = prs.prsample(class_list, examples_per_batch, example_class, seed = 2, no_duplicated_data = no_duplicated_data, \
+        batch_policy = batch_policy, locality_window = locality_window)
+    total = p.total_example_count
+    window_size = min(locality_window, total)
+
+    for epoch in range(3):
+        p.run_self_checks()
+        assert p.run_self_checks(sample_size = 50, seed = epoch) > 0
+
+        # Each window of consecutive batch slots takes a block of consecutive example indices
+        idx, is_valid = p._get_raw_indices(np.arange(p.examples_per_batch_index)[:, np.newaxis], \
+            np.arange(examples_per_batch))
+        idx, is_valid = idx.reshape(-1), is_valid.reshape(-1)
+        blocks = np.where(is_valid, idx // window_size, -1)
+        for window in range(-(-total // window_size)):
+            window_blocks = blocks[window * window_size : (window + 1) * window_size]
+            assert len(set(window_blocks[window_blocks >= 0].tolist())) <= 1
+        for batch_no in range(len(p)):
+            ex = p.get_example(batch_no, examples_per_batch - 1)
+            batch = p._get_batch(batch_no)
+            assert (ex is None and batch[-1][0] == -1) or tuple(batch[-1]) == ex.get()
+        p.init_prsample()
+
+    q = prs.prsample(class_list, examples_per_batch, example_class, seed = 7, no_duplicated_data = no_duplicated_data, \
+        batch_policy = batch_policy, locality_window = locality_window)
+    q.load_state_dict(p.state_dict())
+    assert all(np.array_equal(q._get_batch(batch_no), p._get_batch(batch_no)) for batch_no in range(len(p)))
+
+    # Classes too small for any pair give no examples and so no batches
+    empty = prs.prsample([['a'], ['b']], examples_per_batch, prse.Unordered_In_Class_Pair_Example, \
+        batch_policy = batch_policy, locality_window = locality_window)
+    assert empty.total_example_count == 0 and len(empty) == 0
+    assert list(empty) == []
+    return
+
+def test_wide_locality_window():
+
+    class_list = build_class_list(3, lambda x : x + 2)
+    p = prs.prsample(class_list, 8, Wide_Example, no_duplicated_data = True, locality_window = 2**40 + 3)
+    assert p.total_example_count > 2**63
+    assert p.run_self_checks(sample_size = 200, seed = 1) > 0
+    idx, is_valid = p.get_batch_indices([0, 1, len(p) - 1])
+    assert np.all(is_valid[:2])
+    # The slots of a batch are consecutive positions within a window
+    assert len(set((idx[0] // p.window_size).tolist())) == 1
+    return
+
 def test_version_number():
     assert prs.__version__ == '0.0.5'
     return
 
 
+
+def make_class_dirs(root, files):
+    for f in files:
+        path = root / f
+        path.parent.mkdir(parents = True, exist_ok = True)
+        path.write_text('')
+
+@pytest.mark.parametrize("num_threads", [1, 4])
+def test_build_class_list_from_class_dirs(tmp_path, num_threads):
+    make_class_dirs(tmp_path, ['b/2.png', 'b/1.png', 'a/x.jpg', 'a/nested/y.png', 'a/z.txt', 'c/.hidden.png', '.d/w.png', 'top.png'])
+    class_list = prs.build_class_list_from_class_dirs([str(tmp_path)], ['png', 'jpg'], num_threads = num_threads)
+    expected = [[str(tmp_path / 'top.png')],
+        [str(tmp_path / 'a' / 'x.jpg')],
+        [str(tmp_path / 'a' / 'nested' / 'y.png')],
+        [str(tmp_path / 'b' / '1.png'), str(tmp_path / 'b' / '2.png')]]
+    assert sorted(class_list) == sorted(expected)
+    assert class_list == sorted(expected, key = lambda c : os.path.dirname(c[0]))
+
+@pytest.mark.parametrize("num_threads", [1, 4])
+def test_build_class_list_from_class_dirs_matching(tmp_path, num_threads):
+    data = tmp_path / 'data'
+    make_class_dirs(data, ['a/y.tar.gz', 'a/gz', 'a/jpg', 'a/x.jpg', 'a/x.jpgs', 'b/z.jpg'])
+    make_class_dirs(tmp_path, ['other/w.jpg'])
+    # A symbolic link to a directory is followed like any directory, and a link back up is not walked round again
+    os.symlink(tmp_path / 'other', data / 'linked')
+    os.symlink(data, data / 'b' / 'loop')
+
+    class_list = prs.build_class_list_from_class_dirs([str(data)], ['tar.gz', 'jpg'], num_threads = num_threads)
+    assert class_list == [[str(data / 'a' / 'x.jpg'), str(data / 'a' / 'y.tar.gz')], [str(data / 'b' / 'z.jpg')], 
+        [str(data / 'linked' / 'w.jpg')]]
+
+@pytest.mark.parametrize("num_threads", [1, 4])
+def test_build_class_list_from_class_dirs_cache(tmp_path, monkeypatch, num_threads):
+    data = tmp_path / 'data'
+    make_class_dirs(data, ['a/1.png', 'b/1.png', 'b/2.png'])
+    cache_path = str(tmp_path / 'manifest.json')
+    first = prs.build_class_list_from_class_dirs([str(data)], ['png'], num_threads = num_threads, cache_path = cache_path)
+
+    listed = []
+    scandir = os.scandir
+    def counting_scandir(path):
+        listed.append(path)
+        return scandir(path)
+    monkeypatch.setattr(os, 'scandir', counting_scandir)
+
+    assert prs.build_class_list_from_class_dirs([str(data)], ['png'], num_threads = num_threads, cache_path = cache_path) == first
+    assert listed == []
+
+    (data / 'a' / '2.png').write_text('')
+    os.utime(data / 'a', ns = (0, os.stat(data / 'a').st_mtime_ns + 10**9))
+    class_list = prs.build_class_list_from_class_dirs([str(data)], ['png'], num_threads = num_threads, cache_path = cache_path)
+    assert listed == [str(data / 'a')]
+    assert class_list == [[str(data / 'a' / '1.png'), str(data / 'a' / '2.png')], first[1]]
+
+    # A different set of file types does not use the manifest
+    listed.clear()
+    prs.build_class_list_from_class_dirs([str(data)], ['jpg'], num_threads = num_threads, cache_path = cache_path)
+    assert len(listed) == 3